@@ -0,0 +1,239 @@
+"""
+summarize many shim databases in parallel.
+
+inputs may be files, directories (searched recursively for .sdb files), glob patterns,
+ or `@path` to read one input per line from a file list.
+one JSON record is written per database as soon as its result is available:
+
+    $python sdb_batch_scan.py --workers 8 C:\\collected\\ > summary.ndjson
+
+a file that fails to parse yields a record with an "error" field, and the scan continues.
+"""
+import os
+import sys
+import glob
+import json
+import logging
+import argparse
+import collections
+import multiprocessing
+import concurrent.futures
+
+import sdb
+from sdb import SDB_TAGS
+from sdb_dump_common import formatGuid
+from sdb_dump_common import getTagNameForTag
+from sdb_dump_common import parse_windows_timestamp
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_batch_scan")
+g_logger.setLevel(logging.INFO)
+
+
+# tags whose occurrences are counted in each summary
+SUMMARY_TAGS = (
+    SDB_TAGS.TAG_EXE,
+    SDB_TAGS.TAG_MATCHING_FILE,
+    SDB_TAGS.TAG_SHIM,
+    SDB_TAGS.TAG_SHIM_REF,
+    SDB_TAGS.TAG_PATCH,
+    SDB_TAGS.TAG_PATCH_REF,
+    SDB_TAGS.TAG_FLAG,
+    SDB_TAGS.TAG_FLAG_REF,
+    SDB_TAGS.TAG_LAYER,
+    SDB_TAGS.TAG_MSI_TRANSFORM,
+    SDB_TAGS.TAG_STRINGTABLE_ITEM,
+)
+
+DEFAULT_CHUNK_SIZE = 0x10
+
+
+def _get_string(db, tag):
+    return db.get_string(db.database_root.get_child(tag).value)
+
+
+def summarize(db):
+    """
+    collect the fields reported by `SdbInfoDumper.dump_info`, and item counts.
+
+    Args:
+      db (sdb.LazySDB): the database.
+
+    Returns:
+      Dict[str, Any]: the summary, with JSON-serializable values.
+    """
+    root = db.database_root
+    summary = collections.OrderedDict()
+
+    try:
+        summary["name"] = _get_string(db, SDB_TAGS.TAG_NAME)
+    except KeyError:
+        summary["name"] = None
+
+    try:
+        summary["database_id"] = formatGuid(root.get_child(SDB_TAGS.TAG_DATABASE_ID).value)
+    except KeyError:
+        summary["database_id"] = None
+
+    try:
+        summary["timestamp"] = parse_windows_timestamp(root.get_child(SDB_TAGS.TAG_TIME).value)
+    except KeyError:
+        summary["timestamp"] = None
+
+    try:
+        summary["compiler_version"] = _get_string(db, SDB_TAGS.TAG_COMPILER_VERSION)
+    except KeyError:
+        summary["compiler_version"] = None
+
+    try:
+        summary["os_platform"] = root.get_child(SDB_TAGS.TAG_OS_PLATFORM).value
+    except KeyError:
+        summary["os_platform"] = None
+
+    items = 0
+    junk = 0
+    tags = collections.Counter()
+    for event in sdb.iter_events(db.buffer):
+        if event.kind == sdb.EVENT_JUNK:
+            junk += event.value
+        elif event.kind != sdb.EVENT_EXIT_LIST:
+            items += 1
+            tags[event.tag] += 1
+
+    counts = collections.OrderedDict()
+    counts["items"] = items
+    counts["junk"] = junk
+    for tag in SUMMARY_TAGS:
+        counts[getTagNameForTag(tag).lower()] = tags[tag]
+    summary["counts"] = counts
+    return summary
+
+
+def scan_file(path):
+    """
+    summarize the database at the given path.
+    failures are reported in the record, rather than raised.
+
+    Returns:
+      Dict[str, Any]: the record for the file.
+    """
+    record = collections.OrderedDict()
+    record["path"] = path
+    try:
+        record["size"] = os.path.getsize(path)
+        with sdb.LazySDB.open(path) as db:
+            record.update(summarize(db))
+    except sdb.InvalidSDBFileError as e:
+        record["error"] = "not an SDB file: %s" % (str(e))
+    except Exception as e:
+        # a corrupt file may fail in any number of ways,
+        #  and one bad file shouldn't abort the scan.
+        record["error"] = "%s: %s" % (e.__class__.__name__, str(e))
+    return record
+
+
+def scan_files(paths):
+    return [scan_file(path) for path in paths]
+
+
+def iter_paths(inputs):
+    """
+    expand the given files, directories, glob patterns, and `@filelist` entries into file paths.
+    """
+    for spec in inputs:
+        if spec.startswith("@"):
+            with open(spec[1:], "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+        elif os.path.isdir(spec):
+            for root, dirs, files in os.walk(spec):
+                dirs.sort()
+                for filename in sorted(files):
+                    if filename.lower().endswith(".sdb"):
+                        yield os.path.join(root, filename)
+        elif os.path.exists(spec):
+            yield spec
+        else:
+            paths = sorted(glob.glob(spec))
+            if not paths:
+                g_logger.warning("no files match: %s", spec)
+            for path in paths:
+                yield path
+
+
+def _iter_chunks(paths, chunk_size):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan(paths, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    summarize the given databases using a pool of worker processes.
+    records are yielded as they complete, so they may be out of order.
+
+    at most a few chunks per worker are outstanding at a time,
+     so arbitrarily long path iterators may be scanned.
+
+    Args:
+      paths (Iterable[str]): the files to scan.
+      workers (int): the number of worker processes, or None for the number of CPUs.
+      chunk_size (int): the number of files given to a worker at a time.
+
+    Yields:
+      Dict[str, Any]: one record per file.
+    """
+    chunks = _iter_chunks(paths, chunk_size)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        max_pending = 4 * (workers or multiprocessing.cpu_count())
+        pending = set()
+        while True:
+            for chunk in chunks:
+                pending.add(executor.submit(scan_files, chunk))
+                if len(pending) >= max_pending:
+                    break
+
+            if not pending:
+                break
+
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                for record in future.result():
+                    yield record
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Summarize shim databases as NDJSON.")
+    parser.add_argument("inputs", nargs="+",
+                        help="files, directories, glob patterns, or @filelist")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="number of files given to a worker at a time")
+    args = parser.parse_args(args)
+
+    ret = 0
+    for record in scan(iter_paths(args.inputs), workers=args.workers, chunk_size=args.chunk_size):
+        if "error" in record:
+            g_logger.error("%s: %s", record["path"], record["error"])
+            ret = -1
+        sys.stdout.write(json.dumps(record))
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+    return ret
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
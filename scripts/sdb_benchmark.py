@@ -0,0 +1,260 @@
+"""
+time, and profile the memory use of, the parsers and dumpers against synthetic databases:
+
+    $python sdb_benchmark.py --exes 100,10000,100000 > results.json
+    $python sdb_benchmark.py --exes 100,10000,100000 --baseline results.json
+
+the results are written as JSON, one record per benchmark and database size.
+with `--baseline`, each record also has the ratio of its time to that of the
+ matching record of an earlier run, so regressions between commits stand out.
+"""
+import io
+import sys
+import json
+import timeit
+import logging
+import argparse
+import platform
+import collections
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2.x
+    tracemalloc = None
+
+import sdb
+from sdb import generate_sdb
+from sdb_dump_common import SdbIndex
+from sdb_dump_common import SdbRenderer
+from sdb_dump_common import BufferedOutput
+from sdb_dump_raw import dump as dump_raw
+from sdb_dump_database import SdbDatabaseDumper
+from sdb_dump_shims import SdbShimDumper
+from sdb_dump_info import SdbInfoDumper
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_benchmark")
+g_logger.setLevel(logging.INFO)
+# the dumpers log their progress, and the parsers log each junk byte
+for name in ("sdb", "sdb_dump_info", "sdb_dump_database"):
+    logging.getLogger(name).setLevel(logging.ERROR)
+
+
+def consume(lines):
+    collections.deque(lines, maxlen=0)
+
+
+def parse_vstruct(buf):
+    s = sdb.SDB()
+    s.vsParse(bytearray(buf))
+    return s
+
+
+def get_patch_bits(buf):
+    db = sdb.parse_sdb(buf)
+    return [bytes(bytearray(n.value)) for n in sdb.query(db, "DATABASE//PATCH/PATCH_BITS")]
+
+
+def parse_patch_bits(payloads):
+    """
+    parse PATCHBITS records until each payload is exhausted, like `sdb_dump_patch.py`.
+    """
+    for bits in payloads:
+        offset = 0
+        while offset < len(bits):
+            p = sdb.PATCHBITS()
+            try:
+                offset = p.vsParse(bits, offset=offset)
+            except Exception:
+                break
+
+
+# the inputs that benchmarks are run against, computed once per database
+FIXTURES = {
+    "buffer": lambda buf: buf,
+    "vstruct": parse_vstruct,
+    "lazy": sdb.LazySDB,
+    "patch_bits": get_patch_bits,
+}
+
+
+class _NullStream(object):
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def render_events(buf, format):
+    with BufferedOutput(_NullStream()) as output:
+        SdbRenderer(output, format=format).render(sdb.iter_events(buf))
+
+
+def render_database(db, format):
+    with BufferedOutput(_NullStream()) as output:
+        SdbDatabaseDumper(db).render(output, format=format)
+
+
+def _index_sdb(db):
+    SdbIndex().index_sdb(db)
+
+
+# name, fixture, and function to time
+BENCHMARKS = [
+    ("SDB.vsParse", "buffer", parse_vstruct),
+    ("parse_sdb", "buffer", sdb.parse_sdb),
+    ("parse_sdb[stats]", "buffer", lambda buf: sdb.parse_sdb(buf, stats=sdb.ParseStats())),
+    ("parse_sdb[exclude]", "buffer", lambda buf: sdb.parse_sdb(buf, exclude=["INDEXES", "PATCH_BITS"])),
+    ("SDBNodeStore", "buffer", sdb.SDBNodeStore),
+    ("iter_events", "buffer", lambda buf: consume(sdb.iter_events(buf))),
+    ("SdbIndex.index_sdb", "vstruct", _index_sdb),
+    ("sdb_dump_raw.dump", "vstruct", lambda db: consume(dump_raw(db))),
+    ("SdbRenderer[xml]", "buffer", lambda buf: render_events(buf, "xml")),
+    ("SdbRenderer[json]", "buffer", lambda buf: render_events(buf, "json")),
+    ("SdbRenderer[ndjson]", "buffer", lambda buf: render_events(buf, "ndjson")),
+    ("SdbDatabaseDumper.dump", "vstruct", lambda db: consume(SdbDatabaseDumper(db).dump())),
+    ("SdbDatabaseDumper.render[lazy]", "lazy", lambda db: render_database(db, "xml")),
+    ("SdbShimDumper.dump_database", "vstruct", lambda db: consume(SdbShimDumper(db).dump_database())),
+    ("SdbInfoDumper.dump_info", "vstruct", lambda db: consume(SdbInfoDumper(db).dump_info())),
+    ("PATCHBITS", "patch_bits", parse_patch_bits),
+]
+
+
+def measure(f, arg, repeat=3, memory=True):
+    """
+    Returns:
+      Tuple[float, Optional[int]]: the fastest time, in seconds, and the peak memory
+        allocated during a separate run, in bytes (or None when not measured).
+    """
+    best = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        f(arg)
+        elapsed = timeit.default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    peak = None
+    if memory and tracemalloc is not None:
+        # tracing slows everything down, so it's not done while timing
+        tracemalloc.start()
+        try:
+            f(arg)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(sizes, shape, names=None, repeat=3, memory=True):
+    """
+    Args:
+      sizes (List[int]): the numbers of EXEs of the databases to generate.
+      shape (Dict[str, int]): the other parameters of `sdb.synthetic.SyntheticSDBGenerator`.
+      names (List[str]): the names of the benchmarks to run, or None for all of them.
+
+    Yields:
+      Dict[str, Any]: the result of each benchmark, for each size.
+    """
+    for exes in sizes:
+        f = io.BytesIO()
+        size = generate_sdb(f, exes=exes, **shape)
+        buf = f.getvalue()
+        g_logger.info("generated database with %d EXEs: %d bytes", exes, size)
+
+        fixtures = {}
+        for name, fixture, func in BENCHMARKS:
+            if names is not None and name not in names:
+                continue
+            if fixture not in fixtures:
+                fixtures[fixture] = FIXTURES[fixture](buf)
+
+            seconds, peak = measure(func, fixtures[fixture], repeat=repeat, memory=memory)
+            g_logger.info("%s: %d EXEs: %.3fs", name, exes, seconds)
+            yield collections.OrderedDict([
+                ("benchmark", name),
+                ("exes", exes),
+                ("file_size", size),
+                ("seconds", seconds),
+                ("peak_memory", peak),
+            ])
+
+
+def compare(results, baseline):
+    """
+    annotate the results with the ratio of their times to those of the baseline.
+    """
+    previous = {}
+    for r in baseline["results"]:
+        previous[(r["benchmark"], r["exes"])] = r
+    for r in results:
+        b = previous.get((r["benchmark"], r["exes"]))
+        if b is None or not b["seconds"]:
+            continue
+        r["baseline_seconds"] = b["seconds"]
+        r["ratio"] = r["seconds"] / b["seconds"]
+
+
+def _parse_list(s):
+    return [int(v, 0) for v in s.split(",")]
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Benchmark the parsers and dumpers against synthetic databases.")
+    parser.add_argument("--exes", type=_parse_list, default=[100, 1000, 10000],
+                        help="comma-separated numbers of EXEs of the databases to generate")
+    parser.add_argument("--matching-files", type=int, default=2, help="MATCHING_FILEs per EXE")
+    parser.add_argument("--strings", type=int, default=0, help="extra strings in the string table")
+    parser.add_argument("--patch-size", type=lambda s: int(s, 0), default=0x100,
+                        help="size of each PATCH_BITS payload")
+    parser.add_argument("--junk", type=int, default=0, help="junk bytes to inject")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    parser.add_argument("--benchmark", action="append", dest="benchmarks",
+                        help="name of a benchmark to run (default: all); may be repeated")
+    parser.add_argument("--repeat", type=int, default=3, help="runs to take the fastest time of")
+    parser.add_argument("--no-memory", action="store_true", help="don't measure peak memory")
+    parser.add_argument("--baseline", help="path to the JSON results of an earlier run, to compare against")
+    args = parser.parse_args(args)
+
+    known = set(name for name, _, _ in BENCHMARKS)
+    for name in args.benchmarks or []:
+        if name not in known:
+            g_logger.error("unknown benchmark: %s (choose from: %s)", name, ", ".join(sorted(known)))
+            return -1
+
+    shape = {
+        "matching_files": args.matching_files,
+        "strings": args.strings,
+        "patch_size": args.patch_size,
+        "junk": args.junk,
+        "seed": args.seed,
+    }
+    results = list(run_benchmarks(args.exes, shape, names=args.benchmarks,
+                                  repeat=args.repeat, memory=not args.no_memory))
+
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            baseline = json.loads(f.read().decode("utf-8"))
+        if baseline.get("shape") != shape:
+            g_logger.warning("the baseline databases have a different shape: %s", baseline.get("shape"))
+        compare(results, baseline)
+
+    doc = collections.OrderedDict([
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("shape", shape),
+        ("results", results),
+    ])
+    sys.stdout.write(json.dumps(doc, indent=2))
+    sys.stdout.write("\n")
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import sys
+import logging
+
+import sdb
+from sdb import SDB_TAG_TYPES
+from sdb_dump_common import isBadItem
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_compare_engines")
+g_logger.setLevel(logging.INFO)
+
+
+def _vstruct_value(item):
+    m = (item.header.valuetype & 0xF0) << 8
+    v = item.value
+    if m == SDB_TAG_TYPES.TAG_TYPE_LIST or m == SDB_TAG_TYPES.TAG_TYPE_NULL:
+        return None
+    elif m == SDB_TAG_TYPES.TAG_TYPE_STRINGREF:
+        return v.reference
+    elif m == SDB_TAG_TYPES.TAG_TYPE_BINARY:
+        return bytes(v.value)
+    else:
+        return v.value
+
+
+def _node_value(node):
+    if node.type == SDB_TAG_TYPES.TAG_TYPE_BINARY:
+        return node.value.tobytes()
+    return node.value
+
+
+def compare_items(item, node, offset, junk):
+    """
+    compare a vstruct `SDBItem` against the equivalent `SDBNode`.
+
+    the vstruct tree doesn't know the offsets of its items, so we track them here.
+    note that we can't use `len(item)`, as it accounts for padding that `vsParse` doesn't consume.
+
+    Args:
+      item (sdb.SDBItem): the item parsed by `SDB.vsParse`.
+      node (sdb.SDBNode): the item parsed by the fast engine.
+      offset (int): the offset of `item`.
+      junk (List[Tuple[int, int]]): collects the (offset, length) of runs of junk bytes in the vstruct tree.
+
+    Returns:
+      Tuple[List[str], int]: descriptions of the differences, and the offset following the item.
+    """
+    if isBadItem(item):
+        raise RuntimeError("cannot compare junk item")
+
+    errors = []
+    if item.header.tag != node.tag:
+        errors.append("0x%x: tag mismatch: 0x%x != 0x%x" % (offset, item.header.tag, node.tag))
+        return errors, offset + node.length
+    if offset != node.offset:
+        errors.append("0x%x: offset mismatch: 0x%x" % (offset, node.offset))
+    if _vstruct_value(item) != _node_value(node):
+        errors.append("0x%x: value mismatch: %r != %r" % (offset, _vstruct_value(item), _node_value(node)))
+
+    start = offset
+    if item.value.vsHasField("children"):
+        offset += 6
+        children = [c for _, c in item.value.children]
+        good_children = []
+        for c in children:
+            if isBadItem(c):
+                junk.append((offset, len(c)))
+                offset += len(c)
+                continue
+            good_children.append((offset, c))
+            offset += _consumed(c)
+
+        if len(good_children) != len(node.children):
+            errors.append("0x%x: child count mismatch: %d != %d" %
+                          (start, len(good_children), len(node.children)))
+        for (child_offset, c), n in zip(good_children, node.children):
+            child_errors, _ = compare_items(c, n, child_offset, junk)
+            errors.extend(child_errors)
+    else:
+        offset += _consumed(item)
+
+    if offset - start != node.length:
+        errors.append("0x%x: length mismatch: 0x%x != 0x%x" % (start, offset - start, node.length))
+    return errors, start + node.length
+
+
+def _consumed(item):
+    """
+    the number of bytes consumed by `vsParse` for the given item.
+    """
+    if isBadItem(item):
+        return len(item)
+    v = item.value
+    if v.vsHasField("children"):
+        return 6 + sum(_consumed(c) for _, c in v.children)
+    elif v.vsHasField("size"):
+        return 6 + v.size
+    else:
+        return 2 + len(v)
+
+
+def compare(buf):
+    """
+    parse the given buffer with both engines and describe any differences.
+    """
+    vs = sdb.SDB()
+    vs.vsParse(bytearray(buf))
+    fast = sdb.parse_sdb(buf)
+
+    errors = []
+    junk = []
+    offset = len(vs.header)
+    for name in ("indexes_root", "database_root", "strtab_root"):
+        root_errors, offset = compare_items(vs[name], getattr(fast, name), offset, junk)
+        errors.extend(root_errors)
+
+    if junk != [tuple(run) for run in fast.junk]:
+        errors.append("junk mismatch: %s != %s" % (junk, fast.junk))
+    return errors
+
+
+def _main(*sdb_paths):
+    ret = 0
+    for sdb_path in sdb_paths:
+        with open(sdb_path, "rb") as f:
+            buf = f.read()
+
+        try:
+            errors = compare(buf)
+        except sdb.InvalidSDBFileError:
+            g_logger.error("not an SDB file: %s" % (sdb_path))
+            ret = -1
+            continue
+
+        if errors:
+            ret = -1
+            for e in errors:
+                g_logger.error("%s: %s", sdb_path, e)
+        else:
+            g_logger.info("%s: OK", sdb_path)
+    return ret
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
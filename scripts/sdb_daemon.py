@@ -0,0 +1,387 @@
+"""
+serve lookups, queries, and dumps against shim databases that stay parsed in memory:
+
+    $python sdb_daemon.py --socket /tmp/sdb.sock sysmain.sdb drvmain.sdb
+    $echo '{"op": "lookup", "name": "calc.exe"}' | nc -U /tmp/sdb.sock
+
+each request is a line of JSON, and each response is a line of JSON, in order,
+ on the same connection. a response has `"ok": true` and a `"result"`, or
+ `"ok": false` and an `"error"`. an `"id"` given in a request is echoed.
+
+requests:
+
+  - `{"op": "status"}`: the databases being served, and request counters.
+  - `{"op": "lookup", "name": "calc.exe"}`: the EXEs whose NAME matches the file name.
+     with `"attributes"` (and optionally `"files"`), only those that match the file;
+     see `sdb.SDBMatcher.match`.
+  - `{"op": "query", "query": "DATABASE/EXE/NAME"}`: the items selected by a path query;
+     see `sdb.query`.
+  - `{"op": "dump", "db": "sysmain.sdb", "offset": 4232}`: the item at the given offset
+     (by default, the DATABASE root) and its descendants, up to `"depth"` levels.
+  - `{"op": "reload", "db": "sysmain.sdb"}`: re-read the database now.
+
+lookups and queries apply to every database unless `"db"` names one, and
+ return at most `"limit"` items.
+
+files are polled for changes every `--interval` seconds. changed files are
+ re-parsed on a background thread, and swapped in once ready, so requests
+ are answered from the previous version in the meantime.
+
+this script requires python 3.4 or later.
+"""
+import os
+import sys
+import stat
+import json
+import timeit
+import asyncio
+import logging
+import argparse
+import collections
+
+import sdb
+from sdb import SDB_TAGS
+from sdb import SDBRegistry
+from sdb_query import formatNode
+from sdb_dump_common import formatGuid
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_daemon")
+g_logger.setLevel(logging.INFO)
+
+
+DEFAULT_INTERVAL = 2.0
+DEFAULT_LIMIT = 1000
+# requests larger than this close the connection, rather than buffering without bound
+MAX_REQUEST_SIZE = 0x100000
+
+
+class RequestError(Exception):
+    """
+    a request that can't be answered, reported to the client.
+    """
+    pass
+
+
+def _get_child_string(snapshot, node, tag):
+    try:
+        return snapshot.get_string(node.get_child(tag).value)
+    except KeyError:
+        return None
+
+
+def _get_ref_names(snapshot, exe, tag):
+    return [_get_child_string(snapshot, ref, SDB_TAGS.TAG_NAME) for ref in exe.get_children(tag)]
+
+
+def summarize_exe(name, snapshot, exe):
+    summary = collections.OrderedDict()
+    summary["db"] = name
+    summary["offset"] = exe.offset
+    summary["name"] = _get_child_string(snapshot, exe, SDB_TAGS.TAG_NAME)
+    summary["app_name"] = _get_child_string(snapshot, exe, SDB_TAGS.TAG_APP_NAME)
+    summary["vendor"] = _get_child_string(snapshot, exe, SDB_TAGS.TAG_VENDOR)
+    try:
+        summary["exe_id"] = formatGuid(exe.get_child(SDB_TAGS.TAG_EXE_ID).value)
+    except KeyError:
+        summary["exe_id"] = None
+    summary["shims"] = _get_ref_names(snapshot, exe, SDB_TAGS.TAG_SHIM_REF)
+    summary["flags"] = _get_ref_names(snapshot, exe, SDB_TAGS.TAG_FLAG_REF)
+    summary["patches"] = _get_ref_names(snapshot, exe, SDB_TAGS.TAG_PATCH_REF)
+    summary["layers"] = _get_ref_names(snapshot, exe, SDB_TAGS.TAG_LAYER)
+    return summary
+
+
+def _dump_node(snapshot, node, depth, indent=u""):
+    yield indent + formatNode(snapshot, node)
+    if node.children is None:
+        return
+    if depth == 0:
+        if node.children:
+            yield indent + u"  ..."
+        return
+    for c in node.children:
+        for l in _dump_node(snapshot, c, depth - 1, indent + u"  "):
+            yield l
+
+
+class SdbDaemon(object):
+    def __init__(self, registry, interval=DEFAULT_INTERVAL, loop=None):
+        self.registry = registry
+        self.interval = interval
+        self.loop = loop or asyncio.get_event_loop()
+        # names of the databases being reloaded in the background
+        self._reloading = set()
+        # map from op to (number of requests, total seconds)
+        self.counters = collections.OrderedDict()
+        self.handlers = {
+            "status": self.handle_status,
+            "lookup": self.handle_lookup,
+            "query": self.handle_query,
+            "dump": self.handle_dump,
+            "reload": self.handle_reload,
+        }
+
+    def _get_names(self, request):
+        name = request.get("db")
+        if name is None:
+            return self.registry.names()
+        if name not in self.registry:
+            raise RequestError("unknown database: %s" % (name))
+        return [name]
+
+    def _get_limit(self, request):
+        limit = request.get("limit", DEFAULT_LIMIT)
+        if not isinstance(limit, int) or limit < 0:
+            raise RequestError("invalid limit: %r" % (limit, ))
+        return limit
+
+    def handle_status(self, request):
+        databases = []
+        for name in self.registry.names():
+            snapshot = self.registry.get(name)
+            d = collections.OrderedDict()
+            d["name"] = name
+            d["path"] = snapshot.path
+            d["size"] = snapshot.size
+            d["sha256"] = snapshot.digest
+            d["loaded"] = snapshot.loaded
+            d["reloading"] = name in self._reloading
+            d["error"] = self.registry.errors.get(name)
+            databases.append(d)
+
+        requests = collections.OrderedDict()
+        for op, (count, seconds) in self.counters.items():
+            requests[op] = collections.OrderedDict([
+                ("count", count),
+                ("mean_ms", 1000.0 * seconds / count),
+            ])
+        return collections.OrderedDict([("databases", databases), ("requests", requests)])
+
+    def handle_lookup(self, request):
+        path = request.get("name")
+        if not path:
+            raise RequestError("missing name")
+        attributes = request.get("attributes")
+        files = request.get("files")
+        limit = self._get_limit(request)
+
+        results = []
+        for name in self._get_names(request):
+            snapshot = self.registry.get(name)
+            if attributes is None:
+                exes = snapshot.matcher.candidates(path)
+            else:
+                try:
+                    exes = snapshot.matcher.match(path, attributes, files=files)
+                except ValueError as e:
+                    raise RequestError(str(e))
+            for exe in exes:
+                if len(results) >= limit:
+                    return results
+                results.append(summarize_exe(name, snapshot, exe))
+        return results
+
+    def handle_query(self, request):
+        text = request.get("query")
+        if not text:
+            raise RequestError("missing query")
+        try:
+            q = sdb.compile_query(text)
+        except sdb.InvalidQueryError as e:
+            raise RequestError("invalid query: %s" % (e))
+        limit = self._get_limit(request)
+
+        results = []
+        for name in self._get_names(request):
+            snapshot = self.registry.get(name)
+            for node in q.evaluate(snapshot.db, strings=snapshot.strings):
+                if len(results) >= limit:
+                    return results
+                results.append(collections.OrderedDict([
+                    ("db", name),
+                    ("offset", node.offset),
+                    ("item", formatNode(snapshot, node)),
+                ]))
+        return results
+
+    def handle_dump(self, request):
+        if request.get("db") is None:
+            raise RequestError("missing db")
+        name = self._get_names(request)[0]
+        snapshot = self.registry.get(name)
+
+        depth = request.get("depth", -1)
+        if not isinstance(depth, int):
+            raise RequestError("invalid depth: %r" % (depth, ))
+        offset = request.get("offset")
+        if offset is None:
+            node = snapshot.db.database_root
+        else:
+            try:
+                node = snapshot.db.item_at(offset)
+            except (TypeError, ValueError, IndexError, sdb.InvalidSDBFileError):
+                raise RequestError("no item at offset: %r" % (offset, ))
+        return list(_dump_node(snapshot, node, depth))
+
+    def handle_reload(self, request):
+        if request.get("db") is None:
+            raise RequestError("missing db")
+        name = self._get_names(request)[0]
+        self.schedule_reload(name)
+        return collections.OrderedDict([("reloading", name in self._reloading)])
+
+    def handle(self, request):
+        """
+        Returns:
+          Dict[str, Any]: the response to the given request.
+        """
+        response = collections.OrderedDict()
+        if not isinstance(request, dict):
+            response["ok"] = False
+            response["error"] = "request must be an object"
+            return response
+        if "id" in request:
+            response["id"] = request["id"]
+
+        op = request.get("op")
+        handler = self.handlers.get(op)
+        if handler is None:
+            response["ok"] = False
+            response["error"] = "unknown op: %s" % (op)
+            return response
+
+        start = timeit.default_timer()
+        try:
+            response["result"] = handler(request)
+            response["ok"] = True
+        except RequestError as e:
+            response["ok"] = False
+            response["error"] = str(e)
+        except Exception as e:
+            g_logger.exception("failed to handle request: %r", request)
+            response["ok"] = False
+            response["error"] = "%s: %s" % (e.__class__.__name__, str(e))
+        count, seconds = self.counters.get(op, (0, 0.0))
+        self.counters[op] = (count + 1, seconds + timeit.default_timer() - start)
+        return response
+
+    def handle_line(self, line):
+        """
+        Returns:
+          bytes: the encoded response to the given encoded request.
+        """
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError as e:
+            response = {"ok": False, "error": "invalid request: %s" % (e)}
+        else:
+            response = self.handle(request)
+        return json.dumps(response).encode("utf-8") + b"\n"
+
+    def schedule_reload(self, name):
+        """
+        re-read the named database on a background thread, unless it's already being reloaded.
+        """
+        if name in self._reloading:
+            return
+        self._reloading.add(name)
+        future = self.loop.run_in_executor(None, self.registry.reload, name)
+        future.add_done_callback(lambda f: self._reloading.discard(name))
+
+    def poll(self):
+        for name in self.registry.stale():
+            self.schedule_reload(name)
+        self.loop.call_later(self.interval, self.poll)
+
+    def start(self):
+        if self.interval > 0:
+            self.loop.call_later(self.interval, self.poll)
+
+
+class SdbProtocol(asyncio.Protocol):
+    """
+    a connection, on which requests are answered in the order they arrive.
+    """
+    def __init__(self, daemon):
+        self._daemon = daemon
+        self._transport = None
+        self._pending = b""
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        self._pending += data
+        while True:
+            line, sep, rest = self._pending.partition(b"\n")
+            if not sep:
+                break
+            self._pending = rest
+            if line.strip():
+                self._transport.write(self._daemon.handle_line(line))
+
+        if len(self._pending) > MAX_REQUEST_SIZE:
+            g_logger.warning("request too large, closing connection")
+            self._transport.close()
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Serve lookups against shim databases kept parsed in memory.")
+    parser.add_argument("sdb_paths", nargs="+", help="paths to the shim databases")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--socket", help="path of the unix socket to listen on")
+    group.add_argument("--port", type=int, help="localhost TCP port to listen on")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="seconds between checks for changed files (0 disables)")
+    args = parser.parse_args(args)
+
+    registry = SDBRegistry()
+    for path in args.sdb_paths:
+        try:
+            registry.add(path)
+        except sdb.InvalidSDBFileError:
+            g_logger.error("not an SDB file: %s" % (path))
+            return -1
+        except (IOError, OSError, ValueError) as e:
+            g_logger.error("failed to load %s: %s" % (path, e))
+            return -1
+
+    if args.socket and os.path.lexists(args.socket):
+        # a stale socket from an earlier run is replaced, but nothing else is
+        if not stat.S_ISSOCK(os.lstat(args.socket).st_mode):
+            g_logger.error("not a socket, refusing to replace: %s" % (args.socket))
+            return -1
+        os.remove(args.socket)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    daemon = SdbDaemon(registry, interval=args.interval, loop=loop)
+    factory = lambda: SdbProtocol(daemon)
+    if args.socket:
+        server = loop.run_until_complete(loop.create_unix_server(factory, path=args.socket))
+        g_logger.info("listening on %s", args.socket)
+    else:
+        server = loop.run_until_complete(loop.create_server(factory, host="127.0.0.1", port=args.port))
+        g_logger.info("listening on 127.0.0.1:%d", args.port)
+
+    daemon.start()
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import logging
+
+import sdb
+from sdb import SDB_TAG_TYPES
+from sdb_dump_common import formatTagValue
+from sdb_dump_common import BufferedOutput
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_diff")
+g_logger.setLevel(logging.INFO)
+
+
+CHANGE_MARKERS = {
+    sdb.CHANGE_ADDED: "+",
+    sdb.CHANGE_REMOVED: "-",
+    sdb.CHANGE_MODIFIED: "~",
+}
+
+
+def formatNodeValue(hasher, node):
+    if node.children is not None:
+        return None
+    if node.tag & 0xF000 == SDB_TAG_TYPES.TAG_TYPE_STRINGREF:
+        value = hasher.get_value(node)
+        if value is None:
+            return "UNRESOLVED_STRINGREF:" + hex(node.value)
+        return u"'%s'" % (value)
+    return formatTagValue(node.tag, node.value)
+
+
+def format_changes(diff):
+    for change in diff:
+        marker = CHANGE_MARKERS[change.kind]
+        if change.kind == sdb.CHANGE_MODIFIED:
+            yield u"{marker:s} {path:s}: {old:s} -> {new:s}".format(
+                marker=marker,
+                path=change.path,
+                old=formatNodeValue(diff.old, change.old),
+                new=formatNodeValue(diff.new, change.new))
+        else:
+            if change.kind == sdb.CHANGE_ADDED:
+                value = formatNodeValue(diff.new, change.new)
+            else:
+                value = formatNodeValue(diff.old, change.old)
+
+            if value is None:
+                yield u"{marker:s} {path:s}".format(marker=marker, path=change.path)
+            else:
+                yield u"{marker:s} {path:s}: {value:s}".format(marker=marker, path=change.path, value=value)
+
+
+def _main(old_path, new_path):
+    dbs = []
+    for sdb_path in (old_path, new_path):
+        with open(sdb_path, "rb") as f:
+            buf = f.read()
+
+        try:
+            dbs.append(sdb.parse_sdb(buf))
+        except sdb.InvalidSDBFileError:
+            g_logger.error("not an SDB file: %s" % (sdb_path))
+            return -1
+
+    old_db, new_db = dbs
+    with BufferedOutput() as output:
+        output.write_lines(format_changes(sdb.SDBDiff(old_db, new_db)))
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
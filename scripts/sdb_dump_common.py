@@ -1,21 +1,46 @@
+import sys
+import json
 import base64
 import logging
 import binascii
 import string
 import xml.sax.saxutils
+from datetime import datetime
 
+from sdb import SDB
+from sdb import SDBItem
+from sdb import SDBStringTable
+from sdb import SDBTagIdResolver
 from sdb import SDB_TAGS
 from sdb import SDB_TAG_TYPES
+from sdb import get_tag_name
+from sdb import format_guid
+from sdb import EVENT_LEAF
+from sdb import EVENT_ENTER_LIST
+from sdb import EVENT_EXIT_LIST
 
 g_logger = logging.getLogger("sdb_dump_common")
 g_logger.setLevel(logging.DEBUG)
 
 
 def getTagName(header):
-    tagname = SDB_TAGS.vsReverseMapping(header.tag)
-    if tagname is None:
-        return "UNKNOWN_%s" % (hex(header.tag & 0xFFFF))
-    tagname = str(tagname.partition("TAG_")[2])
+    return getTagNameForTag(header.tag)
+
+
+# map from tag to its name, filled in as tags are seen
+_TAG_NAMES = {}
+
+
+def getTagNameForTag(tag):
+    try:
+        return _TAG_NAMES[tag]
+    except KeyError:
+        tagname = _TAG_NAMES[tag] = _formatTagName(tag)
+        return tagname
+
+
+def _formatTagName(tag):
+    tagname = get_tag_name(tag)
 
     # valid XML cannot begin with a digit
     if tagname[0] in string.digits:
@@ -25,42 +50,68 @@ def getTagName(header):
 
 
 def formatGuid(h):
-    return "%02x%02x%02x%02x-%02x%02x-%02x%02x-%02x%02x-%02x%02x%02x%02x%02x%02x" % \
-        (h[3], h[2], h[1], h[0],
-        h[5], h[4],
-        h[7], h[6],
-        h[8], h[9],
-        h[10], h[11], h[12], h[13], h[14], h[15])
+    return format_guid(h)
 
 
-def formatValue(item):
+def parse_windows_timestamp(i):
+    return datetime.utcfromtimestamp(float(i) * 1e-7 - 11644473600).isoformat("T")
+
+
+def getItemValue(item):
+    """
+    fetch the decoded value of a vstruct item, in the form used by `SDBNode.value`.
+    """
     m = (item.header.valuetype & 0xF0) << 8
     if m == SDB_TAG_TYPES.TAG_TYPE_LIST:
         raise RuntimeError("cannot format complex TAG_TYPE_LIST")
     elif m == SDB_TAG_TYPES.TAG_TYPE_STRINGREF:
-        return hex(item.value.reference)
+        return item.value.reference
+    elif m == SDB_TAG_TYPES.TAG_TYPE_NULL:
+        return None
+    else:
+        return item.value.value
+
+
+def formatValue(item):
+    return formatTagValue(item.header.tag, getItemValue(item))
+
+
+def formatTagValue(tag, value):
+    """
+    format the decoded value of an item with the given tag,
+     such as `SDBNode.value` or `SDBEvent.value`.
+    """
+    m = tag & 0xF000
+    if m == SDB_TAG_TYPES.TAG_TYPE_LIST:
+        raise RuntimeError("cannot format complex TAG_TYPE_LIST")
+    elif m == SDB_TAG_TYPES.TAG_TYPE_STRINGREF:
+        return hex(value)
     elif m == SDB_TAG_TYPES.TAG_TYPE_DWORD:
-        return hex(item.value.value)
+        return hex(value)
     elif m == SDB_TAG_TYPES.TAG_TYPE_STRING:
-        return xml.sax.saxutils.escape(item.value.value)
+        return xml.sax.saxutils.escape(value)
     elif m == SDB_TAG_TYPES.TAG_TYPE_NULL:
         return ""
     elif m == SDB_TAG_TYPES.TAG_TYPE_QWORD:
-        return hex(item.value.value).rstrip("L")
+        return hex(value).rstrip("L")
     elif m == SDB_TAG_TYPES.TAG_TYPE_WORD:
-        return hex(item.value.value)
+        return hex(value)
     elif m == SDB_TAG_TYPES.TAG_TYPE_BINARY:
         # we're just guessing here ;-)
-        if item.value.size == 0x10 and getTagName(item.header).endswith("_ID"):
-            return formatGuid(item.value.value)
+        if len(value) == 0x10 and getTagNameForTag(tag).endswith("_ID"):
+            return formatGuid(value)
         else:
-            return str(binascii.hexlify(item.value.value))
+            return binascii.hexlify(value).decode("ascii")
     else:
-        raise RuntimeError("cannot format unknown value type: 0x%x", item.header.valuetype)
+        raise RuntimeError("cannot format unknown value type: 0x%x", tag >> 8)
 
 
 def formatValueType(item):
-    m = (item.header.valuetype & 0xF0) << 8
+    return formatTagValueType(item.header.tag)
+
+
+def formatTagValueType(tag):
+    m = tag & 0xF000
     if m == SDB_TAG_TYPES.TAG_TYPE_LIST:
         raise RuntimeError("cannot format complex TAG_TYPE_LIST")
     elif m == SDB_TAG_TYPES.TAG_TYPE_STRINGREF:
@@ -76,13 +127,12 @@ def formatValueType(item):
     elif m == SDB_TAG_TYPES.TAG_TYPE_WORD:
         return "integer"
     elif m == SDB_TAG_TYPES.TAG_TYPE_BINARY:
-        tag = (item.header.valuetype << 8) | item.header.tagtype
         if tag == SDB_TAGS.TAG_DATABASE_ID:
             return "guid"
         else:
             return "hex"
     else:
-        raise RuntimeError("cannot format unknown value type: 0x%x", item.header.valuetype)
+        raise RuntimeError("cannot format unknown value type: 0x%x", tag >> 8)
 
 
 def isBadItem(item):
@@ -91,64 +141,345 @@ def isBadItem(item):
 
 class SdbIndex(object):
     def __init__(self):
-        self._itemindex = {}  # type: Mapping[int, SdbItem]
-        self._strindex = {}  # type: Mapping[int, str]
+        self._refindex = None  # type: SDBTagIdResolver
+        self._strindex = None  # type: SDBStringTable
 
     def index_sdb(self, db):
-        o = len(db.header)
-        indexes_root = db.indexes_root
-        self._itemindex_item(o, indexes_root)
-        o += len(indexes_root)
-
-        database_root = db.database_root
-        self._itemindex_item(o, database_root)
-        o += len(database_root)
-
-        strtab_root = db.strtab_root
-        self._itemindex_item(o, strtab_root)
-        o += len(strtab_root)
-
-        # len(strtab) - len(strtab value) == 6
-        # 01 78 ?? ?? ?? ?? (children_size:uint32)
-        offset = 0x6
-        for fieldname, field in db.strtab_root.value.children.vsGetFields():
-            if isBadItem(field):
-                offset += len(field)
-                continue
-            self._strindex[offset] = field.value.value
-            offset += len(field)
-
-    def _itemindex_item(self, offset, item):
-        value = item.value
-
-        # some items may have the same starting offset, so we take the first one
-        # eg. given an item array, and the first item in the array, we want the array
-        if offset not in self._itemindex:
-            self._itemindex[offset] = item
-
-        if value.vsHasField("children"):
-            offset += value.vsGetOffset("children")
-            children = value.children
-            self._itemindex[offset] = children
-            for child_id, child in children:
-                if isBadItem(child):
-                    offset += len(child)
-                    continue
-                # you might be tempted to use vsGetOffset(child_id)... don't.
-                # internally it has to iterate all fields and do a __len__ on them,
-                #   so this ends up taking quadratic time.
-                # instead, we track the offset ourselves.
-                self._itemindex_item(offset, child)
-                offset += len(child)
+        self._refindex = SDBTagIdResolver.from_db(db)
+        if isinstance(db, SDB):
+            self._strindex = SDBStringTable.from_vstruct(db.strtab_root)
+        else:
+            # parsed by the fast, lazy, or columnar engines
+            self.index_strings(db)
+
+    def index_cached(self, entry):
+        """
+        use the indexes loaded with a `sdb.CachedSDB`, rather than building them.
+        """
+        self._refindex = entry.references
+        self._strindex = entry.strings
+
+    def index_strings(self, db):
+        """
+        index just the string table of a database parsed by the fast,
+         lazy, or columnar engines. no strings are decoded up front.
+        """
+        self._strindex = SDBStringTable.from_buffer(db.buffer, db.strtab_root.offset)
 
     def get_item(self, offset):
-        return self._itemindex[offset]
+        """
+        fetch the item referenced by a *_TAGID value: a SHIM, PATCH, FLAG, LAYER, or MSI_TRANSFORM.
+        """
+        return self._refindex.get_item(offset)
+
+    def resolve_reference(self, ref_tag, tagid):
+        """
+        fetch the item referenced by a *_TAGID item with the given tag and value.
+
+        Raises:
+          KeyError: if the reference is dangling.
+        """
+        return self._refindex.resolve(ref_tag, tagid)
 
     def get_string(self, offset):
-        return xml.sax.saxutils.escape(self._strindex[offset])
+        """
+        fetch the XML-escaped string at the given string table offset.
+        """
+        return self._strindex.get_escaped(offset)
+
+    def get_raw_string(self, offset):
+        """
+        fetch the unescaped string at the given string table offset.
+        """
+        return self._strindex.get(offset)
+
+
+def print_stats(stats):
+    """
+    write the report of a `sdb.ParseStats` to stderr, out of the way of the dump.
+    """
+    for l in stats.format():
+        sys.stderr.write(l)
+        sys.stderr.write("\n")
+
+
+# the output formats of `SdbRenderer`
+OUTPUT_FORMATS = ("xml", "json", "ndjson")
+
+# the number of characters collected by `BufferedOutput` before they're encoded and written
+DEFAULT_BUFFER_SIZE = 0x40000
+
+# the number of fragments of text collected by `SdbRenderer` before they're passed on
+RENDER_BATCH_SIZE = 0x1000
+
+# quote and escape a string as JSON, leaving non-ASCII characters as they are
+_json_string = json.encoder.encode_basestring
+
+
+class BufferedOutput(object):
+    """
+    collect text and write it, encoded as UTF-8, in large batches
+     rather than a line at a time.
+    """
+    def __init__(self, out=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        Args:
+          out (file): the binary stream to write to, by default stdout.
+          buffer_size (int): the number of characters to collect before writing.
+        """
+        if out is None:
+            # under python 2.x, stdout is already a byte stream
+            out = getattr(sys.stdout, "buffer", sys.stdout)
+        self._out = out
+        self._buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self._buffer_size:
+            self._write_parts()
+
+    def write_lines(self, lines):
+        for l in lines:
+            self.write(l)
+            self.write(u"\n")
+
+    def _write_parts(self):
+        self._out.write(u"".join(self._parts).encode("utf-8"))
+        self._parts = []
+        self._size = 0
+
+    def flush(self):
+        if self._parts:
+            self._write_parts()
+        self._out.flush()
+
+
+class SdbRenderer(object):
+    """
+    render a stream of `sdb.SDBEvent`s as XML, JSON, or NDJSON.
+
+    the text around each tag (its name and type label) and the formatter of its values
+     are computed the first time the tag is seen, so rendering an item is a lookup and
+     a few appends. the text is passed on in batches to a `BufferedOutput`.
+
+    XML is the format of `sdb_dump_raw.py`: a line per item, indented by depth.
+    JSON is an array of the top level items, with the items of each list in `children`.
+    NDJSON is a line per item with its `offset` and `depth`, and no `children`,
+     so the items of a list follow it.
+    """
+    def __init__(self, output, format="xml", strings=None):
+        """
+        Args:
+          output (BufferedOutput): where to write the rendered text.
+          format (str): one of `OUTPUT_FORMATS`.
+          strings (SdbIndex): if given, TAG_TYPE_STRINGREF values are resolved into strings,
+            otherwise the references are rendered.
+
+        Raises:
+          ValueError: if the format is unknown.
+        """
+        if format not in OUTPUT_FORMATS:
+            raise ValueError("unknown output format: %s" % (format))
+        self._output = output
+        self._format = format
+        self._strings = strings
+        # map from tag to the (prefix, suffix, formatter) used to render its leaf items
+        self._leaves = {}
+        # map from tag to the (enter, exit) text used to render its list items
+        self._lists = {}
+        self._indents = []
+
+    def _get_indent(self, depth):
+        while len(self._indents) <= depth:
+            self._indents.append(u"  " * len(self._indents))
+        return self._indents[depth]
+
+    def _get_xml_formatter(self, tag):
+        m = tag & 0xF000
+        if m == SDB_TAG_TYPES.TAG_TYPE_STRINGREF and self._strings is not None:
+            return self._strings.get_string
+        elif m in (SDB_TAG_TYPES.TAG_TYPE_STRINGREF, SDB_TAG_TYPES.TAG_TYPE_DWORD, SDB_TAG_TYPES.TAG_TYPE_WORD):
+            return hex
+        elif m == SDB_TAG_TYPES.TAG_TYPE_STRING:
+            return xml.sax.saxutils.escape
+        else:
+            return lambda value: formatTagValue(tag, value)
+
+    def _get_json_formatter(self, tag):
+        m = tag & 0xF000
+        if m == SDB_TAG_TYPES.TAG_TYPE_STRINGREF and self._strings is not None:
+            get_raw_string = self._strings.get_raw_string
+            return lambda value: _json_string(get_raw_string(value))
+        elif m in (SDB_TAG_TYPES.TAG_TYPE_STRINGREF, SDB_TAG_TYPES.TAG_TYPE_DWORD,
+                   SDB_TAG_TYPES.TAG_TYPE_WORD, SDB_TAG_TYPES.TAG_TYPE_QWORD):
+            return str
+        elif m == SDB_TAG_TYPES.TAG_TYPE_STRING:
+            return _json_string
+        elif m == SDB_TAG_TYPES.TAG_TYPE_NULL:
+            return lambda value: u"null"
+        else:
+            return lambda value: _json_string(formatTagValue(tag, value))
+
+    def _add_leaf(self, tag):
+        name = getTagNameForTag(tag)
+        type_ = formatTagValueType(tag)
+        if self._format == "xml":
+            leaf = (u"<%s type='%s'>" % (name, type_), u"</%s>\n" % (name), self._get_xml_formatter(tag))
+        elif self._format == "json":
+            leaf = (u'{"tag": "%s", "type": "%s", "value": ' % (name, type_), u"}", self._get_json_formatter(tag))
+        else:
+            leaf = (u', "tag": "%s", "type": "%s", "value": ' % (name, type_), u"}\n", self._get_json_formatter(tag))
+        self._leaves[tag] = leaf
+        return leaf
+
+    def _add_list(self, tag):
+        name = getTagNameForTag(tag)
+        if self._format == "xml":
+            list_ = (u"<%s>\n" % (name), u"</%s>\n" % (name))
+        elif self._format == "json":
+            list_ = (u'{"tag": "%s", "children": [' % (name), u"]}")
+        else:
+            list_ = (u', "tag": "%s", "type": "list"}\n' % (name), None)
+        self._lists[tag] = list_
+        return list_
+
+    def render(self, events):
+        """
+        render the given events, such as from `sdb.iter_events` or `sdb.iter_item_events`.
+        EVENT_JUNK events are skipped.
+        """
+        if self._format == "xml":
+            self._render_xml(events)
+        elif self._format == "json":
+            self._render_json(events)
+        else:
+            self._render_ndjson(events)
+
+    def _render_xml(self, events):
+        leaves = self._leaves
+        lists = self._lists
+        indents = self._indents
+        parts = []
+        for kind, _, depth, tag, value in events:
+            try:
+                indent = indents[depth]
+            except IndexError:
+                indent = self._get_indent(depth)
+
+            if kind == EVENT_LEAF:
+                try:
+                    prefix, suffix, format_value = leaves[tag]
+                except KeyError:
+                    prefix, suffix, format_value = self._add_leaf(tag)
+                parts.append(indent)
+                parts.append(prefix)
+                parts.append(format_value(value))
+                parts.append(suffix)
+            elif kind == EVENT_ENTER_LIST:
+                parts.append(indent)
+                parts.append(lists[tag][0] if tag in lists else self._add_list(tag)[0])
+            elif kind == EVENT_EXIT_LIST:
+                parts.append(indent)
+                parts.append(lists[tag][1] if tag in lists else self._add_list(tag)[1])
+            else:
+                continue
+
+            if len(parts) >= RENDER_BATCH_SIZE:
+                self._output.write(u"".join(parts))
+                parts = []
+        self._output.write(u"".join(parts))
+
+    def _render_json(self, events):
+        leaves = self._leaves
+        lists = self._lists
+        indents = self._indents
+        # the first item of a list isn't preceded by a comma
+        first = True
+        parts = [u"["]
+        for kind, _, depth, tag, value in events:
+            # items are nested within the top level array
+            try:
+                indent = indents[depth + 1]
+            except IndexError:
+                indent = self._get_indent(depth + 1)
+
+            if kind == EVENT_LEAF:
+                try:
+                    prefix, suffix, format_value = leaves[tag]
+                except KeyError:
+                    prefix, suffix, format_value = self._add_leaf(tag)
+                parts.append(u"\n" if first else u",\n")
+                parts.append(indent)
+                parts.append(prefix)
+                parts.append(format_value(value))
+                parts.append(suffix)
+                first = False
+            elif kind == EVENT_ENTER_LIST:
+                parts.append(u"\n" if first else u",\n")
+                parts.append(indent)
+                parts.append(lists[tag][0] if tag in lists else self._add_list(tag)[0])
+                first = True
+            elif kind == EVENT_EXIT_LIST:
+                parts.append(u"\n")
+                parts.append(indent)
+                parts.append(lists[tag][1] if tag in lists else self._add_list(tag)[1])
+                first = False
+            else:
+                continue
+
+            if len(parts) >= RENDER_BATCH_SIZE:
+                self._output.write(u"".join(parts))
+                parts = []
+        parts.append(u"\n]\n")
+        self._output.write(u"".join(parts))
+
+    def _render_ndjson(self, events):
+        leaves = self._leaves
+        lists = self._lists
+        parts = []
+        for kind, offset, depth, tag, value in events:
+            if kind == EVENT_LEAF:
+                try:
+                    prefix, suffix, format_value = leaves[tag]
+                except KeyError:
+                    prefix, suffix, format_value = self._add_leaf(tag)
+                parts.append(u'{"offset": %d, "depth": %d' % (offset, depth))
+                parts.append(prefix)
+                parts.append(format_value(value))
+                parts.append(suffix)
+            elif kind == EVENT_ENTER_LIST:
+                parts.append(u'{"offset": %d, "depth": %d' % (offset, depth))
+                parts.append(lists[tag][0] if tag in lists else self._add_list(tag)[0])
+            else:
+                continue
+
+            if len(parts) >= RENDER_BATCH_SIZE:
+                self._output.write(u"".join(parts))
+                parts = []
+        self._output.write(u"".join(parts))
 
 
 def item_get_children(item, child_tag):
+    """
+    Args:
+      item (Union[sdb.SDBItem, sdb.SDBNode, sdb.SDBNodeView]): the parent item.
+      child_tag (int): the tag of the children to find.
+    """
+    if not isinstance(item, SDBItem):
+        # parsed by the fast, lazy, or columnar engines
+        for c in item.get_children(child_tag):
+            yield c
+        return
+
     v = item.value
     if not v.vsHasField("children"):
         raise RuntimeError("item doesnt have children")
@@ -161,6 +492,9 @@ def item_get_children(item, child_tag):
 
 
 def item_get_child(item, child_tag):
+    if not isinstance(item, SDBItem):
+        return item.get_child(child_tag)
+
     v = item.value
     if not v.vsHasField("children"):
         raise RuntimeError("item doesnt have children")
@@ -168,4 +502,3 @@ def item_get_child(item, child_tag):
     for c in item_get_children(item, child_tag):
         return c
     raise KeyError("failed to find child with tag %s"  % hex(child_tag))
-
@@ -1,11 +1,16 @@
-import sys
 import logging
+import argparse
 
+import sdb
 from sdb_dump_common import isBadItem
 from sdb_dump_common import getTagName
 from sdb_dump_common import formatValue
 from sdb_dump_common import formatValueType
 from sdb_dump_common import SdbIndex
+from sdb_dump_common import print_stats
+from sdb_dump_common import BufferedOutput
+from sdb_dump_common import SdbRenderer
+from sdb_dump_common import OUTPUT_FORMATS
 from sdb import SDB_TAG_TYPES
 
 logging.basicConfig()
@@ -14,10 +19,20 @@ g_logger.setLevel(logging.WARN)
 
 
 class SdbDatabaseDumper(object):
-    def __init__(self, sdb):
-        self._sdb = sdb
+    def __init__(self, db, stats=None):
+        """
+        Args:
+          db (Union[sdb.SDB, sdb.LazySDB]): the database to dump.
+            a `LazySDB` is dumped as a stream of events, without building a tree.
+          stats (sdb.ParseStats): if given, count the items of the stream of events.
+        """
+        self._sdb = db
+        self._stats = stats
         self._strindex = SdbIndex()
-        self._strindex.index_sdb(sdb)
+        if isinstance(db, sdb.LazySDB):
+            self._strindex.index_strings(db)
+        else:
+            self._strindex.index_sdb(db)
 
     def _formatValue(self, item):
         m = (item.header.valuetype & 0xF0) << 8
@@ -53,27 +68,50 @@ class SdbDatabaseDumper(object):
                 data=self._formatValue(item),
                 tag=getTagName(item.header))
 
-    def dump(self):
-        if self._strindex is None:
-            self._build_string_index()
+    def _iter_events(self):
+        events = sdb.iter_item_events(self._sdb.buffer, self._sdb.database_root.offset)
+        if self._stats is not None:
+            events = self._stats.observe_events(events)
+        return events
 
+    def dump(self):
+        """
+        format the DATABASE of an `SDB` as lines of XML. see `render` for a `LazySDB`.
+        """
         for i in self._dump_item(self._sdb.database_root):
             yield i
 
-
-def _main(sdb_path):
-    from sdb import SDB
-
-    with open(sdb_path, "rb") as f:
-        buf = f.read()
-
-    s = SDB()
-    s.vsParse(bytearray(buf))
-
-    d = SdbDatabaseDumper(s)
-    for l in d.dump():
-        sys.stdout.write(l.encode("utf-8"))
-        sys.stdout.write("\n")
+    def render(self, output, format="xml"):
+        """
+        write the DATABASE of a `LazySDB` to the given `BufferedOutput`, as XML, JSON, or NDJSON.
+        """
+        SdbRenderer(output, format=format, strings=self._strindex).render(self._iter_events())
+
+
+def _main(*args):
+    from sdb import LazySDB
+    parser = argparse.ArgumentParser(description="Dump the DATABASE of a shim database.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="xml",
+                        help="output format (default: xml)")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    stats = sdb.ParseStats()
+    with stats.timer("parse"):
+        db = LazySDB.open(args.sdb_path)
+    with db:
+        with stats.timer("index"):
+            d = SdbDatabaseDumper(db, stats=stats if args.stats else None)
+        with stats.timer("render"):
+            with BufferedOutput() as output:
+                d.render(output, format=args.format)
+        if args.stats:
+            stats.count_sections(db)
+
+    if args.stats:
+        print_stats(stats)
 
 
 def main():
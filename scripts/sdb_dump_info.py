@@ -1,7 +1,7 @@
 import sys
 import logging
+import argparse
 import binascii
-from datetime import datetime
 
 import sdb
 from sdb import SDB_TAGS
@@ -13,6 +13,9 @@ from sdb_dump_common import formatValueType
 from sdb_dump_common import SdbIndex
 from sdb_dump_common import item_get_child
 from sdb_dump_common import formatGuid
+from sdb_dump_common import parse_windows_timestamp
+from sdb_dump_common import print_stats
+from sdb_dump_common import BufferedOutput
 
 
 logging.basicConfig(level=logging.DEBUG)
@@ -20,10 +23,6 @@ g_logger = logging.getLogger("sdb_dump_info")
 g_logger.setLevel(logging.DEBUG)
 
 
-def parse_windows_timestamp(i):
-    return datetime.utcfromtimestamp(float(i) * 1e-7 - 11644473600).isoformat("T")
-
-
 class SdbInfoDumper(object):
     def __init__(self, db):
         self._db = db
@@ -69,20 +68,33 @@ class SdbInfoDumper(object):
             pass
 
 
-def _main(sdb_path):
+def _main(*args):
     from sdb import SDB
-    with open(sdb_path, "rb") as f:
+    parser = argparse.ArgumentParser(description="Dump the metadata of a shim database.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    with open(args.sdb_path, "rb") as f:
         buf = f.read()
 
+    stats = sdb.ParseStats()
     g_logger.debug("loading database")
     s = SDB()
-    s.vsParse(bytearray(buf))
+    with stats.timer("parse"):
+        s.vsParse(bytearray(buf))
     g_logger.debug("done loading database")
 
-    d = SdbInfoDumper(s)
-    for l in d.dump_info():
-        sys.stdout.write(l.encode("utf-8"))
-        sys.stdout.write("\n")
+    with stats.timer("index"):
+        d = SdbInfoDumper(s)
+    with stats.timer("render"):
+        with BufferedOutput() as output:
+            output.write_lines(d.dump_info())
+
+    if args.stats:
+        stats.count_tree(s)
+        print_stats(stats)
 
 
 def main():
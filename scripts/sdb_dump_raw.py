@@ -1,10 +1,15 @@
-import sys
 import logging
+import argparse
 
+import sdb
 from sdb_dump_common import isBadItem
 from sdb_dump_common import getTagName
 from sdb_dump_common import formatValue
 from sdb_dump_common import formatValueType
+from sdb_dump_common import print_stats
+from sdb_dump_common import BufferedOutput
+from sdb_dump_common import SdbRenderer
+from sdb_dump_common import OUTPUT_FORMATS
 
 g_logger = logging.getLogger("sdb_dump_raw")
 
@@ -47,17 +52,32 @@ def dump(sdb):
         yield i
 
 
-def _main(sdb_path):
-    from sdb import SDB
-    with open(sdb_path, "rb") as f:
-        buf = f.read()
-
-    s = SDB()
-    s.vsParse(bytearray(buf))
-
-    for l in dump(s):
-        sys.stdout.write(l.encode("utf-8"))
-        sys.stdout.write("\n")
+def _main(*args):
+    from sdb import LazySDB
+    parser = argparse.ArgumentParser(description="Dump all the items of a shim database.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="xml",
+                        help="output format (default: xml)")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    stats = sdb.ParseStats()
+    # the database is mapped rather than read,
+    #  and items are formatted as they are parsed.
+    with stats.timer("parse"):
+        db = LazySDB.open(args.sdb_path)
+    with db:
+        events = sdb.iter_events(db.buffer)
+        if args.stats:
+            stats.count_sections(db)
+            events = stats.observe_events(events)
+        with stats.timer("render"):
+            with BufferedOutput() as output:
+                SdbRenderer(output, format=args.format).render(events)
+
+    if args.stats:
+        print_stats(stats)
 
 
 def main():
@@ -1,5 +1,6 @@
 import sys
 import logging
+import argparse
 
 import sdb
 from sdb import SDB_TAGS
@@ -10,6 +11,9 @@ from sdb_dump_common import formatValue
 from sdb_dump_common import formatValueType
 from sdb_dump_common import SdbIndex
 from sdb_dump_common import item_get_child
+from sdb_dump_common import getTagNameForTag
+from sdb_dump_common import print_stats
+from sdb_dump_common import BufferedOutput
 
 logging.basicConfig()
 g_logger = logging.getLogger("sdb_dump_shims")
@@ -28,7 +32,7 @@ class SdbShimDumper(object):
             ref = item.value.reference
             try:
                 return self._index.get_string(ref)
-            except IndexError:
+            except KeyError:
                 return "UNRESOLVED_STRINGREF:" + hex(ref)
         else:
             return formatValue(item)
@@ -40,80 +44,86 @@ class SdbShimDumper(object):
             for l in self.dump_item(c, indent):
                 yield l
 
+    def dump_reference(self, item, tagid_tag, indent=""):
+        ref_name = getTagNameForTag(item.header.tag)
+        tagid_name = getTagNameForTag(tagid_tag)
+        # have to hardcode the parent tag name, since the ref points
+        #   to the referenced node, not a copy of it
+        target_name = getTagNameForTag(sdb.REFERENCE_TARGETS[tagid_tag])
+
+        yield u"{indent:s}<{tag:s}>".format(
+            indent=indent,
+            tag=target_name)
+
+        ref_item = None
+        name_item = None
+        try:
+            ref_item = item_get_child(item, tagid_tag)
+        except KeyError:
+            yield u"{indent:s}<!-- {ref:s} missing {tagid:s} -->".format(
+                indent=indent + "  ", ref=ref_name, tagid=tagid_name)
+            g_logger.debug("%s missing %s", ref_name, tagid_name)
+
+        try:
+            name_item = item_get_child(item, SDB_TAGS.TAG_NAME)
+        except KeyError:
+            yield u"{indent:s}<!-- {ref:s} missing NAME -->".format(
+                indent=indent + "  ", ref=ref_name)
+            g_logger.debug("%s missing NAME", ref_name)
+
+        name = None
+        if name_item:
+            name_ref = name_item.value
+            if not isinstance(name_ref, sdb.SDBValueStringRef):
+                raise RuntimeError("unexpected TAG_NAME value type")
+            name = self._index.get_string(name_ref.reference)
+
+        tagid = None
+        target_item = None
+        if ref_item:
+            tagid_ref = ref_item.value
+            if not isinstance(tagid_ref, sdb.SDBValueDword):
+                raise RuntimeError("unexpected %s value type" % tagid_name)
+            tagid = tagid_ref.value
+            try:
+                target_item = self._index.resolve_reference(tagid_tag, tagid)
+            except KeyError:
+                yield u"{indent:s}<!-- dangling {tagid_name:s}:{offset:s} -->".format(
+                    indent=indent + "  ", tagid_name=tagid_name, offset=hex(tagid))
+                g_logger.debug("dangling %s: %s", tagid_name, hex(tagid))
+
+        if target_item is not None and name is not None:
+            yield u"{indent:s}<!-- {ref:s} name:'{name:s}' offset:{offset:s} -->".format(
+                indent=indent + "  ", ref=ref_name, name=name, offset=hex(tagid))
+
+            for l in self.dump_item_array(target_item.value.children, indent=indent + "  "):
+                yield l
+        else:
+            yield u"{indent:s}<!-- unresolved {ref:s} -->".format(
+                indent=indent + "  ", ref=ref_name)
+            g_logger.debug("unresolved %s", ref_name)
+
+            if name is not None:
+                yield u"{indent:s}<!-- {ref:s} name:'{name:s}' -->".format(
+                    indent=indent + "  ", ref=ref_name, name=name)
+
+            if tagid is not None:
+                yield u"{indent:s}<!-- {ref:s} offset:'{offset:s}' -->".format(
+                    indent=indent + "  ", ref=ref_name, offset=hex(tagid))
+
+        yield u"{indent:s}</{tag:s}>".format(
+            indent=indent,
+            tag=target_name)
+
     def dump_item(self, item, indent=""):
         if isBadItem(item):
             return
 
         v = item.value
-        # TODO: need to also support the following reftypes
-        #  - PATCH_REF
-        #  - MSI_TRANSFORM_REF
-        #  - FLAG_REF
-        if item.header.tag == SDB_TAGS.TAG_SHIM_REF:
-            # have to hardcode the parent tag name, since the ref may point
-            #   within the SHIM node
-            yield u"{indent:s}<{tag:s}>".format(
-                indent=indent,
-                tag="SHIM")
-
-            ref_item = None
-            name_item = None
-            try:
-                ref_item = item_get_child(item, SDB_TAGS.TAG_SHIM_TAGID)
-            except KeyError:
-                yield u"{indent:s}<!-- SHIM_REF missing SHIM_TAGID -->".format(
-                    indent=indent + "  ")
-                g_logger.debug("SHIM_REF missing SHIM_TAGID")
-
-            try:
-                name_item = item_get_child(item, SDB_TAGS.TAG_NAME)
-            except KeyError:
-                yield u"{indent:s}<!-- SHIM_REF missing NAME -->".format(
-                    indent=indent + "  ")
-                g_logger.debug("SHIM_REF missing NAME")
-
-            if ref_item and name_item:
-                name_ref = name_item.value
-                if not isinstance(name_ref, sdb.SDBValueStringRef):
-                    raise RuntimeError("unexpected TAG_NAME value type")
-                name = self._index.get_string(name_ref.reference)
-
-                shim_ref = ref_item.value
-                if not isinstance(shim_ref, sdb.SDBValueDword):
-                    raise RuntimeError("unexpected SHIM_TAGID value type")
-                shim_item = self._index.get_item(shim_ref.value)
-
-                yield u"{indent:s}<!-- SHIM_REF name:'{name:s}' offset:{offset:s} -->".format(
-                    indent=indent + "  ", name=name, offset=hex(shim_ref.value))
-
-                for l in self.dump_item_array(shim_item, indent=indent + "  "):
-                    yield l
-            else:
-                yield u"{indent:s}<!-- unresolved SHIM_REF -->".format(
-                    indent=indent + "  ")
-                g_logger.debug("unresolved SHIM_REF")
-
-                if name_item:
-                    name_ref = name_item.value
-                    if not isinstance(name_ref, sdb.SDBValueStringRef):
-                        raise RuntimeError("unexpected TAG_NAME value type")
-                    name = self._index.get_string(name_ref.reference)
-                    yield u"{indent:s}<!-- SHIM_REF name:'{name:s}' -->".format(
-                        indent=indent + "  ", name=name)
-
-                if ref_item:
-                    shim_ref = ref_item.value
-                    if not isinstance(shim_ref, sdb.SDBValueDword):
-                        raise RuntimeError("unexpected SHIM_TAGID value type")
-                    shim_item = self._index.get_item(shim_ref.value)
-                    yield u"{indent:s}<!-- SHIM_REF offset:'{offset:s}' -->".format(
-                        indent=indent + "  ", offset=hex(shim_ref.value))
-
-            # have to hardcode the parent tag name, since the ref may point
-            #   within the SHIM node
-            yield u"{indent:s}</{tag:s}>".format(
-                indent=indent,
-                tag="SHIM")
+        tag = item.header.tag
+        if tag in sdb.REFERENCE_LISTS:
+            for l in self.dump_reference(item, sdb.REFERENCE_LISTS[tag], indent=indent):
+                yield l
 
         elif v.vsHasField("children"):
             yield u"{indent:s}<{tag:s}>".format(
@@ -139,22 +149,35 @@ class SdbShimDumper(object):
             yield i
 
 
-def _main(sdb_path):
+def _main(*args):
     from sdb import SDB
-    with open(sdb_path, "rb") as f:
+    parser = argparse.ArgumentParser(description="Dump the DATABASE of a shim database, with references resolved.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    with open(args.sdb_path, "rb") as f:
         buf = f.read()
 
+    stats = sdb.ParseStats()
     s = SDB()
     try:
-        s.vsParse(bytearray(buf))
+        with stats.timer("parse"):
+            s.vsParse(bytearray(buf))
     except sdb.InvalidSDBFileError:
-        g_logger.error("not an SDB file: %s" % (sdb_path))
+        g_logger.error("not an SDB file: %s" % (args.sdb_path))
         return -1
 
-    d = SdbShimDumper(s)
-    for l in d.dump_database():
-        sys.stdout.write(l.encode("utf-8"))
-        sys.stdout.write("\n")
+    with stats.timer("index"):
+        d = SdbShimDumper(s)
+    with stats.timer("render"):
+        with BufferedOutput() as output:
+            output.write_lines(d.dump_database())
+
+    if args.stats:
+        stats.count_tree(s)
+        print_stats(stats)
 
 
 def main():
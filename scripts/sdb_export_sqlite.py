@@ -0,0 +1,74 @@
+"""
+export shim databases into normalized SQLite tables:
+
+    $python sdb_export_sqlite.py shims.sqlite sysmain.sdb drvmain.sdb
+    $sqlite3 shims.sqlite "SELECT e.name, s.name FROM exes e JOIN shim_refs s ON s.db = e.db AND s.exe = e.offset"
+
+databases already in the output with the same DATABASE_ID and contents are skipped,
+ and those with changed contents are replaced. see `sdb.sqlite` for the tables.
+"""
+import sys
+import sqlite3
+import logging
+import argparse
+
+import sdb
+from sdb.sqlite import DEFAULT_BATCH_SIZE
+from sdb_dump_common import print_stats
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_export_sqlite")
+g_logger.setLevel(logging.INFO)
+
+
+# items that aren't exported, and so needn't be parsed
+EXCLUDE = ("INDEXES", "PATCH_BITS", "FILE_BITS")
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Export shim databases into SQLite tables.")
+    parser.add_argument("output", help="path to the SQLite database to create or update")
+    parser.add_argument("sdb_paths", nargs="+", help="paths to the shim databases")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="number of rows inserted into a table at a time")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    ret = 0
+    stats = sdb.ParseStats()
+    conn = sqlite3.connect(args.output)
+    try:
+        exporter = sdb.SQLiteExporter(conn, batch_size=args.batch_size)
+        for path in args.sdb_paths:
+            try:
+                with open(path, "rb") as f:
+                    buf = f.read()
+                with stats.timer("parse"):
+                    db = sdb.parse_sdb(buf, exclude=EXCLUDE)
+            except sdb.InvalidSDBFileError:
+                g_logger.error("not an SDB file: %s" % (path))
+                ret = -1
+                continue
+
+            with stats.timer("export"):
+                exported = exporter.export(db, path=path)
+            if exported:
+                g_logger.info("%s: exported %d rows", path, sum(exporter.counts.values()))
+            else:
+                g_logger.info("%s: up to date", path)
+    finally:
+        conn.close()
+
+    if args.stats:
+        print_stats(stats)
+    return ret
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
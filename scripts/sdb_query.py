@@ -0,0 +1,83 @@
+"""
+print the items of a shim database selected by a path query:
+
+    $python sdb_query.py sysmain.sdb 'DATABASE/EXE[NAME="calc.exe"]/SHIM_REF/NAME'
+    0x1088 NAME: 'CorrectFilePaths'
+
+see `sdb.query` for the syntax of queries.
+"""
+import logging
+import argparse
+
+import sdb
+from sdb import SDB_TAG_TYPES
+from sdb_dump_common import formatTagValue
+from sdb_dump_common import getTagNameForTag
+from sdb_dump_common import print_stats
+from sdb_dump_common import BufferedOutput
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_query")
+g_logger.setLevel(logging.INFO)
+
+
+def formatNode(db, node):
+    name = getTagNameForTag(node.tag)
+    if node.children is not None:
+        return u"%s %s" % (hex(node.offset), name)
+
+    t = node.tag & 0xF000
+    if t == SDB_TAG_TYPES.TAG_TYPE_STRINGREF:
+        try:
+            value = u"'%s'" % (db.get_string(node.value))
+        except (KeyError, sdb.InvalidSDBFileError):
+            value = "UNRESOLVED_STRINGREF:" + hex(node.value)
+    elif t == SDB_TAG_TYPES.TAG_TYPE_STRING:
+        value = u"'%s'" % (node.value)
+    else:
+        value = formatTagValue(node.tag, node.value)
+    return u"%s %s: %s" % (hex(node.offset), name, value)
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Print the items of a shim database selected by a path query.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    parser.add_argument("query", help="the path query, such as 'DATABASE/EXE/NAME'")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    try:
+        q = sdb.compile_query(args.query)
+    except sdb.InvalidQueryError as e:
+        g_logger.error("invalid query: %s" % (e))
+        return -1
+
+    stats = sdb.ParseStats()
+    try:
+        with stats.timer("parse"):
+            db = sdb.LazySDB.open(args.sdb_path)
+    except sdb.InvalidSDBFileError:
+        g_logger.error("not an SDB file: %s" % (args.sdb_path))
+        return -1
+
+    with db:
+        # items are decoded as the query reaches them, so parsing is part of the query time
+        with stats.timer("query"):
+            with BufferedOutput() as output:
+                output.write_lines(formatNode(db, node) for node in q.evaluate(db))
+        if args.stats:
+            stats.count_sections(db)
+            stats.junk += sum(run.length for run in db.junk)
+
+    if args.stats:
+        print_stats(stats)
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
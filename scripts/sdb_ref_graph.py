@@ -0,0 +1,121 @@
+"""
+answer questions about the references between the items of a shim database:
+
+    $python sdb_ref_graph.py sysmain.sdb --users SHIM:CorrectFilePaths
+    0x2bc EXE: 'setup.exe'
+    0x3d8 EXE: 'calc.exe'
+
+    $python sdb_ref_graph.py sysmain.sdb --top 100 --tag SHIM
+    13 0x20a SHIM: 'CorrectFilePaths'
+    6 0x21c SHIM: 'RunAsAdmin'
+
+    $python sdb_ref_graph.py sysmain.sdb --uses 0x3d8
+    0x20a SHIM: 'CorrectFilePaths'
+
+see `sdb.SDBReferenceGraph`.
+"""
+import logging
+import argparse
+
+import sdb
+from sdb_dump_common import getTagNameForTag
+from sdb_dump_common import print_stats
+from sdb_dump_common import BufferedOutput
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_ref_graph")
+g_logger.setLevel(logging.INFO)
+
+
+def formatItem(graph, offset):
+    name = graph.get_name(offset)
+    if name is None:
+        return u"%s %s" % (hex(offset), getTagNameForTag(graph.get_tag(offset)))
+    return u"%s %s: '%s'" % (hex(offset), getTagNameForTag(graph.get_tag(offset)), name)
+
+
+def dump_users(graph, tag, name, source_tags=None):
+    """
+    Raises:
+      KeyError: if there's no item with the given tag and name.
+    """
+    seen = set()
+    for edge in graph.fan_in(graph.find(tag, name), source_tags=source_tags):
+        if edge.source in seen:
+            continue
+        seen.add(edge.source)
+        yield formatItem(graph, edge.source)
+
+
+def dump_uses(graph, source, target_tags=None):
+    for edge in graph.fan_out(source, target_tags=target_tags):
+        yield formatItem(graph, edge.target)
+
+
+def dump_top(graph, n, tags=None):
+    for offset, count in graph.most_referenced(n, tags=tags):
+        yield u"%d %s" % (count, formatItem(graph, offset))
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Report the references between the items of a shim database.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--users", metavar="TAG:NAME",
+                       help="list the items that reference the named item, such as SHIM:CorrectFilePaths")
+    group.add_argument("--uses", metavar="OFFSET", type=lambda s: int(s, 0),
+                       help="list the items referenced by the item at the given offset")
+    group.add_argument("--top", metavar="N", type=int, default=20,
+                       help="list the N most referenced items (default: 20)")
+    parser.add_argument("--tag", action="append", dest="tags",
+                        help="only report items with this tag, such as EXE or SHIM; may be repeated")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    stats = sdb.ParseStats()
+    try:
+        with stats.timer("parse"):
+            db = sdb.LazySDB.open(args.sdb_path)
+    except sdb.InvalidSDBFileError:
+        g_logger.error("not an SDB file: %s" % (args.sdb_path))
+        return -1
+
+    ret = 0
+    with db:
+        with stats.timer("index"):
+            graph = sdb.SDBReferenceGraph.from_db(db)
+        for ref in graph.unresolved:
+            g_logger.warning("unresolved reference to %s [offset=%s]",
+                             getTagNameForTag(ref.target_tag), hex(ref.reference))
+
+        with stats.timer("query"):
+            try:
+                if args.users:
+                    tag, _, name = args.users.partition(":")
+                    lines = dump_users(graph, tag, name, source_tags=args.tags)
+                elif args.uses is not None:
+                    lines = dump_uses(graph, args.uses, target_tags=args.tags)
+                else:
+                    lines = dump_top(graph, args.top, tags=args.tags)
+                with BufferedOutput() as output:
+                    output.write_lines(lines)
+            except KeyError:
+                g_logger.error("no such item: %s" % (args.users))
+                ret = -1
+            except ValueError as e:
+                g_logger.error("%s" % (e))
+                ret = -1
+
+    if args.stats:
+        print_stats(stats)
+    return ret
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
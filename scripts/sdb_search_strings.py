@@ -0,0 +1,87 @@
+"""
+print the items of a shim database that hold strings matching a wildcard pattern:
+
+    $python sdb_search_strings.py sysmain.sdb '*\\temp\\*' --tag COMMAND_LINE
+    0x1a2c COMMAND_LINE: '%windir%\\temp\\setup.log'
+
+patterns match whole strings, case-insensitively: `*` matches any run of characters,
+ and `?` matches any one character. see `sdb.SDBStringIndex`.
+with `--cache`, the index is persisted alongside the other cached structures,
+ so later searches needn't rebuild it.
+"""
+import logging
+import argparse
+
+import sdb
+from sdb.fastparse import normalize_tags
+from sdb_query import formatNode
+from sdb_dump_common import print_stats
+from sdb_dump_common import BufferedOutput
+
+logging.basicConfig()
+g_logger = logging.getLogger("sdb_search_strings")
+g_logger.setLevel(logging.INFO)
+
+
+def search(db, index, pattern, tags=None):
+    """
+    Yields:
+      str: a line for each item that holds a matching string.
+    """
+    for offset in index.search_items(pattern, tags=tags):
+        yield formatNode(db, db.item_at(offset))
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Print the items of a shim database that hold matching strings.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    parser.add_argument("pattern", help="the wildcard pattern, such as '*\\temp\\*'")
+    parser.add_argument("--tag", action="append", dest="tags",
+                        help="only report items with this tag, such as NAME; may be repeated")
+    parser.add_argument("--cache", help="directory of cached databases and string indexes")
+    parser.add_argument("--stats", action="store_true",
+                        help="write parse counters and timings to stderr")
+    args = parser.parse_args(args)
+
+    try:
+        tags = normalize_tags(args.tags)
+    except ValueError as e:
+        g_logger.error("%s" % (e))
+        return -1
+
+    stats = sdb.ParseStats()
+    try:
+        with stats.timer("parse"):
+            db = sdb.LazySDB.open(args.sdb_path)
+    except sdb.InvalidSDBFileError:
+        g_logger.error("not an SDB file: %s" % (args.sdb_path))
+        return -1
+
+    with db:
+        with stats.timer("index"):
+            if args.cache:
+                entry = sdb.open_cached(args.sdb_path, args.cache, index_strings=True)
+                index = entry.search
+            else:
+                entry = None
+                index = sdb.SDBStringIndex.from_db(db)
+
+        try:
+            with stats.timer("query"):
+                with BufferedOutput() as output:
+                    output.write_lines(search(db, index, args.pattern, tags=tags))
+        finally:
+            if entry is not None:
+                entry.close()
+
+    if args.stats:
+        print_stats(stats)
+
+
+def main():
+    import sys
+    return sys.exit(_main(*sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,125 @@
-import hashlib
-
-from lxml import etree
-
-
-def strip_comments(tree):
-    # via: http://stackoverflow.com/a/10437575/87207
-    comments = tree.xpath('//comment()')
-
-    for c in comments:
-        p = c.getparent()
-        p.remove(c)
-
-
-def tree_cmp(a, b):
-    # sorting precendence:
-    #  - no children before has children
-    #  - tag name, alphanumerically
-    #  - if no children, by value 
-    #  - if children, by number of children
-    #  - if children, by children values
-    if len(a) != len(b):
-        if len(a) == 0:
-            return -1
-        elif len(b) == 0:
-            return 1
-
-    if a.tag != b.tag:
-        return cmp(a.tag, b.tag)
-
-    if len(a) == 0:
-        return cmp(a.text, b.text)
-    else:
-        if len(a) != len(b):
-            return cmp(len(a), len(b))
-        else:
-            return cmp(etree.tostring(a, method="text", encoding="UTF-8"),
-                       etree.tostring(b, method="text", encoding="UTF-8"))
-
-
-def sort_tree(tree):
-    for child in tree:
-        sort_tree(child)
-
-    # `cmp` is python 2.x only
-    sorted_children = sorted(tree, cmp=tree_cmp)
-    for child in tree:
-        tree.remove(child)
-    for child in reversed(sorted_children):
-        tree.insert(0, child)
-
-
-TEST_XML = """<?xml version="1.0" encoding="UTF-8"?>
-<_>
-<b>b</b>
-<a><a>b</a></a>
-<a><a>a</a></a>
-<a>b</a>
-<a>a</a>
-</_>"""
-
-# expected output:
-"""
-<_>
-  <a>a</a>
-  <a>b</a>
-  <b>b</b>
-  <a>
-    <a>a</a>
-  </a>
-  <a>
-    <a>b</a>
-  </a>
-</_>
 """
+compute a canonical hash of each EXE entry of a shim database:
+
+    $python shims_hash_shims.py sysmain.sdb
+    EXE_ID|APP_NAME|NAME|hash
 
+the hash doesn't depend on the order of items within lists, or upon the layout
+ of the file, and SHIM_REF (and PATCH_REF, FLAG_REF, MSI_TRANSFORM_REF) items
+ hash as the definitions they refer to. so, EXEs that apply the same fixes in
+ the same way hash the same across databases.
 
-def _main(xml_path):
-    with open(xml_path, "rb") as f:
-        xml = f.read()
-
-    # `remove_blank_text` is lxml only
-    parser = etree.XMLParser(remove_blank_text=True)
-    tree = etree.fromstring(xml, parser=parser)
-    #tree = etree.fromstring(TEST_XML, parser=parser)
-
-    strip_comments(tree)
-    sort_tree(tree)
-
-    for exe in tree.iterfind("EXE"):
-        #print(etree.tostring(exe, pretty_print=True, encoding="UTF-8"))
-        name = exe.find("NAME").text
-        app_name = exe.find("APP_NAME").text
-        exe_id = exe.find("EXE_ID").text
-        exe_xml = etree.tostring(exe, method="xml", encoding="UTF-8")
-        m = hashlib.md5()
-        m.update(exe_xml)
-        print("%s|%s|%s|%s" % (exe_id,
-                               app_name.encode("UTF-8"),
-                               name.encode("UTF-8"),
-                               m.hexdigest()))
+EXEs are hashed in parallel by a pool of worker processes.
+"""
+import sys
+import logging
+import argparse
+import binascii
+import multiprocessing
+
+import sdb
+from sdb import SDB_TAGS
+from sdb_dump_common import formatGuid
+from sdb_dump_common import BufferedOutput
+
+logging.basicConfig()
+g_logger = logging.getLogger("shims_hash_shims")
+g_logger.setLevel(logging.INFO)
+
+
+DEFAULT_CHUNK_SIZE = 0x100
+
+# the database and hasher of a worker process, set up by `_init_worker`
+g_db = None
+g_hasher = None
+
+
+def _get_string(hasher, exe, tag):
+    try:
+        return hasher.get_value(exe.get_child(tag))
+    except KeyError:
+        return None
+
+
+def hash_exe(hasher, exe):
+    """
+    Returns:
+      Tuple[str, str, str, str]: the EXE_ID, APP_NAME, NAME, and canonical hash of the EXE.
+    """
+    try:
+        exe_id = formatGuid(exe.get_child(SDB_TAGS.TAG_EXE_ID).value)
+    except KeyError:
+        exe_id = None
+    app_name = _get_string(hasher, exe, SDB_TAGS.TAG_APP_NAME)
+    name = _get_string(hasher, exe, SDB_TAGS.TAG_NAME)
+    return exe_id, app_name, name, binascii.hexlify(hasher.hash(exe)).decode("ascii")
+
+
+def _init_worker(sdb_path, ref_offsets, ref_tags):
+    global g_db
+    global g_hasher
+    g_db = sdb.LazySDB.open(sdb_path)
+    # the parent process already found the referenceable items
+    references = sdb.SDBTagIdResolver(ref_offsets, ref_tags, loader=g_db.item_at)
+    g_hasher = sdb.CanonicalHasher(g_db, references=references)
+
+
+def _hash_exes(offsets):
+    return [hash_exe(g_hasher, g_db.item_at(offset)) for offset in offsets]
+
+
+def iter_exe_hashes(sdb_path, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    hash the EXEs of the given database, in order.
+
+    Args:
+      sdb_path (str): the path to the database.
+      workers (int): the number of worker processes, or None for the number of CPUs.
+        when 1, the EXEs are hashed in this process.
+      chunk_size (int): the number of EXEs given to a worker at a time.
+
+    Yields:
+      Tuple[str, str, str, str]: the EXE_ID, APP_NAME, NAME, and canonical hash of each EXE.
+    """
+    with sdb.LazySDB.open(sdb_path) as db:
+        offsets = [exe.offset for exe in db.database_root.get_children(SDB_TAGS.TAG_EXE)]
+        ref_offsets, ref_tags = sdb.SDBTagIdResolver.from_db(db).columns
+
+    chunks = [offsets[i:i + chunk_size] for i in range(0, len(offsets), chunk_size)]
+    if workers == 1:
+        _init_worker(sdb_path, ref_offsets, ref_tags)
+        for chunk in chunks:
+            for result in _hash_exes(chunk):
+                yield result
+        return
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(sdb_path, ref_offsets, ref_tags))
+    try:
+        for results in pool.imap(_hash_exes, chunks):
+            for result in results:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _main(*args):
+    parser = argparse.ArgumentParser(description="Compute canonical hashes of the EXEs in a shim database.")
+    parser.add_argument("sdb_path", help="path to the shim database")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    args = parser.parse_args(args)
+
+    try:
+        results = iter_exe_hashes(args.sdb_path, workers=args.workers)
+        with BufferedOutput() as output:
+            for exe_id, app_name, name, h in results:
+                output.write(u"%s|%s|%s|%s\n" % (exe_id or u"", app_name or u"", name or u"", h))
+    except sdb.InvalidSDBFileError:
+        g_logger.error("not an SDB file: %s" % (args.sdb_path))
+        return -1
 
 
 def main():
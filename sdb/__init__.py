@@ -14,6 +14,89 @@ from .sdb import SDBValueQword
 from .sdb import SDBValueStringRef
 from .sdb import SDBItem
 from .sdb import InvalidSDBFileError
+from .sdb import find_item_header
+from .sdb import get_tag_name
+from .sdb import format_guid
 
 from .patchbits import PATCH_ACTIONS
 from .patchbits import PATCHBITS
+
+from .fastparse import SDBNode
+from .fastparse import FastSDB
+from .fastparse import parse_sdb
+from .fastparse import parse_item
+from .fastparse import JunkRange
+from .fastparse import PrunedItem
+
+from .lazy import LazySDB
+from .lazy import LazySDBNode
+
+from .stream import SDBEvent
+from .stream import EVENT_ENTER_LIST
+from .stream import EVENT_EXIT_LIST
+from .stream import EVENT_LEAF
+from .stream import EVENT_JUNK
+from .stream import iter_events
+from .stream import iter_item_events
+
+from .columnar import SDBNodeStore
+from .columnar import SDBNodeView
+
+from .indexes import IndexRecord
+from .indexes import SDBIndexTable
+from .indexes import SDBIndexes
+from .indexes import decode_index_bits
+
+from .strtab import SDBStringTable
+
+from .refs import REFERENCE_TARGETS
+from .refs import REFERENCE_LISTS
+from .refs import DanglingReference
+from .refs import SDBTagIdResolver
+
+from .cache import SDBCache
+from .cache import CachedSDB
+from .cache import open_cached
+
+from .hashing import SubtreeHasher
+from .hashing import CanonicalHasher
+
+from .diff import CHANGE_ADDED
+from .diff import CHANGE_REMOVED
+from .diff import CHANGE_MODIFIED
+from .diff import SDBChange
+from .diff import SDBDiff
+from .diff import diff_sdb
+
+from .query import InvalidQueryError
+from .query import SDBQuery
+from .query import compile_query
+from .query import query
+
+from .matching import SDBMatcher
+from .bulk import BulkMatcher
+from .bulk import BulkMatches
+
+from .writer import SDBWriter
+from .writer import write_sdb
+from .writer import make_item
+from .writer import make_list
+
+from .synthetic import SyntheticSDBGenerator
+from .synthetic import generate_sdb
+
+from .stats import ParseStats
+
+from .parallel import parse_parallel
+
+from .resident import ResidentSDB
+from .resident import SDBRegistry
+
+from .sqlite import SQLiteExporter
+from .sqlite import export_sqlite
+
+from .search import StringMatch
+from .search import SDBStringIndex
+
+from .graph import ReferenceEdge
+from .graph import SDBReferenceGraph
@@ -0,0 +1,351 @@
+"""
+match an inventory of many files against a shim database at once, using numpy.
+
+the numeric criteria (SIZE, CHECKSUM, BIN_FILE_VERSION, LINK_DATE, their UPTO_*
+ bounds, and so on) of each MATCHING_FILE that describes the program itself are
+ extracted into arrays, one rule per MATCHING_FILE. a batch of inventory rows is
+ paired with the EXEs named like each row, and the rules of all the pairs are
+ compared at once. a pair survives when each rule of its EXE passes.
+
+the rules are exact for EXEs with only numeric criteria on the program. for other
+ EXEs (with string criteria, or criteria on other files of the program's directory),
+ the rules are a prefilter, and just the surviving pairs are checked with `SDBMatcher`.
+either way, the results are the same as those of `SDBMatcher.match`.
+
+numpy is an optional dependency, needed only by this module.
+"""
+import logging
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .sdb import SDB_TAGS
+from .matching import SDBMatcher
+from .matching import MAIN_FILE_NAME
+from .matching import UPPER_BOUNDS
+from .matching import VERSION_TAGS
+from .matching import VERSION_WILDCARD
+from .matching import normalize_path
+from .matching import has_wildcards
+from .matching import normalize_attributes
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_NULL
+from .fastparse import TAG_TYPE_WORD
+from .fastparse import TAG_TYPE_DWORD
+from .fastparse import TAG_TYPE_QWORD
+
+g_logger = logging.getLogger("sdb.bulk")
+
+
+NUMERIC_TYPES = (TAG_TYPE_WORD, TAG_TYPE_DWORD, TAG_TYPE_QWORD)
+
+ALL_BITS = 0xFFFFFFFFFFFFFFFF
+
+# the matches within a batch, sorted by row and then by EXE:
+#  `rows` are indices into the batch, `exe_indices` are indices into `BulkMatcher.exes`,
+#  and `exe_ids` are the raw 16 byte EXE_IDs (empty if the EXE has none).
+BulkMatches = namedtuple("BulkMatches", ["rows", "exe_indices", "exe_ids"])
+
+
+def get_version_mask(criterion):
+    """
+    compute the mask of the words of a version criterion that aren't wildcards.
+    """
+    mask = 0
+    for shift in (0, 16, 32, 48):
+        if (criterion >> shift) & 0xFFFF != VERSION_WILDCARD:
+            mask |= 0xFFFF << shift
+    return mask
+
+
+def _as_column(values):
+    """
+    Returns:
+      Tuple[np.ndarray, np.ndarray]: the values as uint64, and whether each is present.
+    """
+    if np.ma.isMaskedArray(values):
+        present = ~np.ma.getmaskarray(values)
+        values = np.ma.getdata(values)
+    else:
+        values = np.asarray(values)
+        present = np.ones(len(values), dtype=bool)
+    return values.astype(np.uint64), present
+
+
+def _expand(counts):
+    """
+    lay out groups of the given sizes one after another.
+
+    Returns:
+      Tuple[np.ndarray, np.ndarray]: for each of the `sum(counts)` slots, the index
+        of its group, and its index within the group.
+    """
+    counts = np.asarray(counts, dtype=np.intp)
+    groups = np.repeat(np.arange(len(counts), dtype=np.intp), counts)
+    within = np.arange(len(groups), dtype=np.intp) - np.repeat(np.cumsum(counts) - counts, counts)
+    return groups, within
+
+
+class BulkMatcher(object):
+    """
+    find the EXE entries of a database, parsed by the fast, lazy, or columnar
+     engines, that apply to each file of an inventory.
+    """
+    def __init__(self, db, strings=None):
+        if np is None:
+            raise RuntimeError("the bulk matcher requires numpy")
+
+        self._matcher = SDBMatcher(db, strings=strings)
+        # the EXEs of the database, in order
+        self.exes = list(db.database_root.get_children(SDB_TAGS.TAG_EXE))
+        self._exe_indices = dict((exe.offset, i) for i, exe in enumerate(self.exes))
+
+        exe_ids = []
+        # the rules of EXE `i` are `rules[rule_starts[i]:rule_starts[i + 1]]`
+        rule_starts = [0]
+        rules = []
+        # whether the rules of each EXE are exact, rather than a prefilter
+        exact = []
+        for exe in self.exes:
+            try:
+                exe_ids.append(bytes(bytearray(exe.get_child(SDB_TAGS.TAG_EXE_ID).value)))
+            except KeyError:
+                exe_ids.append(b"")
+
+            exe_rules, exe_exact = self._extract_rules(exe)
+            rules.extend(exe_rules)
+            rule_starts.append(len(rules))
+            exact.append(exe_exact)
+        self.exe_ids = np.array(exe_ids, dtype="S16")
+        self._rule_starts = np.array(rule_starts, dtype=np.intp)
+        self._rule_counts = np.diff(self._rule_starts)
+        self._exact = np.array(exact, dtype=bool)
+
+        g_logger.debug("extracted %d rules for %d EXEs, exact for %d",
+                       len(rules), len(self.exes), int(self._exact.sum()))
+
+        # one row per field, one column per rule
+        self._fields = sorted(set(tag for constraints, _ in rules for tag in constraints))
+        shape = (len(self._fields), len(rules))
+        self._used = np.zeros(shape, dtype=bool)
+        self._masks = np.zeros(shape, dtype=np.uint64)
+        self._values = np.zeros(shape, dtype=np.uint64)
+        self._bounds = np.full(shape, ALL_BITS, dtype=np.uint64)
+        self._negated = np.array([negated for _, negated in rules], dtype=bool)
+        for r, (constraints, _) in enumerate(rules):
+            for tag, (mask, value, bound) in constraints.items():
+                f = self._fields.index(tag)
+                self._used[f, r] = True
+                self._masks[f, r] = mask
+                self._values[f, r] = value & mask
+                self._bounds[f, r] = bound
+
+    def _extract_constraints(self, matching_file):
+        """
+        Returns:
+          Tuple[Dict[int, Tuple[int, int, int]], bool, bool]: the (mask, value, bound) of each
+            numeric field constrained by the MATCHING_FILE, whether the MATCHING_FILE is negated,
+            and whether the constraints are all of its criteria.
+        """
+        constraints = {}
+        negated = False
+        complete = True
+        for c in matching_file.children:
+            if c.tag == SDB_TAGS.TAG_MATCH_LOGIC_NOT:
+                negated = True
+                continue
+            if c.children is not None:
+                continue
+            if c.tag == SDB_TAGS.TAG_NAME or c.tag & TAG_TYPE_MASK == TAG_TYPE_NULL:
+                continue
+            if c.tag & TAG_TYPE_MASK not in NUMERIC_TYPES:
+                # string and binary criteria are checked pair by pair
+                complete = False
+                continue
+
+            if c.tag in UPPER_BOUNDS:
+                field = UPPER_BOUNDS[c.tag]
+                mask, value, bound = constraints.get(field, (0, 0, ALL_BITS))
+                constraints[field] = (mask, value, min(bound, c.value))
+            else:
+                field = c.tag
+                mask, value, bound = constraints.get(field, (0, 0, ALL_BITS))
+                if mask != 0:
+                    # the first of several criteria on a field is enough for a prefilter
+                    complete = False
+                    continue
+                if c.tag in VERSION_TAGS:
+                    mask = get_version_mask(c.value)
+                else:
+                    mask = ALL_BITS
+                constraints[field] = (mask, c.value, bound)
+        return constraints, negated, complete
+
+    def _extract_rules(self, exe):
+        """
+        Returns:
+          Tuple[List[Tuple[Dict[int, Tuple[int, int, int]], bool]], bool]: the constraints,
+            and whether they're negated, of each MATCHING_FILE of the EXE that can be expressed
+            as a rule, and whether the rules are exact rather than a prefilter.
+        """
+        try:
+            exe_name = self._matcher.get_value(exe.get_child(SDB_TAGS.TAG_NAME))
+        except KeyError:
+            return [], False
+        if exe_name is None:
+            return [], False
+        exe_name = normalize_path(exe_name)
+
+        rules = []
+        exact = True
+        for matching_file in exe.get_children(SDB_TAGS.TAG_MATCHING_FILE):
+            try:
+                file_name = self._matcher.get_value(matching_file.get_child(SDB_TAGS.TAG_NAME))
+            except KeyError:
+                file_name = MAIN_FILE_NAME
+            if file_name is None:
+                exact = False
+                continue
+            file_name = normalize_path(file_name)
+            # rows are only paired with EXEs of the same name, unless the name has wildcards
+            if file_name != MAIN_FILE_NAME and (file_name != exe_name or has_wildcards(exe_name)):
+                # criteria on another file
+                exact = False
+                continue
+
+            constraints, negated, complete = self._extract_constraints(matching_file)
+            if negated and not complete:
+                # a file may fail the other criteria of a negated MATCHING_FILE, and so match it
+                exact = False
+                continue
+            exact = exact and complete
+            rules.append((constraints, negated))
+        return rules, exact
+
+    def _get_candidates(self, name):
+        """
+        Returns:
+          np.ndarray: the indices of the EXEs that may apply to files with the given name.
+        """
+        return np.array([self._exe_indices[exe.offset] for exe in self._matcher.candidates(name)],
+                        dtype=np.intp)
+
+    def _pair(self, inverse, candidates):
+        """
+        pair each row with each candidate EXE of its name.
+
+        Returns:
+          Tuple[np.ndarray, np.ndarray]: the row and the EXE index of each pair.
+        """
+        counts = np.array([len(c) for c in candidates], dtype=np.intp)
+        starts = np.cumsum(counts) - counts
+        flat = np.concatenate(candidates + [np.zeros(0, dtype=np.intp)])
+
+        pair_rows, within = _expand(counts[inverse])
+        pair_exes = flat[starts[inverse][pair_rows] + within]
+        return pair_rows, pair_exes
+
+    def _evaluate(self, columns, rows, rules):
+        """
+        Returns:
+          np.ndarray: whether each row passes the rule paired with it.
+        """
+        ok = np.ones(len(rules), dtype=bool)
+        for f, tag in enumerate(self._fields):
+            used = self._used[f][rules]
+            if not used.any():
+                continue
+
+            column = columns.get(tag)
+            if column is None:
+                ok &= ~used
+                continue
+
+            values, present = _as_column(column)
+            v = values[rows]
+            passed = present[rows]
+            passed &= (v & self._masks[f][rules]) == self._values[f][rules]
+            passed &= v <= self._bounds[f][rules]
+            ok &= ~used | passed
+
+        ok ^= self._negated[rules]
+        return ok
+
+    def _filter(self, columns, pair_rows, pair_exes):
+        """
+        Returns:
+          np.ndarray: whether each pair passes each rule of its EXE.
+        """
+        pairs, within = _expand(self._rule_counts[pair_exes])
+        rules = self._rule_starts[pair_exes][pairs] + within
+        ok = self._evaluate(columns, pair_rows[pairs], rules)
+        failed = np.bincount(pairs[~ok], minlength=len(pair_rows))
+        return failed == 0
+
+    def _get_row_attributes(self, columns, row):
+        attributes = {}
+        for tag, column in columns.items():
+            if np.ma.isMaskedArray(column) and np.ma.getmaskarray(column)[row]:
+                continue
+            value = column[row]
+            if isinstance(value, np.generic):
+                value = value.item()
+            attributes[tag] = value
+        return attributes
+
+    def _check(self, columns, names, inverse, pair_rows, pair_exes):
+        """
+        Returns:
+          np.ndarray: whether each pair matches, according to `SDBMatcher`.
+        """
+        matched = np.zeros(len(pair_rows), dtype=bool)
+        attributes = {}
+        for j, (row, i) in enumerate(zip(pair_rows, pair_exes)):
+            if row not in attributes:
+                attributes[row] = self._get_row_attributes(columns, row)
+            matched[j] = self._matcher.match_exe(self.exes[i], names[inverse[row]], attributes[row])
+        return matched
+
+    def match_batch(self, columns):
+        """
+        find the EXEs that apply to each file of a batch of inventory rows.
+
+        Args:
+          columns (Dict[Union[int, str], Sequence]): the attributes of the files,
+            by tag (or tag name, without the `TAG_` prefix), in columns of equal length.
+            the `NAME` column holds the path, or file name, of each file.
+            missing values may be masked, with a `numpy.ma.MaskedArray`.
+
+        Returns:
+          BulkMatches: the matching (row, EXE) pairs.
+
+        Raises:
+          ValueError: if a column name is unknown.
+        """
+        columns = normalize_attributes(columns)
+        paths = columns.pop(SDB_TAGS.TAG_NAME)
+        names, inverse = np.unique(np.asarray(paths), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        names = [name.item() if isinstance(name, np.generic) else name for name in names]
+        candidates = [self._get_candidates(name) for name in names]
+
+        pair_rows, pair_exes = self._pair(inverse, candidates)
+        passed = self._filter(columns, pair_rows, pair_exes)
+        pair_rows = pair_rows[passed]
+        pair_exes = pair_exes[passed]
+
+        # the pairs of EXEs with criteria that the rules don't cover are checked one by one
+        inexact = np.flatnonzero(~self._exact[pair_exes])
+        if len(inexact):
+            passed = np.ones(len(pair_rows), dtype=bool)
+            passed[inexact] = self._check(columns, names, inverse, pair_rows[inexact], pair_exes[inexact])
+            pair_rows = pair_rows[passed]
+            pair_exes = pair_exes[passed]
+
+        order = np.lexsort((pair_exes, pair_rows))
+        rows = pair_rows[order]
+        exe_indices = pair_exes[order]
+        return BulkMatches(rows, exe_indices, self.exe_ids[exe_indices])
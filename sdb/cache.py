@@ -0,0 +1,353 @@
+"""
+persistent cache of parsed shim databases.
+
+a cache entry holds the columns of a `SDBNodeStore`, the string table index,
+ and the tag id resolver index for one database, keyed by the hash of its contents.
+on a hit, the entry is mapped and the arrays are used in place, so nothing is parsed.
+
+entry layout (native byte order, checked on load):
+
+    struct header {
+        char   magic[4];     // "SDBC"
+        uint32 version;      // CACHE_VERSION
+        uint8  little_endian;
+        uint8  padding[3];
+        uint64 source_size;
+        char   sha256[32];   // of the source file
+        uint32 column_count;
+    };
+    struct column {
+        char   typecode;
+        uint8  itemsize;
+        uint8  padding[6];
+        uint64 count;
+        uint64 offset;       // from the start of the entry, 8-byte aligned
+    } columns[column_count];
+"""
+import os
+import sys
+import mmap
+import array
+import struct
+import hashlib
+import binascii
+import logging
+import tempfile
+
+from .lazy import _release
+from .strtab import SDBStringTable
+from .refs import SDBTagIdResolver
+from .refs import node_store_loader
+from .search import SDBStringIndex
+from .columnar import COLUMNS
+from .columnar import SDBNodeStore
+
+g_logger = logging.getLogger("sdb.cache")
+
+
+# bump whenever the layout of entries or of the cached structures changes,
+#  so that existing entries are discarded rather than misread.
+CACHE_VERSION = 2
+
+CACHE_MAGIC = b"SDBC"
+CACHE_EXTENSION = ".sdbc"
+DEFAULT_MAX_SIZE = 0x40000000
+
+_HEADER = struct.Struct("<4sIB3xQ32sI")
+_COLUMN = struct.Struct("<cB6xQQ")
+
+# node store columns, then string table columns, then resolver columns
+_COLUMN_COUNT = len(COLUMNS) + 3 + 2
+# followed, in entries made with `index_strings`, by the string search index columns
+_SEARCH_COLUMN_COUNT = 9
+
+
+class CachedSDB(object):
+    """
+    a parsed shim database, along with its string table and tag id resolver indexes.
+
+    `store`, `strings`, `references`, and `search` may refer into mapped files,
+     so they must not be used after the entry is closed.
+    """
+    def __init__(self, store, strings, references, hit=False, buffers=(), mappings=(), search=None):
+        self.store = store
+        self.strings = strings
+        self.references = references
+        # the `SDBStringIndex`, if the cache indexes strings
+        self.search = search
+        # was this loaded from the cache, or parsed?
+        self.hit = hit
+        # views onto the mappings, released when closed
+        self._buffers = list(buffers)
+        self._mappings = list(mappings)
+
+    def close(self):
+        for buf in self._buffers:
+            _release(buf)
+        self._buffers = []
+        for m in self._mappings:
+            try:
+                m.close()
+            except BufferError:
+                # some values are still referenced.
+                # the mapping is released once they are collected.
+                g_logger.debug("mapping still in use, deferring close")
+        self._mappings = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _map_file(path):
+    """
+    Returns:
+      Tuple[memoryview, Optional[mmap.mmap]]: the contents, and the mapping, if any.
+    """
+    with open(path, "rb") as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # cannot map an empty file
+            return memoryview(b""), None
+
+    try:
+        return memoryview(m), m
+    except TypeError:
+        # python 2.x mmap objects don't support the new buffer protocol,
+        #  so fall back to a copy.
+        buf = memoryview(bytearray(m[:]))
+        m.close()
+        return buf, None
+
+
+def _array_bytes(a):
+    if isinstance(a, memoryview):
+        return a.tobytes()
+    if hasattr(a, "tobytes"):
+        return a.tobytes()
+    # python 2.x
+    return a.tostring()
+
+
+def _load_column(buf, typecode, offset, count):
+    a = array.array(typecode)
+    end = offset + count * a.itemsize
+    if end > len(buf):
+        raise ValueError("column overruns entry")
+    view = buf[offset:end]
+    if hasattr(view, "cast"):
+        return view.cast(typecode)
+    # python 2.x memoryviews can't be cast, so copy the data.
+    a.fromstring(view.tobytes())
+    return a
+
+
+class SDBCache(object):
+    """
+    a directory of cache entries, bounded to `max_size` bytes.
+    the least recently used entries are evicted first.
+    with `index_strings`, entries also hold a `SDBStringIndex` for substring searches.
+    """
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, index_strings=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.index_strings = index_strings
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _entry_path(self, digest):
+        return os.path.join(self.directory, digest + CACHE_EXTENSION)
+
+    def open(self, path):
+        """
+        load the database at the given path from the cache, or parse and cache it.
+
+        Returns:
+          CachedSDB: the database. the caller should close it when done.
+
+        Raises:
+          InvalidSDBFileError: if the file cannot be parsed.
+        """
+        buf, source_mapping = _map_file(path)
+        try:
+            digest = hashlib.sha256(buf).digest()
+            entry_path = self._entry_path(binascii.hexlify(digest).decode("ascii"))
+
+            entry = None
+            if os.path.exists(entry_path):
+                entry = self._load(entry_path, buf, digest)
+            if entry is None:
+                entry = self._build(buf)
+                self._save(entry_path, entry, len(buf), digest)
+                self.evict()
+        except Exception:
+            if source_mapping is not None:
+                _release(buf)
+                source_mapping.close()
+            raise
+
+        if source_mapping is not None:
+            entry._buffers.append(buf)
+            entry._mappings.append(source_mapping)
+        return entry
+
+    def _build(self, buf):
+        store = SDBNodeStore(buf)
+        strings = SDBStringTable.from_buffer(buf, store.strtab_root.offset)
+        references = SDBTagIdResolver.from_db(store)
+        search = None
+        if self.index_strings:
+            search = SDBStringIndex.from_db(store, strings=strings)
+        return CachedSDB(store, strings, references, search=search)
+
+    def _load(self, entry_path, buf, digest):
+        """
+        map the given entry.
+
+        Returns:
+          Optional[CachedSDB]: the database, or None if the entry is stale or invalid.
+        """
+        entry_buf, entry_mapping = _map_file(entry_path)
+        try:
+            magic, version, little_endian, source_size, sha256, column_count = \
+                _HEADER.unpack_from(entry_buf, 0)
+            if magic != CACHE_MAGIC or version != CACHE_VERSION:
+                raise ValueError("unsupported version")
+            if bool(little_endian) != (sys.byteorder == "little"):
+                raise ValueError("unsupported byte order")
+            if source_size != len(buf) or sha256 != digest:
+                raise ValueError("source mismatch")
+            if column_count not in (_COLUMN_COUNT, _COLUMN_COUNT + _SEARCH_COLUMN_COUNT):
+                raise ValueError("unexpected column count")
+            if self.index_strings and column_count == _COLUMN_COUNT:
+                # rebuild the entry with the string index
+                raise ValueError("no string index")
+
+            columns = []
+            for i in range(column_count):
+                typecode, itemsize, count, offset = \
+                    _COLUMN.unpack_from(entry_buf, _HEADER.size + i * _COLUMN.size)
+                typecode = typecode.decode("ascii")
+                if array.array(typecode).itemsize != itemsize:
+                    raise ValueError("unsupported column item size")
+                columns.append(_load_column(entry_buf, typecode, offset, count))
+        except (ValueError, TypeError, struct.error) as e:
+            g_logger.debug("discarding cache entry %s: %s", entry_path, str(e))
+            if entry_mapping is not None:
+                _release(entry_buf)
+                entry_mapping.close()
+            self._remove(entry_path)
+            return None
+
+        # mark the entry as recently used
+        os.utime(entry_path, None)
+
+        store = SDBNodeStore.from_columns(buf, columns[:len(COLUMNS)])
+        refs, starts, sizes = columns[len(COLUMNS):len(COLUMNS) + 3]
+        strings = SDBStringTable(buf, refs, starts, sizes)
+        offsets, tags = columns[len(COLUMNS) + 3:_COLUMN_COUNT]
+        references = SDBTagIdResolver(offsets, tags, loader=node_store_loader(store))
+        search = None
+        if column_count > _COLUMN_COUNT:
+            search = SDBStringIndex(buf, *columns[_COLUMN_COUNT:])
+
+        buffers = [c for c in columns if isinstance(c, memoryview)]
+        mappings = []
+        if entry_mapping is not None:
+            buffers.append(entry_buf)
+            mappings.append(entry_mapping)
+        return CachedSDB(store, strings, references, hit=True, buffers=buffers, mappings=mappings, search=search)
+
+    def _save(self, entry_path, entry, source_size, digest):
+        columns = list(entry.store.columns) + list(entry.strings.columns) + list(entry.references.columns)
+        if entry.search is not None:
+            columns.extend(entry.search.columns)
+
+        descriptors = []
+        chunks = []
+        offset = _HEADER.size + len(columns) * _COLUMN.size
+        for column in columns:
+            offset = (offset + 7) & ~7
+            data = _array_bytes(column)
+            typecode = column.typecode if isinstance(column, array.array) else column.format
+            descriptors.append(_COLUMN.pack(typecode.encode("ascii"), column.itemsize, len(column), offset))
+            chunks.append((offset, data))
+            offset += len(data)
+
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, sys.byteorder == "little",
+                                     source_size, digest, len(columns)))
+                for descriptor in descriptors:
+                    f.write(descriptor)
+                for offset, data in chunks:
+                    f.write(b"\x00" * (offset - f.tell()))
+                    f.write(data)
+            if os.path.exists(entry_path):
+                # another process cached the same file
+                self._remove(tmp_path)
+            else:
+                os.rename(tmp_path, entry_path)
+        except (IOError, OSError) as e:
+            g_logger.warning("failed to write cache entry %s: %s", entry_path, str(e))
+            self._remove(tmp_path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _iter_entries(self):
+        """
+        Yields:
+          Tuple[float, int, str]: the last use time, size, and path of each entry.
+        """
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(CACHE_EXTENSION):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield st.st_mtime, st.st_size, path
+
+    @property
+    def size(self):
+        """
+        the total size of the entries, in bytes.
+        """
+        return sum(size for _, size, _ in self._iter_entries())
+
+    def evict(self):
+        """
+        remove the least recently used entries until the cache fits within `max_size`.
+        """
+        entries = sorted(self._iter_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            g_logger.debug("evicting cache entry %s", path)
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for _, _, path in list(self._iter_entries()):
+            self._remove(path)
+
+
+def open_cached(path, directory, max_size=DEFAULT_MAX_SIZE, index_strings=False):
+    """
+    load the database at the given path via the cache in the given directory.
+    with `index_strings`, the entry also holds a `SDBStringIndex` (see `SDBCache`).
+
+    Returns:
+      CachedSDB: the database. the caller should close it when done.
+    """
+    return SDBCache(directory, max_size=max_size, index_strings=index_strings).open(path)
@@ -0,0 +1,359 @@
+"""
+compact, array-backed representation of a parsed shim database.
+
+rather than one or more python objects per item, a `SDBNodeStore` keeps
+ parallel `array.array` columns indexed by node number:
+
+  - offset: file offset of the item
+  - length: number of bytes consumed by the item
+  - tag: the item tag
+  - parent: node number of the enclosing list, or -1 for the roots
+  - first_child, next_sibling: node numbers, or -1
+  - value: the integer value for WORD/DWORD/QWORD/STRINGREF items,
+     or the offset of the data for STRING/BINARY items, which are decoded
+     from the source buffer on access.
+
+`SDBNodeView` is a lightweight handle onto one node, with the same
+ navigation methods as `SDBNode`.
+"""
+import array
+import struct
+import logging
+
+from .sdb import InvalidSDBFileError
+from .fastparse import SDBFileHeader
+from .fastparse import JunkRange
+from .fastparse import read_junk
+from .fastparse import SDB_HEADER_SIZE
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_NULL
+from .fastparse import TAG_TYPE_WORD
+from .fastparse import TAG_TYPE_DWORD
+from .fastparse import TAG_TYPE_QWORD
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_LIST
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_BINARY
+from .fastparse import _KNOWN_TAGS
+from .fastparse import _KNOWN_TAG_TYPES
+from .fastparse import _unpack_header
+from .fastparse import _unpack_tag
+from .fastparse import _unpack_word
+from .fastparse import _unpack_dword
+from .fastparse import _unpack_qword
+
+g_logger = logging.getLogger("sdb.columnar")
+
+
+NO_NODE = -1
+
+# names of the array attributes of a `SDBNodeStore`, in a fixed order
+COLUMNS = ("offsets", "lengths", "tags", "parents", "first_children",
+           "next_siblings", "values", "junk_offsets", "junk_lengths", "roots")
+
+# python 2.x arrays don't support "Q", though "L" is 64 bits wide on LP64 platforms.
+try:
+    array.array("Q")
+    QWORD_TYPECODE = "Q"
+except ValueError:
+    QWORD_TYPECODE = "L"
+
+
+class SDBNodeView(object):
+    """
+    a handle onto a single node of a `SDBNodeStore`.
+    views are created on demand and compare equal when they refer to the same node.
+    """
+    __slots__ = ("_store", "index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self.index = index
+
+    @property
+    def offset(self):
+        return int(self._store.offsets[self.index])
+
+    @property
+    def length(self):
+        return int(self._store.lengths[self.index])
+
+    @property
+    def tag(self):
+        return self._store.tags[self.index]
+
+    @property
+    def type(self):
+        return self._store.tags[self.index] & TAG_TYPE_MASK
+
+    @property
+    def is_list(self):
+        return self._store.tags[self.index] & TAG_TYPE_MASK == TAG_TYPE_LIST
+
+    @property
+    def value(self):
+        return self._store.get_value(self.index)
+
+    @property
+    def parent(self):
+        p = self._store.parents[self.index]
+        if p == NO_NODE:
+            return None
+        return SDBNodeView(self._store, p)
+
+    @property
+    def children(self):
+        if not self.is_list:
+            return None
+        return [SDBNodeView(self._store, i) for i in self._store.iter_children(self.index)]
+
+    def get_children(self, tag):
+        if not self.is_list:
+            raise RuntimeError("item doesnt have children")
+        store = self._store
+        tags = store.tags
+        for i in store.iter_children(self.index):
+            if tags[i] == tag:
+                yield SDBNodeView(store, i)
+
+    def get_child(self, tag):
+        for c in self.get_children(tag):
+            return c
+        raise KeyError("failed to find child with tag %s" % hex(tag))
+
+    def __eq__(self, other):
+        return (isinstance(other, SDBNodeView) and
+                self._store is other._store and
+                self.index == other.index)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self._store), self.index))
+
+    def __str__(self):
+        return "SDBNodeView(tag: 0x%x, offset: 0x%x)" % (self.tag, self.offset)
+
+    __repr__ = __str__
+
+
+class SDBNodeStore(object):
+    """
+    a parsed shim database stored in parallel arrays.
+    the source buffer is retained, since string and binary values are read from it on access.
+    """
+    def __init__(self, buf):
+        self._set_buffer(buf)
+        self._init_columns()
+        self._build(SDB_HEADER_SIZE, 3)
+
+    def _init_columns(self):
+        self.offsets = array.array("I")
+        self.lengths = array.array("I")
+        self.tags = array.array("H")
+        self.parents = array.array("i")
+        self.first_children = array.array("i")
+        self.next_siblings = array.array("i")
+        self.values = array.array(QWORD_TYPECODE)
+        # the runs of junk bytes that were skipped during parsing
+        self.junk_offsets = array.array("I")
+        self.junk_lengths = array.array("I")
+        # node numbers of: indexes, database, string table
+        self.roots = array.array("i")
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    @classmethod
+    def from_columns(cls, buf, columns):
+        """
+        construct a store from previously built columns, without parsing the buffer.
+        the columns may be any indexable sequences, such as memoryviews over a mapped file.
+
+        Args:
+          buf (Union[bytes, bytearray, memoryview]): the contents of the database.
+          columns (Sequence[Sequence[int]]): the columns, in the order given by `COLUMNS`.
+        """
+        store = cls.__new__(cls)
+        store._set_buffer(buf)
+        for name, column in zip(COLUMNS, columns):
+            setattr(store, name, column)
+        return store
+
+    def _set_buffer(self, buf):
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        self._buf = buf
+
+        if len(buf) < SDB_HEADER_SIZE:
+            raise InvalidSDBFileError("invalid magic")
+        self.header = SDBFileHeader(*_unpack_header(buf, 0))
+        if self.header.magic != b"sdbf":
+            raise InvalidSDBFileError("invalid magic")
+
+    @property
+    def columns(self):
+        """
+        the columns, in the order given by `COLUMNS`.
+        """
+        return tuple(getattr(self, name) for name in COLUMNS)
+
+    def _build(self, offset, count):
+        buf = self._buf
+        offsets = self.offsets
+        lengths = self.lengths
+        tags = self.tags
+        parents = self.parents
+        first_children = self.first_children
+        next_siblings = self.next_siblings
+        values = self.values
+        known_tags = _KNOWN_TAGS
+        known_types = _KNOWN_TAG_TYPES
+
+        # entries of [node number, end offset, last child node number] for the currently open lists
+        stack = []
+        last_root = NO_NODE
+        try:
+            while True:
+                while stack and offset >= stack[-1][1]:
+                    index = stack.pop()[0]
+                    lengths[index] = offset - offsets[index]
+
+                if not stack and count == 0:
+                    break
+
+                b1, b2 = _unpack_tag(buf, offset)
+                t = (b2 & 0xF0) << 8
+                if b1 not in known_tags and t not in known_types:
+                    run = read_junk(buf, offset, stack[-1][1] if stack else len(buf))
+                    g_logger.warning("ignoring %d bytes [offset=%s]: 0x%02x 0x%02x",
+                                     run.length, hex(offset), b1, b2)
+                    self.junk_offsets.append(run.offset)
+                    self.junk_lengths.append(run.length)
+                    offset += run.length
+                    continue
+
+                index = len(offsets)
+                if stack:
+                    top = stack[-1]
+                    parents.append(top[0])
+                    if top[2] == NO_NODE:
+                        first_children[top[0]] = index
+                    else:
+                        next_siblings[top[2]] = index
+                    top[2] = index
+                else:
+                    count -= 1
+                    parents.append(NO_NODE)
+                    if last_root != NO_NODE:
+                        next_siblings[last_root] = index
+                    last_root = index
+                    self.roots.append(index)
+
+                tag = (b2 << 8) | b1
+                offsets.append(offset)
+                tags.append(tag)
+                first_children.append(NO_NODE)
+                next_siblings.append(NO_NODE)
+
+                start = offset
+                offset += 2
+                if t == TAG_TYPE_LIST:
+                    size = _unpack_dword(buf, offset)[0]
+                    values.append(0)
+                    # updated once the children are parsed
+                    lengths.append(0)
+                    stack.append([index, offset + 4 + size, NO_NODE])
+                    offset += 4
+                    continue
+                elif t == TAG_TYPE_STRINGREF or t == TAG_TYPE_DWORD:
+                    values.append(_unpack_dword(buf, offset)[0])
+                    offset += 4
+                elif t == TAG_TYPE_STRING or t == TAG_TYPE_BINARY:
+                    size = _unpack_dword(buf, offset)[0]
+                    offset += 4
+                    values.append(offset)
+                    offset += size
+                    if offset > len(buf):
+                        raise InvalidSDBFileError("value overruns buffer at offset %s" % hex(start))
+                elif t == TAG_TYPE_NULL:
+                    values.append(0)
+                elif t == TAG_TYPE_QWORD:
+                    values.append(_unpack_qword(buf, offset)[0])
+                    offset += 8
+                elif t == TAG_TYPE_WORD:
+                    values.append(_unpack_word(buf, offset)[0])
+                    offset += 2
+                else:
+                    raise InvalidSDBFileError("unexpected item type: 0x%x" % tag)
+                lengths.append(offset - start)
+        except struct.error:
+            raise InvalidSDBFileError("truncated item near offset %s" % hex(offset))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def junk(self):
+        """
+        the runs of junk bytes that were skipped during parsing, as `JunkRange`s.
+        """
+        return [JunkRange(int(o), int(n)) for o, n in zip(self.junk_offsets, self.junk_lengths)]
+
+    @property
+    def nbytes(self):
+        """
+        the number of bytes used by the columns, excluding the source buffer.
+        """
+        return sum(a.itemsize * len(a) for a in self.columns)
+
+    @property
+    def buffer(self):
+        return self._buf
+
+    def node(self, index):
+        return SDBNodeView(self, index)
+
+    @property
+    def indexes_root(self):
+        return SDBNodeView(self, self.roots[0])
+
+    @property
+    def database_root(self):
+        return SDBNodeView(self, self.roots[1])
+
+    @property
+    def strtab_root(self):
+        return SDBNodeView(self, self.roots[2])
+
+    def iter_children(self, index):
+        """
+        yield the node numbers of the children of the given node.
+        """
+        next_siblings = self.next_siblings
+        i = self.first_children[index]
+        while i != NO_NODE:
+            yield i
+            i = next_siblings[i]
+
+    def get_value(self, index):
+        """
+        decode the value of the given node, in the form used by `SDBNode.value`.
+        """
+        t = self.tags[index] & TAG_TYPE_MASK
+        if t == TAG_TYPE_LIST or t == TAG_TYPE_NULL:
+            return None
+        elif t == TAG_TYPE_STRING:
+            start = self.values[index]
+            end = self.offsets[index] + self.lengths[index]
+            return self._buf[start:end].tobytes().decode("utf-16le").split(u"\x00")[0]
+        elif t == TAG_TYPE_BINARY:
+            start = self.values[index]
+            end = self.offsets[index] + self.lengths[index]
+            return self._buf[start:end]
+        else:
+            # under python 2.x, unsigned array elements are `long`s
+            return int(self.values[index])
@@ -0,0 +1,190 @@
+"""
+structural comparison of two shim databases.
+
+the top-level entries (EXE, LAYER, SHIM, PATCH, FLAG, and so on) of each
+ database are keyed by their EXE_ID or NAME and matched up between the two.
+matched entries are compared item by item, but subtrees with the same
+ hash (see `sdb.hashing`) are skipped without being walked.
+"""
+import logging
+import binascii
+from collections import namedtuple
+from collections import OrderedDict
+
+from .sdb import SDB_TAGS
+from .sdb import get_tag_name
+from .hashing import SubtreeHasher
+
+g_logger = logging.getLogger("sdb.diff")
+
+
+CHANGE_ADDED = "added"
+CHANGE_REMOVED = "removed"
+CHANGE_MODIFIED = "modified"
+
+
+# a difference between the databases.
+# `path` locates the item, such as "EXE[calc.exe]/MATCHING_FILE[1]/SIZE".
+# `old` and `new` are the items from each database, or None when it's missing from one side.
+SDBChange = namedtuple("SDBChange", ["kind", "path", "old", "new"])
+
+
+# the children that identify an entry, in order of preference
+ENTRY_KEY_TAGS = {
+    SDB_TAGS.TAG_EXE: (SDB_TAGS.TAG_EXE_ID, SDB_TAGS.TAG_NAME),
+    SDB_TAGS.TAG_MSI_PACKAGE: (SDB_TAGS.TAG_MSI_PACKAGE_ID, SDB_TAGS.TAG_NAME),
+}
+DEFAULT_ENTRY_KEY_TAGS = (SDB_TAGS.TAG_NAME, )
+
+
+def iter_entries(db):
+    """
+    yield the top-level entries of the database: the lists within DATABASE,
+     and those within LIBRARY.
+    """
+    for c in db.database_root.children:
+        if not c.is_list:
+            continue
+        if c.tag == SDB_TAGS.TAG_LIBRARY:
+            for l in c.children:
+                if l.is_list:
+                    yield l
+        else:
+            yield c
+
+
+def get_entry_key(hasher, entry):
+    """
+    compute a label for the entry from its identifying child, such as "EXE[calc.exe]".
+
+    Returns:
+      Optional[str]: the label, or None if the entry has no identifying child.
+    """
+    for key_tag in ENTRY_KEY_TAGS.get(entry.tag, DEFAULT_ENTRY_KEY_TAGS):
+        try:
+            key = hasher.get_value(entry.get_child(key_tag))
+        except KeyError:
+            continue
+        if key is None:
+            continue
+        if not isinstance(key, type(u"")):
+            key = binascii.hexlify(bytearray(key)).decode("ascii")
+        return u"%s[%s]" % (get_tag_name(entry.tag), key)
+    return None
+
+
+def index_entries(hasher, db):
+    """
+    Returns:
+      OrderedDict[str, node]: the entries of the database, by label.
+    """
+    entries = OrderedDict()
+    ordinals = {}
+    for entry in iter_entries(db):
+        key = get_entry_key(hasher, entry)
+        if key is None:
+            key = get_tag_name(entry.tag)
+        n = ordinals.get(key, 0)
+        ordinals[key] = n + 1
+        if n:
+            # entries with the same key are matched up in order
+            key = u"%s#%d" % (key, n)
+        entries[key] = entry
+    return entries
+
+
+def _group_children(children):
+    groups = OrderedDict()
+    for c in children:
+        groups.setdefault(c.tag, []).append(c)
+    return groups
+
+
+class SDBDiff(object):
+    """
+    compare the entries of two databases parsed by the fast, lazy, or columnar engines.
+    """
+    def __init__(self, old_db, new_db):
+        self.old = SubtreeHasher(old_db)
+        self.new = SubtreeHasher(new_db)
+        self._old_db = old_db
+        self._new_db = new_db
+
+    def _diff_items(self, path, old, new):
+        if self.old.hash(old) == self.new.hash(new):
+            return
+
+        if old.children is None or new.children is None:
+            yield SDBChange(CHANGE_MODIFIED, path, old, new)
+            return
+
+        for change in self._diff_children(path, old.children, new.children):
+            yield change
+
+    def _diff_children(self, path, old_children, new_children):
+        """
+        match up children by tag and position, and compare them.
+        """
+        old_groups = _group_children(old_children)
+        new_groups = _group_children(new_children)
+        tags = list(old_groups.keys())
+        tags.extend(t for t in new_groups.keys() if t not in old_groups)
+        for tag in tags:
+            old_group = old_groups.get(tag, [])
+            new_group = new_groups.get(tag, [])
+            name = get_tag_name(tag)
+            indexed = len(old_group) > 1 or len(new_group) > 1
+            for i in range(max(len(old_group), len(new_group))):
+                if indexed:
+                    child_path = u"%s/%s[%d]" % (path, name, i)
+                else:
+                    child_path = u"%s/%s" % (path, name)
+
+                if i >= len(new_group):
+                    yield SDBChange(CHANGE_REMOVED, child_path, old_group[i], None)
+                elif i >= len(old_group):
+                    yield SDBChange(CHANGE_ADDED, child_path, None, new_group[i])
+                else:
+                    for change in self._diff_items(child_path, old_group[i], new_group[i]):
+                        yield change
+
+    def __iter__(self):
+        """
+        yield the changes: to the properties of the database, then removed and modified entries
+         in the order of the old database, then added entries in the order of the new database.
+
+        Yields:
+          SDBChange: the changes.
+        """
+        # the properties of the database itself, such as its NAME and TIME
+        old_root = self._old_db.database_root
+        new_root = self._new_db.database_root
+        for change in self._diff_children(get_tag_name(old_root.tag),
+                                          [c for c in old_root.children if not c.is_list],
+                                          [c for c in new_root.children if not c.is_list]):
+            yield change
+
+        old_entries = index_entries(self.old, self._old_db)
+        new_entries = index_entries(self.new, self._new_db)
+
+        for key, old in old_entries.items():
+            new = new_entries.get(key)
+            if new is None:
+                yield SDBChange(CHANGE_REMOVED, key, old, None)
+            else:
+                for change in self._diff_items(key, old, new):
+                    yield change
+
+        for key, new in new_entries.items():
+            if key not in old_entries:
+                yield SDBChange(CHANGE_ADDED, key, None, new)
+
+
+def diff_sdb(old_db, new_db):
+    """
+    compare the entries of two databases.
+
+    Returns:
+      Iterator[SDBChange]: the changes from `old_db` to `new_db`.
+    """
+    return iter(SDBDiff(old_db, new_db))
@@ -0,0 +1,520 @@
+"""
+alternate parser engine for shim databases.
+
+`SDB.vsParse` creates an `SDBItem`, an `SDBItemHeader`, and a value VStruct
+ for every tag in the file, and fires the vstruct field callbacks for each.
+this module walks a `memoryview` of the file with `struct.unpack_from` instead,
+ and creates a single `SDBNode` per item.
+
+the resulting tree mirrors the one built by `SDB.vsParse`:
+  - items appear in the same order, at the same offsets,
+  - unknown (junk) bytes are skipped using the same heuristic as `SDBItem.vsParse`,
+     though each run of them is recorded on the `FastSDB` rather than inserted into the tree.
+"""
+import struct
+import numbers
+import logging
+from collections import namedtuple
+
+from .sdb import SDB_TAGS
+from .sdb import SDB_TAG_TYPES
+from .sdb import SDB_KNOWN_TAGS
+from .sdb import SDB_KNOWN_TAG_TYPES
+from .sdb import InvalidSDBFileError
+from .sdb import find_item_header
+
+g_logger = logging.getLogger("sdb.fastparse")
+
+
+TAG_TYPE_MASK = 0xF000
+TAG_TYPE_NULL = SDB_TAG_TYPES.TAG_TYPE_NULL
+TAG_TYPE_WORD = SDB_TAG_TYPES.TAG_TYPE_WORD
+TAG_TYPE_DWORD = SDB_TAG_TYPES.TAG_TYPE_DWORD
+TAG_TYPE_QWORD = SDB_TAG_TYPES.TAG_TYPE_QWORD
+TAG_TYPE_STRINGREF = SDB_TAG_TYPES.TAG_TYPE_STRINGREF
+TAG_TYPE_LIST = SDB_TAG_TYPES.TAG_TYPE_LIST
+TAG_TYPE_STRING = SDB_TAG_TYPES.TAG_TYPE_STRING
+TAG_TYPE_BINARY = SDB_TAG_TYPES.TAG_TYPE_BINARY
+
+# size of the file header: unknown0:uint32, unknown1:uint32, magic:char[4]
+SDB_HEADER_SIZE = 0xC
+
+_KNOWN_TAGS = frozenset(SDB_KNOWN_TAGS)
+_KNOWN_TAG_TYPES = frozenset(SDB_KNOWN_TAG_TYPES)
+
+# the lengths of the items of each fixed-size type, including the tag
+_FIXED_ITEM_LENGTHS = {
+    TAG_TYPE_NULL: 2,
+    TAG_TYPE_WORD: 4,
+    TAG_TYPE_DWORD: 6,
+    TAG_TYPE_STRINGREF: 6,
+    TAG_TYPE_QWORD: 10,
+}
+
+_unpack_header = struct.Struct("<II4s").unpack_from
+_unpack_tag = struct.Struct("<BB").unpack_from
+_unpack_word = struct.Struct("<H").unpack_from
+_unpack_dword = struct.Struct("<I").unpack_from
+_unpack_qword = struct.Struct("<Q").unpack_from
+
+
+SDBFileHeader = namedtuple("SDBFileHeader", ["unknown0", "unknown1", "magic"])
+
+# a run of consecutive junk bytes that was skipped.
+JunkRange = namedtuple("JunkRange", ["offset", "length"])
+
+# an item (and its subtree) that was skipped by a tag filter, without being decoded.
+PrunedItem = namedtuple("PrunedItem", ["offset", "length", "tag"])
+
+
+class SDBNode(object):
+    """
+    a single parsed item.
+
+    `value` depends on the item type:
+      - TAG_TYPE_LIST: None, and the items are found in `children`
+      - TAG_TYPE_NULL: None
+      - TAG_TYPE_WORD, TAG_TYPE_DWORD, TAG_TYPE_QWORD: int
+      - TAG_TYPE_STRINGREF: int, the offset into the string table
+      - TAG_TYPE_STRING: unicode string
+      - TAG_TYPE_BINARY: memoryview over the source buffer
+
+    `length` is the number of bytes consumed by the item, including its tag.
+    """
+    __slots__ = ("offset", "length", "tag", "value", "children")
+
+    def __init__(self, offset, length, tag, value, children=None):
+        self.offset = offset
+        self.length = length
+        self.tag = tag
+        self.value = value
+        self.children = children
+
+    @property
+    def type(self):
+        return self.tag & TAG_TYPE_MASK
+
+    @property
+    def is_list(self):
+        return self.tag & TAG_TYPE_MASK == TAG_TYPE_LIST
+
+    def get_children(self, tag):
+        if self.children is None:
+            raise RuntimeError("item doesnt have children")
+        for c in self.children:
+            if c.tag == tag:
+                yield c
+
+    def get_child(self, tag):
+        for c in self.get_children(tag):
+            return c
+        raise KeyError("failed to find child with tag %s" % hex(tag))
+
+    def __str__(self):
+        return "SDBNode(tag: 0x%x, offset: 0x%x)" % (self.tag, self.offset)
+
+    __repr__ = __str__
+
+
+def is_junk(buf, offset):
+    """
+    does the item header at the given offset look like junk?
+    uses the same heuristic as `SDBItem.vsParse`.
+    """
+    b1, b2 = _unpack_tag(buf, offset)
+    return b1 not in _KNOWN_TAGS and (b2 & 0xF0) << 8 not in _KNOWN_TAG_TYPES
+
+
+def read_junk(buf, offset, end):
+    """
+    find the extent of the run of junk bytes that begins at the given offset,
+     without extending beyond the end of the enclosing list.
+
+    Returns:
+      JunkRange: the run.
+    """
+    return JunkRange(offset, find_item_header(buf, offset, end) - offset)
+
+
+def read_value(buf, offset, tag):
+    """
+    decode the value of a non-list item whose value begins at the given offset.
+
+    Returns:
+      Tuple[Any, int]: the value, and the offset following the value.
+    """
+    t = tag & TAG_TYPE_MASK
+    if t == TAG_TYPE_STRINGREF or t == TAG_TYPE_DWORD:
+        return _unpack_dword(buf, offset)[0], offset + 4
+    elif t == TAG_TYPE_STRING:
+        size = _unpack_dword(buf, offset)[0]
+        offset += 4
+        end = offset + size
+        if end > len(buf):
+            raise InvalidSDBFileError("string value overruns buffer at offset %s" % hex(offset))
+        s = buf[offset:end].tobytes().decode("utf-16le")
+        return s.split(u"\x00")[0], end
+    elif t == TAG_TYPE_NULL:
+        return None, offset
+    elif t == TAG_TYPE_QWORD:
+        return _unpack_qword(buf, offset)[0], offset + 8
+    elif t == TAG_TYPE_BINARY:
+        size = _unpack_dword(buf, offset)[0]
+        offset += 4
+        end = offset + size
+        if end > len(buf):
+            raise InvalidSDBFileError("binary value overruns buffer at offset %s" % hex(offset))
+        return buf[offset:end], end
+    elif t == TAG_TYPE_WORD:
+        return _unpack_word(buf, offset)[0], offset + 2
+    else:
+        raise InvalidSDBFileError("unexpected item type: 0x%x" % tag)
+
+
+def skip_item(buf, offset):
+    """
+    compute the offset following the item at the given offset, using only
+     its tag and size field. values and children are not decoded.
+    """
+    tag = _unpack_word(buf, offset)[0]
+    t = tag & TAG_TYPE_MASK
+    if t == TAG_TYPE_LIST or t == TAG_TYPE_STRING or t == TAG_TYPE_BINARY:
+        return offset + 6 + _unpack_dword(buf, offset + 2)[0]
+    elif t == TAG_TYPE_STRINGREF or t == TAG_TYPE_DWORD:
+        return offset + 6
+    elif t == TAG_TYPE_NULL:
+        return offset + 2
+    elif t == TAG_TYPE_QWORD:
+        return offset + 10
+    elif t == TAG_TYPE_WORD:
+        return offset + 4
+    else:
+        raise InvalidSDBFileError("unexpected item type: 0x%x" % tag)
+
+
+def normalize_tags(tags):
+    """
+    convert a collection of tags, or tag names with or without the `TAG_` prefix, into a set of tags.
+
+    Raises:
+      ValueError: if a tag name is unknown.
+    """
+    if tags is None:
+        return None
+    normalized = set()
+    for tag in tags:
+        if not isinstance(tag, numbers.Integral):
+            name = tag if tag.startswith("TAG_") else "TAG_" + tag
+            tag = getattr(SDB_TAGS, name, None)
+            if not isinstance(tag, numbers.Integral):
+                raise ValueError("unknown tag: %s" % name)
+        normalized.add(tag)
+    return frozenset(normalized)
+
+
+class _Parser(object):
+    def __init__(self, buf):
+        self.buf = buf
+        # the runs of junk bytes that were skipped
+        self.junk = []
+        # the items that were skipped by a tag filter
+        self.pruned = []
+
+    def parse_items(self, offset, end, out):
+        """
+        parse items until reaching the given end offset, appending them to `out`.
+        like `SDBItemArray.vsParse`, the final item may extend beyond `end`.
+        """
+        buf = self.buf
+        junk = self.junk
+        known_tags = _KNOWN_TAGS
+        known_types = _KNOWN_TAG_TYPES
+        while offset < end:
+            b1, b2 = _unpack_tag(buf, offset)
+            t = (b2 & 0xF0) << 8
+            if b1 not in known_tags and t not in known_types:
+                run = read_junk(buf, offset, end)
+                g_logger.warning("ignoring %d bytes [offset=%s]: 0x%02x 0x%02x",
+                                 run.length, hex(offset), b1, b2)
+                junk.append(run)
+                offset += run.length
+                continue
+
+            tag = (b2 << 8) | b1
+            start = offset
+            if t == TAG_TYPE_LIST:
+                size = _unpack_dword(buf, offset + 2)[0]
+                children = []
+                offset = self.parse_items(offset + 6, offset + 6 + size, children)
+                out.append(SDBNode(start, offset - start, tag, None, children))
+            else:
+                value, offset = read_value(buf, offset + 2, tag)
+                out.append(SDBNode(start, offset - start, tag, value))
+        return offset
+
+    def parse_item(self, offset):
+        """
+        parse the single item at the given offset, skipping any leading junk bytes.
+
+        Returns:
+          Tuple[SDBNode, int]: the item, and the offset following it.
+        """
+        if is_junk(self.buf, offset):
+            run = read_junk(self.buf, offset, len(self.buf))
+            g_logger.warning("ignoring %d bytes [offset=%s]", run.length, hex(offset))
+            self.junk.append(run)
+            offset += run.length
+        out = []
+        # the item begins before `end`, so exactly one item is parsed
+        offset = self.parse_items(offset, offset + 1, out)
+        return out[0], offset
+
+
+class _PruningParser(_Parser):
+    """
+    a parser that skips items by tag, seeking past them using their size field.
+    it's separate so that the unfiltered loop stays as fast as possible.
+
+    with an include filter, lists outside of any included item are descended, so that
+     included items are found at any depth. the leaves outside of them are skipped without
+     being recorded, and lists without any included descendant are dropped.
+    """
+    def __init__(self, buf, include=None, exclude=None):
+        super(_PruningParser, self).__init__(buf)
+        self.include = include
+        self.exclude = exclude or frozenset()
+        # are we within an included item? without an include filter, everything is.
+        self.inside = include is None
+        # is the next item a root? roots are present even if they're excluded.
+        self.at_root = False
+
+    def parse_item(self, offset):
+        self.at_root = True
+        try:
+            return super(_PruningParser, self).parse_item(offset)
+        finally:
+            self.at_root = False
+
+    def parse_items(self, offset, end, out):
+        buf = self.buf
+        junk = self.junk
+        pruned = self.pruned
+        include = self.include
+        exclude = self.exclude
+        inside = self.inside
+        at_root = self.at_root
+        self.at_root = False
+        fixed_lengths = _FIXED_ITEM_LENGTHS
+        known_tags = _KNOWN_TAGS
+        known_types = _KNOWN_TAG_TYPES
+        while offset < end:
+            b1, b2 = _unpack_tag(buf, offset)
+            t = (b2 & 0xF0) << 8
+            if b1 not in known_tags and t not in known_types:
+                run = read_junk(buf, offset, end)
+                g_logger.warning("ignoring %d bytes [offset=%s]: 0x%02x 0x%02x",
+                                 run.length, hex(offset), b1, b2)
+                junk.append(run)
+                offset += run.length
+                continue
+
+            tag = (b2 << 8) | b1
+            start = offset
+            if tag in exclude:
+                offset = skip_item(buf, offset)
+                if offset > len(buf):
+                    raise InvalidSDBFileError("item overruns buffer at offset %s" % hex(start))
+                pruned.append(PrunedItem(start, offset - start, tag))
+                if at_root:
+                    # the roots are always present, though excluded ones are empty
+                    out.append(SDBNode(start, offset - start, tag, None, [] if t == TAG_TYPE_LIST else None))
+                continue
+
+            if not (inside or at_root or tag in include):
+                if t != TAG_TYPE_LIST:
+                    # leaves outside of included items are seeked past, and not recorded
+                    length = fixed_lengths.get(t)
+                    if length is None:
+                        offset = skip_item(buf, offset)
+                    else:
+                        offset += length
+                    if offset > len(buf):
+                        raise InvalidSDBFileError("item overruns buffer at offset %s" % hex(start))
+                    continue
+
+                # descend to find the included items within the list.
+                # if there are none, the list is dropped and recorded as a single pruned subtree.
+                mark = len(pruned)
+                size = _unpack_dword(buf, offset + 2)[0]
+                children = []
+                offset = self.parse_items(offset + 6, offset + 6 + size, children)
+                if children:
+                    out.append(SDBNode(start, offset - start, tag, None, children))
+                else:
+                    del pruned[mark:]
+                    pruned.append(PrunedItem(start, offset - start, tag))
+                continue
+
+            if t == TAG_TYPE_LIST:
+                size = _unpack_dword(buf, offset + 2)[0]
+                children = []
+                self.inside = inside or tag in include
+                try:
+                    offset = self.parse_items(offset + 6, offset + 6 + size, children)
+                finally:
+                    self.inside = inside
+                out.append(SDBNode(start, offset - start, tag, None, children))
+            else:
+                value, offset = read_value(buf, offset + 2, tag)
+                out.append(SDBNode(start, offset - start, tag, value))
+        return offset
+
+
+class _InstrumentedParser(_Parser):
+    """
+    a parser that also counts items into a `sdb.ParseStats`.
+    it's separate so that the uninstrumented loop stays as fast as possible.
+    """
+    def __init__(self, buf, stats, **kwargs):
+        super(_InstrumentedParser, self).__init__(buf, **kwargs)
+        self.stats = stats
+        self.depth = 0
+
+    def parse_items(self, offset, end, out):
+        # the items of this level are counted once they're parsed, after their children.
+        start = len(out)
+        depth = self.depth
+        self.depth += 1
+        try:
+            offset = super(_InstrumentedParser, self).parse_items(offset, end, out)
+        finally:
+            self.depth = depth
+        count_item = self.stats.count_item
+        for i in range(start, len(out)):
+            node = out[i]
+            count_item(node.offset, depth, node.tag, node.value)
+        return offset
+
+
+class _InstrumentedPruningParser(_InstrumentedParser, _PruningParser):
+    pass
+
+
+def _make_parser(buf, stats=None, include=None, exclude=None):
+    if include is None and not exclude:
+        if stats is None:
+            return _Parser(buf)
+        return _InstrumentedParser(buf, stats)
+    if stats is None:
+        return _PruningParser(buf, include=include, exclude=exclude)
+    return _InstrumentedPruningParser(buf, stats, include=include, exclude=exclude)
+
+
+def _as_memoryview(buf):
+    if isinstance(buf, memoryview):
+        return buf
+    return memoryview(buf)
+
+
+def parse_item(buf, offset):
+    """
+    parse the single item (and its children) at the given offset.
+
+    Returns:
+      Tuple[SDBNode, int]: the item, and the offset following it.
+    """
+    p = _Parser(_as_memoryview(buf))
+    try:
+        return p.parse_item(offset)
+    except struct.error:
+        raise InvalidSDBFileError("truncated item near offset %s" % hex(offset))
+
+
+class FastSDB(object):
+    """
+    a shim database parsed by the fast engine.
+    it exposes the same three roots as `SDB`.
+    """
+    def __init__(self):
+        self.header = None
+        self.indexes_root = None
+        self.database_root = None
+        self.strtab_root = None
+        # the runs of junk bytes that were skipped during parsing, as `JunkRange`s
+        self.junk = []
+        # the items that were skipped by a tag filter, as `PrunedItem`s
+        self.pruned = []
+        # the source buffer, which binary values refer into
+        self.buffer = None
+
+    def parse(self, buf, offset=0, stats=None, include=None, exclude=None):
+        """
+        Args:
+          stats (sdb.ParseStats): if given, collect counters and the time spent parsing.
+          include (Iterable[Union[int, str]]): if given, the tags (or tag names) of the items to parse,
+            along with their subtrees, at any depth. the lists that contain them are present too,
+            though other leaves outside of included items are skipped, and lists that don't contain
+            any included item are pruned as a whole.
+          exclude (Iterable[Union[int, str]]): the tags (or tag names) of items to skip, with their subtrees,
+            even within included items. excluded roots are present, but empty.
+
+        Raises:
+          ValueError: if a tag name is unknown.
+        """
+        buf = _as_memoryview(buf)
+        p = _make_parser(buf, stats=stats, include=normalize_tags(include), exclude=normalize_tags(exclude))
+        if stats is None:
+            return self._parse(buf, offset, p)
+
+        with stats.timer("parse"):
+            offset = self._parse(buf, offset, p)
+        stats.junk += sum(run.length for run in self.junk)
+        stats.count_sections(self)
+        return offset
+
+    def _parse(self, buf, offset, p):
+        if len(buf) < offset + SDB_HEADER_SIZE:
+            raise InvalidSDBFileError("invalid magic")
+        self.header = SDBFileHeader(*_unpack_header(buf, offset))
+        if self.header.magic != b"sdbf":
+            raise InvalidSDBFileError("invalid magic")
+        offset += SDB_HEADER_SIZE
+
+        try:
+            self.indexes_root, offset = p.parse_item(offset)
+            self.database_root, offset = p.parse_item(offset)
+            self.strtab_root, offset = p.parse_item(offset)
+        except struct.error:
+            raise InvalidSDBFileError("truncated file near offset %s" % hex(offset))
+        self.junk = p.junk
+        self.pruned = p.pruned
+        self.buffer = buf
+        return offset
+
+    def load_item(self, offset):
+        """
+        fully parse the item (and its subtree) that begins at the given file offset,
+         such as one that was skipped by a tag filter.
+        """
+        return parse_item(self.buffer, offset)[0]
+
+
+def parse_sdb(buf, stats=None, include=None, exclude=None):
+    """
+    parse the given buffer (bytes, bytearray, mmap, or memoryview) using the fast engine.
+
+    to extract just part of a large database, pass tag filters, such as `include=["EXE"]`
+     or `exclude=["INDEXES", "PATCH_BITS"]`. skipped items aren't decoded, though they're
+     recorded in `FastSDB.pruned` and may be loaded later with `FastSDB.load_item`.
+
+    Args:
+      stats (sdb.ParseStats): if given, collect counters and the time spent parsing.
+      include (Iterable[Union[int, str]]): the tags of the items to parse; see `FastSDB.parse`.
+      exclude (Iterable[Union[int, str]]): the tags of the items to skip; see `FastSDB.parse`.
+
+    Returns:
+      FastSDB: the parsed database.
+    """
+    s = FastSDB()
+    s.parse(buf, stats=stats, include=include, exclude=exclude)
+    return s
@@ -0,0 +1,320 @@
+"""
+the graph of references from EXEs, LAYERs, APPs, and MSI packages to the SHIMs, PATCHes,
+ FLAGs, LAYERs, and MSI_TRANSFORMs they use.
+
+an edge is recorded for each SHIM_REF, PATCH_REF, FLAG_REF, MSI_TRANSFORM_REF, and nested
+ LAYER item (and for each bare *_TAGID item outside of those). its source is the list item
+ that contains the reference, such as an EXE, and its target is the referenced definition.
+ references are resolved by their *_TAGID when they have one, and otherwise by NAME.
+ references that don't resolve are listed in `SDBReferenceGraph.unresolved`.
+
+the edges are held in flat arrays sorted by target, with a second ordering by source,
+ so that once the graph is built, the edges into or out of an item are found by bisection,
+ and the most referenced items are read off of a precomputed ranking.
+"""
+import array
+import heapq
+import bisect
+import logging
+from collections import namedtuple
+
+from .sdb import SDB_TAGS
+from .strtab import SDBStringTable
+from .refs import REFERENCE_LISTS
+from .refs import REFERENCE_TARGETS
+from .refs import REFERENCEABLE_TAGS
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import normalize_tags
+from .stream import EVENT_LEAF
+from .stream import EVENT_ENTER_LIST
+from .stream import EVENT_EXIT_LIST
+from .stream import iter_item_events
+
+g_logger = logging.getLogger("sdb.graph")
+
+
+# map from reference list tag to the tag of the item it refers to
+REFERENCE_LIST_TARGETS = dict((tag, REFERENCE_TARGETS[tagid_tag]) for tag, tagid_tag in REFERENCE_LISTS.items())
+
+# list items that contain the definitions of referenceable items
+DEFINITION_PARENTS = frozenset([SDB_TAGS.TAG_DATABASE, SDB_TAGS.TAG_LIBRARY])
+
+# an edge of the graph.
+# `source` is the offset of the item that holds the reference, such as an EXE,
+# `target` is the offset of the referenced item, such as a SHIM,
+# and `reference` is the offset of the reference item, such as a SHIM_REF.
+ReferenceEdge = namedtuple("ReferenceEdge", ["source", "source_tag", "target", "target_tag", "reference"])
+
+# a reference that doesn't resolve to an item of the expected kind.
+# `tagid` and `name` are None when the reference doesn't have them.
+UnresolvedReference = namedtuple("UnresolvedReference", ["reference", "source", "target_tag", "tagid", "name"])
+
+
+class _Frame(object):
+    __slots__ = ("offset", "tag", "name", "tagid")
+
+    def __init__(self, offset, tag):
+        self.offset = offset
+        self.tag = tag
+        self.name = None
+        self.tagid = None
+
+
+def _is_reference(frame, parent):
+    if frame.tag in REFERENCE_LIST_TARGETS:
+        return True
+    # LAYERs nested within an EXE (or other source) refer to the LAYERs of the DATABASE
+    return frame.tag == SDB_TAGS.TAG_LAYER and parent is not None and parent.tag not in DEFINITION_PARENTS
+
+
+def _index_names(names):
+    """
+    Returns:
+      Dict[Tuple[int, str], int]: map from (tag, lowercase name) to the offset of the first
+        referenceable item with that tag and name.
+    """
+    by_name = {}
+    for offset in sorted(names.keys()):
+        tag, name = names[offset]
+        if tag in REFERENCEABLE_TAGS and name is not None:
+            by_name.setdefault((tag, name.lower()), offset)
+    return by_name
+
+
+def _runs(values):
+    """
+    Yields:
+      Tuple[int, int]: the start index and length of each run of equal values.
+    """
+    start = 0
+    for i in range(1, len(values) + 1):
+        if i == len(values) or values[i] != values[start]:
+            yield start, i - start
+            start = i
+
+
+class SDBReferenceGraph(object):
+    """
+    the references between the items of a database, indexed in both directions.
+
+    use `SDBReferenceGraph.from_db` to construct one.
+    """
+    def __init__(self, sources, source_tags, targets, target_tags, references, names, unresolved=()):
+        # the edges, sorted by target and then by reference
+        self._sources = sources
+        self._source_tags = source_tags
+        self._targets = targets
+        self._target_tags = target_tags
+        self._references = references
+        # map from the offset of a referenceable item or source to its name
+        self._names = names
+        # map from (tag, lowercase name) to the offset of a referenceable item
+        self._by_name = _index_names(names)
+        self.unresolved = list(unresolved)
+
+        # the edge indexes, sorted by source and then by reference
+        self._by_source = array.array("I", sorted(range(len(sources)), key=lambda i: (sources[i], references[i])))
+        self._sorted_sources = array.array("I", (sources[i] for i in self._by_source))
+
+        # map from target tag to its distinct targets, most referenced first, as (-count, offset) pairs
+        self._ranked = {}
+        for start, n in _runs(targets):
+            self._ranked.setdefault(target_tags[start], []).append((-n, int(targets[start])))
+        for ranked in self._ranked.values():
+            ranked.sort()
+
+        # map from (source tag, target tag) to the number of edges
+        self._tag_counts = {}
+        for pair in zip(source_tags, target_tags):
+            self._tag_counts[pair] = self._tag_counts.get(pair, 0) + 1
+
+    @classmethod
+    def from_db(cls, db, strings=None):
+        """
+        build the graph in one pass over the DATABASE of the given database.
+
+        Args:
+          db (Union[sdb.FastSDB, sdb.LazySDB, sdb.SDBNodeStore]): the database.
+          strings (sdb.SDBStringTable): the string table of the database, if already loaded.
+        """
+        if strings is None:
+            strings = SDBStringTable.from_buffer(db.buffer, db.strtab_root.offset)
+
+        def get_name(tag, value):
+            if tag & TAG_TYPE_MASK != TAG_TYPE_STRINGREF:
+                return value
+            try:
+                return strings.get(value)
+            except KeyError:
+                return None
+
+        # map from offset to (tag, name) of referenceable items and sources
+        names = {}
+        # the references, as (reference, source frame, target tag, tagid, name)
+        pending = []
+        stack = []
+        for kind, offset, _, tag, value in iter_item_events(db.buffer, db.database_root.offset):
+            if kind == EVENT_ENTER_LIST:
+                stack.append(_Frame(offset, tag))
+
+            elif kind == EVENT_LEAF:
+                if not stack:
+                    continue
+                top = stack[-1]
+                if tag == SDB_TAGS.TAG_NAME:
+                    top.name = get_name(tag, value)
+                elif tag in REFERENCE_TARGETS:
+                    if _is_reference(top, stack[-2] if len(stack) > 1 else None):
+                        top.tagid = value
+                    else:
+                        # a bare *_TAGID within a source item
+                        pending.append((offset, top, REFERENCE_TARGETS[tag], value, None))
+
+            elif kind == EVENT_EXIT_LIST:
+                frame = stack.pop()
+                if not stack:
+                    continue
+                parent = stack[-1]
+                if _is_reference(frame, parent):
+                    target_tag = REFERENCE_LIST_TARGETS.get(frame.tag, SDB_TAGS.TAG_LAYER)
+                    pending.append((frame.offset, parent, target_tag, frame.tagid, frame.name))
+                elif frame.tag in REFERENCEABLE_TAGS and parent.tag in DEFINITION_PARENTS:
+                    names[frame.offset] = (frame.tag, frame.name)
+
+        by_name = _index_names(names)
+        edges = []
+        unresolved = []
+        for reference, source, target_tag, tagid, name in pending:
+            if tagid is not None:
+                target = tagid if names.get(tagid, (None, ))[0] == target_tag else None
+            elif name is not None:
+                target = by_name.get((target_tag, name.lower()))
+            else:
+                target = None
+
+            if target is None:
+                unresolved.append(UnresolvedReference(reference, source.offset, target_tag, tagid, name))
+                continue
+            names.setdefault(source.offset, (source.tag, source.name))
+            edges.append((target, reference, source.offset, source.tag, target_tag))
+        edges.sort()
+
+        return cls(array.array("I", (e[2] for e in edges)),
+                   array.array("H", (e[3] for e in edges)),
+                   array.array("I", (e[0] for e in edges)),
+                   array.array("H", (e[4] for e in edges)),
+                   array.array("I", (e[1] for e in edges)),
+                   names,
+                   unresolved=unresolved)
+
+    def __len__(self):
+        """
+        the number of edges.
+        """
+        return len(self._targets)
+
+    def _edge(self, i):
+        return ReferenceEdge(int(self._sources[i]), self._source_tags[i],
+                             int(self._targets[i]), self._target_tags[i],
+                             int(self._references[i]))
+
+    def get_name(self, offset):
+        """
+        fetch the NAME of a referenceable item, or of the source of a reference.
+
+        Raises:
+          KeyError: if the item isn't in the graph.
+        """
+        return self._names[offset][1]
+
+    def get_tag(self, offset):
+        """
+        Raises:
+          KeyError: if the item isn't in the graph.
+        """
+        return self._names[offset][0]
+
+    def find(self, tag, name):
+        """
+        find the referenceable item with the given tag (or tag name) and NAME, case-insensitively.
+
+        Returns:
+          int: the offset of the item.
+
+        Raises:
+          KeyError: if there's no such item.
+          ValueError: if the tag name is unknown.
+        """
+        tag, = normalize_tags([tag])
+        return self._by_name[(tag, name.lower())]
+
+    def fan_in(self, target, source_tags=None):
+        """
+        find the references to the item at the given offset, such as the EXEs that use a SHIM.
+
+        Args:
+          target (int): the offset of a SHIM, PATCH, FLAG, LAYER, or MSI_TRANSFORM.
+          source_tags (Iterable[Union[int, str]]): if given, only report sources with these tags.
+
+        Returns:
+          List[ReferenceEdge]: the edges, in file order of the references.
+        """
+        source_tags = normalize_tags(source_tags)
+        start = bisect.bisect_left(self._targets, target)
+        end = bisect.bisect_right(self._targets, target, start)
+        return [self._edge(i) for i in range(start, end)
+                if source_tags is None or self._source_tags[i] in source_tags]
+
+    def fan_out(self, source, target_tags=None):
+        """
+        find the references held by the item at the given offset, such as the SHIMs used by an EXE.
+
+        Args:
+          source (int): the offset of an EXE, LAYER, APP, MSI_PACKAGE, and so on.
+          target_tags (Iterable[Union[int, str]]): if given, only report targets with these tags.
+
+        Returns:
+          List[ReferenceEdge]: the edges, in file order of the references.
+        """
+        target_tags = normalize_tags(target_tags)
+        start = bisect.bisect_left(self._sorted_sources, source)
+        end = bisect.bisect_right(self._sorted_sources, source, start)
+        edges = (self._by_source[j] for j in range(start, end))
+        return [self._edge(i) for i in edges
+                if target_tags is None or self._target_tags[i] in target_tags]
+
+    def fan_in_count(self, target):
+        return bisect.bisect_right(self._targets, target) - bisect.bisect_left(self._targets, target)
+
+    def fan_out_count(self, source):
+        return bisect.bisect_right(self._sorted_sources, source) - bisect.bisect_left(self._sorted_sources, source)
+
+    def most_referenced(self, n=None, tags=None):
+        """
+        rank the referenced items by their number of references.
+
+        Args:
+          n (int): the number of items to report, or None for all of them.
+          tags (Iterable[Union[int, str]]): if given, only rank items with these tags, such as `["SHIM"]`.
+
+        Returns:
+          List[Tuple[int, int]]: the offset and number of references of each item, most referenced first.
+        """
+        tags = normalize_tags(tags)
+        if tags is None:
+            tags = self._ranked.keys()
+        ranked = heapq.merge(*[self._ranked.get(tag, []) for tag in tags])
+        out = []
+        for count, target in ranked:
+            if n is not None and len(out) >= n:
+                break
+            out.append((target, -count))
+        return out
+
+    def count_by_tag(self):
+        """
+        Returns:
+          Dict[Tuple[int, int], int]: the number of edges from each source tag to each target tag.
+        """
+        return dict(self._tag_counts)
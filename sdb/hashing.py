@@ -0,0 +1,186 @@
+"""
+content hashes of subtrees of a parsed shim database.
+
+a subtree hash covers the tag and value of an item and, in order, the hashes
+ of its children. a canonical hash ignores the order of the children, and
+ replaces reference lists (such as SHIM_REF) with the items they refer to.
+ string references are resolved first, and *_TAGID references are replaced
+ by the tag and NAME of the item they refer to, so equivalent items hash the
+ same across databases that are laid out differently.
+"""
+import struct
+import hashlib
+import logging
+
+from .sdb import SDB_TAGS
+from .strtab import SDBStringTable
+from .refs import REFERENCE_LISTS
+from .refs import REFERENCE_TARGETS
+from .refs import SDBTagIdResolver
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_BINARY
+
+g_logger = logging.getLogger("sdb.hashing")
+
+
+_pack_tag = struct.Struct("<H").pack
+_pack_leaf = struct.Struct("<HI").pack
+
+
+def encode_value(tag, value):
+    """
+    encode a resolved item value as bytes, for hashing.
+    """
+    if value is None:
+        return b""
+    t = tag & TAG_TYPE_MASK
+    if t == TAG_TYPE_STRINGREF or t == TAG_TYPE_STRING:
+        return value.encode("utf-8")
+    elif t == TAG_TYPE_BINARY:
+        return bytes(bytearray(value))
+    else:
+        return str(value).encode("ascii")
+
+
+class SubtreeHasher(object):
+    """
+    compute, and remember, the hashes of items of a database parsed by the
+     fast, lazy, or columnar engines.
+    items are identified by their offset, so a hasher must only be used with one database.
+    """
+    def __init__(self, db, strings=None, references=None):
+        self._db = db
+        if strings is None:
+            strings = SDBStringTable.from_buffer(db.buffer, db.strtab_root.offset)
+        self._strings = strings
+        if references is None:
+            references = SDBTagIdResolver.from_db(db)
+        self._references = references
+        # map from list item offset to digest
+        self._hashes = {}
+        # map from tag id to the encoded identity of the referenced item
+        self._targets = {}
+
+    def get_value(self, node):
+        """
+        fetch the value of the given item, with string references resolved.
+        unresolvable references are returned as None.
+        """
+        if node.tag & TAG_TYPE_MASK == TAG_TYPE_STRINGREF:
+            try:
+                return self._strings.get(node.value)
+            except KeyError:
+                g_logger.debug("unresolved string reference: %s", hex(node.value))
+                return None
+        return node.value
+
+    def _encode_reference(self, tag, tagid):
+        try:
+            return self._targets[tagid]
+        except KeyError:
+            pass
+
+        try:
+            target = self._references.resolve(tag, tagid)
+        except KeyError:
+            # dangling, so all we have is the offset
+            encoded = encode_value(tag, tagid)
+        else:
+            try:
+                name = self.get_value(target.get_child(SDB_TAGS.TAG_NAME))
+            except KeyError:
+                name = None
+            encoded = _pack_tag(target.tag) + encode_value(SDB_TAGS.TAG_NAME, name)
+        self._targets[tagid] = encoded
+        return encoded
+
+    def _encode_leaf(self, node):
+        tag = node.tag
+        if tag in REFERENCE_TARGETS:
+            data = self._encode_reference(tag, node.value)
+        else:
+            data = encode_value(tag, self.get_value(node))
+        return _pack_leaf(tag, len(data)) + data
+
+    def hash(self, node):
+        """
+        compute the digest of the given item and its descendants.
+        the digests of lists are remembered, while leaf items are cheap enough to recompute.
+
+        Returns:
+          bytes: the SHA-1 digest.
+        """
+        children = node.children
+        if children is None:
+            return hashlib.sha1(self._encode_leaf(node)).digest()
+
+        try:
+            return self._hashes[node.offset]
+        except KeyError:
+            pass
+
+        # leaf items are fed directly into the digest of their list,
+        #  rather than being hashed individually.
+        h = hashlib.sha1(_pack_tag(node.tag))
+        for c in children:
+            if c.children is None:
+                h.update(self._encode_leaf(c))
+            else:
+                h.update(self.hash(c))
+        digest = h.digest()
+        self._hashes[node.offset] = digest
+        return digest
+
+
+class CanonicalHasher(SubtreeHasher):
+    """
+    compute order-independent hashes of items, Merkle style:
+     the digest of a list covers the sorted digests of its children.
+
+    reference lists (SHIM_REF, PATCH_REF, FLAG_REF, MSI_TRANSFORM_REF) hash
+     the same as the item they refer to, as though the definition were
+     substituted in place (like `sdb_dump_shims.py` does).
+    """
+    def _resolve_reference_list(self, node):
+        """
+        Returns:
+          Optional[node]: the item referred to by the given reference list, or None if it's dangling.
+        """
+        try:
+            tagid = node.get_child(REFERENCE_LISTS[node.tag]).value
+            return self._references.resolve(REFERENCE_LISTS[node.tag], tagid)
+        except KeyError:
+            return None
+
+    def hash(self, node):
+        """
+        compute the canonical digest of the given item and its descendants.
+
+        Returns:
+          bytes: the SHA-1 digest.
+        """
+        children = node.children
+        if children is None:
+            return hashlib.sha1(self._encode_leaf(node)).digest()
+
+        if node.tag in REFERENCE_LISTS:
+            target = self._resolve_reference_list(node)
+            if target is not None:
+                return self.hash(target)
+
+        try:
+            return self._hashes[node.offset]
+        except KeyError:
+            pass
+
+        # the digests themselves are the sort keys,
+        #  so each child is only hashed (and compared) once.
+        digests = sorted(self.hash(c) for c in children)
+        h = hashlib.sha1(_pack_tag(node.tag))
+        for digest in digests:
+            h.update(digest)
+        digest = h.digest()
+        self._hashes[node.offset] = digest
+        return digest
@@ -0,0 +1,263 @@
+"""
+lookups via the on-disk INDEXES section.
+
+each INDEX item describes the items with tag INDEX_TAG (such as EXE),
+ keyed by their child item with tag INDEX_KEY (such as NAME or EXE_ID).
+its INDEX_BITS payload is a sorted array of records:
+
+    struct {
+        uint64 key;
+        uint32 tagid;  // file offset of the indexed item
+    };
+
+keys are only a prefix of the real value (eight bytes), so candidate
+ items are verified against their actual key item before being returned.
+"""
+import array
+import struct
+import bisect
+import logging
+from collections import namedtuple
+
+from .sdb import SDB_TAGS
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_WORD
+from .fastparse import TAG_TYPE_DWORD
+from .fastparse import TAG_TYPE_QWORD
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_BINARY
+from .columnar import QWORD_TYPECODE
+
+g_logger = logging.getLogger("sdb.indexes")
+
+
+INDEX_RECORD = struct.Struct("<QI")
+
+# when set, only the first of a run of consecutive items with the same key is indexed.
+SHIMDB_INDEX_UNIQUE_KEY = 0x1
+
+
+IndexRecord = namedtuple("IndexRecord", ["key", "tagid"])
+
+
+def decode_index_bits(bits):
+    """
+    decode the payload of an INDEX_BITS item.
+    unused (zero) records are dropped.
+
+    Args:
+      bits (Union[bytes, bytearray, memoryview]): the INDEX_BITS value.
+
+    Returns:
+      List[IndexRecord]: the records, sorted by key.
+    """
+    records = []
+    for offset in range(0, len(bits) - INDEX_RECORD.size + 1, INDEX_RECORD.size):
+        key, tagid = INDEX_RECORD.unpack_from(bits, offset)
+        if tagid == 0:
+            continue
+        records.append(IndexRecord(key, tagid))
+    records.sort()
+    return records
+
+
+def make_string_key(s):
+    """
+    compute the index key for a string value.
+    the upper-cased characters are packed from the most significant byte down,
+     with characters beyond 0xFF taking two bytes.
+    """
+    key = 0
+    shift = 56
+    for c in s.upper():
+        c = ord(c)
+        if c > 0xFF:
+            key |= (c >> 8) << shift
+            shift -= 8
+            if shift < 0:
+                break
+            c &= 0xFF
+        key |= c << shift
+        shift -= 8
+        if shift < 0:
+            break
+    return key
+
+
+def make_binary_key(b):
+    """
+    compute the index key for a binary value: its first eight bytes.
+    """
+    b = bytes(bytearray(b[:8]))
+    return struct.unpack("<Q", b.ljust(8, b"\x00"))[0]
+
+
+def make_key(tag, value):
+    """
+    compute the index key for a value of an item with the given tag.
+    """
+    t = tag & TAG_TYPE_MASK
+    if t == TAG_TYPE_STRINGREF or t == TAG_TYPE_STRING:
+        return make_string_key(value)
+    elif t == TAG_TYPE_BINARY:
+        return make_binary_key(value)
+    elif t in (TAG_TYPE_WORD, TAG_TYPE_DWORD, TAG_TYPE_QWORD):
+        return value
+    else:
+        raise ValueError("cannot index items with tag 0x%x" % tag)
+
+
+class SDBIndexTable(object):
+    """
+    a single decoded INDEX: records sorted by key, searchable by bisection.
+    """
+    def __init__(self, tag, key_tag, flags, records):
+        self.tag = tag
+        self.key_tag = key_tag
+        self.flags = flags
+        self.keys = array.array(QWORD_TYPECODE, (r.key for r in records))
+        self.tagids = array.array("I", (r.tagid for r in records))
+
+    @property
+    def is_unique_key(self):
+        return bool(self.flags & SHIMDB_INDEX_UNIQUE_KEY)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, key):
+        """
+        Returns:
+          List[int]: the tagids of the records with the given key.
+        """
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        return [int(t) for t in self.tagids[lo:hi]]
+
+    def __str__(self):
+        return "SDBIndexTable(tag: 0x%x, key: 0x%x, records: %d)" % (self.tag, self.key_tag, len(self))
+
+    __repr__ = __str__
+
+
+class SDBIndexes(object):
+    """
+    the indexes of a `LazySDB`, decoded on first use.
+
+    lookups bisect the index records and then load only the candidate items,
+     rather than walking `database_root`.
+    """
+    def __init__(self, db):
+        self._db = db
+        # map from (tag, key tag) to the INDEX item, or the decoded `SDBIndexTable`
+        self._indexes = {}
+        for index in db.indexes_root.get_children(SDB_TAGS.TAG_INDEX):
+            try:
+                tag = index.get_child(SDB_TAGS.TAG_INDEX_TAG).value
+                key_tag = index.get_child(SDB_TAGS.TAG_INDEX_KEY).value
+            except KeyError:
+                g_logger.warning("INDEX missing tag or key [offset=%s]", hex(index.offset))
+                continue
+            # the first index for a given key wins
+            self._indexes.setdefault((tag, key_tag), index)
+
+    def __iter__(self):
+        return iter(self._indexes.keys())
+
+    def __contains__(self, tag_and_key):
+        return tag_and_key in self._indexes
+
+    def get_index(self, tag, key_tag):
+        """
+        fetch and decode the index over items with `tag`, keyed by their child with `key_tag`.
+
+        Raises:
+          KeyError: if the database has no such index.
+        """
+        index = self._indexes[(tag, key_tag)]
+        if isinstance(index, SDBIndexTable):
+            return index
+
+        try:
+            flags = index.get_child(SDB_TAGS.TAG_INDEX_FLAGS).value
+        except KeyError:
+            flags = 0
+        try:
+            bits = index.get_child(SDB_TAGS.TAG_INDEX_BITS).value
+        except KeyError:
+            bits = b""
+        table = SDBIndexTable(tag, key_tag, flags, decode_index_bits(bits))
+        self._indexes[(tag, key_tag)] = table
+        return table
+
+    def _get_key_value(self, item, key_tag):
+        try:
+            v = item.get_child(key_tag).value
+        except KeyError:
+            return None
+        if key_tag & TAG_TYPE_MASK == TAG_TYPE_STRINGREF:
+            return self._db.get_string(v)
+        return v
+
+    def _matches(self, key_tag, value, candidate):
+        if candidate is None:
+            return False
+        t = key_tag & TAG_TYPE_MASK
+        if t == TAG_TYPE_STRINGREF or t == TAG_TYPE_STRING:
+            return value.upper() == candidate.upper()
+        elif t == TAG_TYPE_BINARY:
+            return bytearray(candidate) == bytearray(value)
+        return candidate == value
+
+    def lookup(self, tag, key_tag, value):
+        """
+        find the items with `tag` whose child with `key_tag` has the given value.
+        string comparisons are case-insensitive.
+
+        Args:
+          tag (int): the tag of the items to find, such as `SDB_TAGS.TAG_EXE`.
+          key_tag (int): the tag of the key item, such as `SDB_TAGS.TAG_NAME`.
+          value (Union[str, bytes, int]): the key value.
+
+        Returns:
+          Iterator[sdb.LazySDBNode]: the matching items, whose children are loaded on demand.
+
+        Raises:
+          KeyError: if the database has no such index.
+        """
+        table = self.get_index(tag, key_tag)
+        return self._lookup(table, value)
+
+    def _lookup(self, table, value):
+        tag = table.tag
+        key_tag = table.key_tag
+        key = make_key(key_tag, value)
+        end = self._db.database_root.offset + self._db.database_root.length
+
+        seen = set()
+        for tagid in table.find(key):
+            offset = tagid
+            while offset < end and offset not in seen:
+                seen.add(offset)
+                item = self._db.item_at(offset)
+                if item.tag != tag:
+                    break
+
+                candidate = self._get_key_value(item, key_tag)
+                if self._matches(key_tag, value, candidate):
+                    yield item
+
+                # for unique-key indexes, items with the same key follow
+                #  the indexed item, but aren't indexed themselves.
+                if not table.is_unique_key:
+                    break
+                if candidate is None or make_key(key_tag, candidate) != key:
+                    break
+                offset += item.length
+
+    def find_exes_by_name(self, name):
+        return self.lookup(SDB_TAGS.TAG_EXE, SDB_TAGS.TAG_NAME, name)
+
+    def find_exes_by_id(self, exe_id):
+        return self.lookup(SDB_TAGS.TAG_EXE, SDB_TAGS.TAG_EXE_ID, exe_id)
@@ -0,0 +1,266 @@
+"""
+lazily parsed, mmap-backed shim databases.
+
+opening a `LazySDB` reads only the file header and the headers of the three
+ top-level lists. the children of each TAG_TYPE_LIST item are decoded the first
+ time they are accessed, and untouched subtrees are skipped using the list size field.
+"""
+import mmap
+import struct
+import logging
+
+from .sdb import SDB_TAGS
+from .sdb import InvalidSDBFileError
+from .sdb import find_item_header
+from .fastparse import SDBNode
+from .fastparse import SDBFileHeader
+from .fastparse import SDB_HEADER_SIZE
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_LIST
+from .fastparse import read_value
+from .fastparse import is_junk
+from .fastparse import read_junk
+from .fastparse import parse_item
+from .fastparse import _KNOWN_TAGS
+from .fastparse import _KNOWN_TAG_TYPES
+from .fastparse import _unpack_header
+from .fastparse import _unpack_tag
+from .fastparse import _unpack_word
+from .fastparse import _unpack_dword
+
+g_logger = logging.getLogger("sdb.lazy")
+
+
+def _release(buf):
+    # memoryview.release is not available in python 2.x
+    if hasattr(buf, "release"):
+        buf.release()
+
+
+class LazySDBNode(SDBNode):
+    """
+    a TAG_TYPE_LIST item whose children are decoded on first access.
+
+    until the children are read, `length` is computed from the list size field.
+     once they're read, it's the number of bytes actually consumed, as with the
+     fast engine, since the final child may extend beyond the end of the list.
+    untouched lists are skipped using their size field, like pruned items.
+    """
+    __slots__ = ("_db", "_children", "_size")
+
+    def __init__(self, db, offset, tag, size):
+        self._db = db
+        self._children = None
+        self._size = size
+        self.offset = offset
+        self.length = 6 + size
+        self.tag = tag
+        self.value = None
+
+    @property
+    def children(self):
+        if self._children is None:
+            start = self.offset + 6
+            self._children, end = self._db._read_children(start, start + self._size)
+            self.length = end - self.offset
+        return self._children
+
+    @property
+    def is_loaded(self):
+        return self._children is not None
+
+    def unload(self):
+        """
+        drop the decoded children, so they may be reclaimed.
+        they'll be decoded again on next access.
+        """
+        self._children = None
+
+
+class LazySDB(object):
+    """
+    a shim database whose items are decoded on demand.
+
+    construct from a buffer, or use `LazySDB.open` to map a file.
+    values of TAG_TYPE_BINARY items are memoryviews into the underlying buffer,
+     so they must not be used after the database is closed.
+    """
+    def __init__(self, buf):
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        self._buf = buf
+        self._mapping = None
+        # the runs of junk bytes encountered so far, as `JunkRange`s
+        self.junk = []
+
+        if len(buf) < SDB_HEADER_SIZE:
+            raise InvalidSDBFileError("invalid magic")
+        self.header = SDBFileHeader(*_unpack_header(buf, 0))
+        if self.header.magic != b"sdbf":
+            raise InvalidSDBFileError("invalid magic")
+
+        try:
+            offset = SDB_HEADER_SIZE
+            self.indexes_root = self._read_root(offset)
+            offset = self._get_root_end(self.indexes_root)
+            self.database_root = self._read_root(offset)
+            offset = self._get_root_end(self.database_root)
+            self.strtab_root = self._read_root(offset)
+        except struct.error:
+            raise InvalidSDBFileError("truncated file near offset %s" % hex(offset))
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            try:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # cannot map an empty file
+                raise InvalidSDBFileError("invalid magic")
+
+        try:
+            buf = memoryview(m)
+        except TypeError:
+            # python 2.x mmap objects don't support the new buffer protocol,
+            #  so fall back to a copy.
+            buf = memoryview(bytearray(m[:]))
+            m.close()
+            m = None
+
+        try:
+            db = cls(buf)
+        except Exception:
+            if m is not None:
+                _release(buf)
+                m.close()
+            raise
+        db._mapping = m
+        return db
+
+    def close(self):
+        if self._mapping is None:
+            return
+        _release(self._buf)
+        try:
+            self._mapping.close()
+        except BufferError:
+            # some binary values are still referenced.
+            # the mapping is released once they are collected.
+            g_logger.debug("mapping still in use, deferring close")
+        self._mapping = None
+
+    @property
+    def buffer(self):
+        """
+        the underlying buffer, such as for use with `sdb.iter_events`.
+        """
+        return self._buf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_root(self, offset):
+        buf = self._buf
+        offset = self._skip_junk(offset, len(buf))
+        b1, b2 = _unpack_tag(buf, offset)
+        tag = (b2 << 8) | b1
+        if tag & TAG_TYPE_MASK != TAG_TYPE_LIST:
+            raise InvalidSDBFileError("expected list at offset %s" % hex(offset))
+        size = _unpack_dword(buf, offset + 2)[0]
+        return LazySDBNode(self, offset, tag, size)
+
+    def _get_root_end(self, root):
+        """
+        Returns:
+          int: the offset following the given root, where the next root begins.
+        """
+        buf = self._buf
+        end = root.offset + root.length
+        # a run of junk bytes may precede the next root. it's recorded when that root is read.
+        offset = end
+        if is_junk(buf, offset):
+            offset = find_item_header(buf, offset, len(buf))
+        if _unpack_word(buf, offset)[0] & TAG_TYPE_MASK != TAG_TYPE_LIST:
+            # the final child may extend beyond the size field,
+            #  so read the children to find where the root actually ends.
+            root.children
+            end = root.offset + root.length
+        return end
+
+    def _skip_junk(self, offset, end):
+        """
+        Returns:
+          int: the offset following the run of junk bytes at the given offset, if any.
+        """
+        b1, b2 = _unpack_tag(self._buf, offset)
+        if b1 not in _KNOWN_TAGS and (b2 & 0xF0) << 8 not in _KNOWN_TAG_TYPES:
+            run = read_junk(self._buf, offset, end)
+            g_logger.warning("ignoring %d bytes [offset=%s]: 0x%02x 0x%02x",
+                             run.length, hex(offset), b1, b2)
+            self.junk.append(run)
+            return offset + run.length
+        return offset
+
+    def _read_item(self, offset):
+        buf = self._buf
+        b1, b2 = _unpack_tag(buf, offset)
+        tag = (b2 << 8) | b1
+        if tag & TAG_TYPE_MASK == TAG_TYPE_LIST:
+            size = _unpack_dword(buf, offset + 2)[0]
+            return LazySDBNode(self, offset, tag, size)
+        else:
+            value, end = read_value(buf, offset + 2, tag)
+            return SDBNode(offset, end - offset, tag, value)
+
+    def _read_children(self, offset, end):
+        """
+        Returns:
+          Tuple[List[SDBNode], int]: the children, and the offset following the last of them.
+        """
+        children = []
+        try:
+            while offset < end:
+                start = offset
+                offset = self._skip_junk(offset, end)
+                if offset != start:
+                    continue
+                child = self._read_item(offset)
+                children.append(child)
+                if offset + child.length >= end and isinstance(child, LazySDBNode):
+                    # the final child list may itself extend beyond its size field,
+                    #  so read its children to learn how many bytes it consumes.
+                    child.children
+                offset += child.length
+        except struct.error:
+            raise InvalidSDBFileError("truncated item near offset %s" % hex(offset))
+        return children, offset
+
+    def item_at(self, offset):
+        """
+        fetch the item that begins at the given file offset, such as a TAGID.
+        list items are returned unloaded.
+        """
+        try:
+            return self._read_item(offset)
+        except struct.error:
+            raise InvalidSDBFileError("truncated item near offset %s" % hex(offset))
+
+    def get_string(self, reference):
+        """
+        read the string table entry at the given offset (a TAG_TYPE_STRINGREF value),
+         without loading the rest of the string table.
+        """
+        offset = self.strtab_root.offset + reference
+        item = self.item_at(offset)
+        if item.tag != SDB_TAGS.TAG_STRINGTABLE_ITEM:
+            raise KeyError("no string at reference %s" % hex(reference))
+        return item.value
+
+    def load_item(self, offset):
+        """
+        fully parse the item (and its subtree) that begins at the given file offset.
+        """
+        return parse_item(self._buf, offset)[0]
@@ -0,0 +1,288 @@
+"""
+decide which EXE entries of a shim database apply to a given file.
+
+an EXE entry applies to a program when the file name of the program matches the
+ NAME of the EXE, and each MATCHING_FILE of the EXE matches. a MATCHING_FILE named `*`
+ describes the program itself, while other names are paths relative to the directory
+ of the program. each criterion of a MATCHING_FILE (SIZE, CHECKSUM, COMPANY_NAME,
+ LINK_DATE, and so on) must equal the corresponding attribute of the file, except that:
+
+  - names and strings compare case-insensitively, and may contain `*` and `?` wildcards,
+  - words of BIN_FILE_VERSION and BIN_PRODUCT_VERSION that are 0xFFFF match any value,
+  - UPTO_BIN_FILE_VERSION, UPTO_BIN_PRODUCT_VERSION, and UPTO_LINK_DATE are inclusive
+     upper bounds on BIN_FILE_VERSION, BIN_PRODUCT_VERSION, and LINK_DATE,
+  - MATCH_LOGIC_NOT inverts the result of its MATCHING_FILE.
+
+the attributes of a file are given as a dict from tag (or tag name, without the `TAG_`
+ prefix) to value, such as `{"SIZE": 0x3ed, "COMPANY_NAME": u"Microsoft Corporation"}`.
+a criterion on an attribute that isn't given doesn't match.
+
+EXEs are found via an inverted index from their NAME, so matching a file only
+ touches the handful of entries that could apply to it.
+"""
+import re
+import numbers
+import logging
+
+from .sdb import SDB_TAGS
+from .strtab import SDBStringTable
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_NULL
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_BINARY
+
+g_logger = logging.getLogger("sdb.matching")
+
+
+# the NAME of the MATCHING_FILE that describes the program itself
+MAIN_FILE_NAME = u"*"
+
+# map from bound tag to the tag of the attribute it limits
+UPPER_BOUNDS = {
+    SDB_TAGS.TAG_UPTO_BIN_FILE_VERSION: SDB_TAGS.TAG_BIN_FILE_VERSION,
+    SDB_TAGS.TAG_UPTO_BIN_PRODUCT_VERSION: SDB_TAGS.TAG_BIN_PRODUCT_VERSION,
+    SDB_TAGS.TAG_UPTO_LINK_DATE: SDB_TAGS.TAG_LINK_DATE,
+}
+
+# four-word versions, within which 0xFFFF words are wildcards
+VERSION_TAGS = (SDB_TAGS.TAG_BIN_FILE_VERSION, SDB_TAGS.TAG_BIN_PRODUCT_VERSION)
+
+VERSION_WILDCARD = 0xFFFF
+
+
+def normalize_attributes(attributes):
+    """
+    convert a dict of file attributes keyed by tag name into one keyed by tag.
+
+    Raises:
+      ValueError: if a tag name is unknown.
+    """
+    normalized = {}
+    for key, value in attributes.items():
+        if not isinstance(key, numbers.Integral):
+            name = key if key.startswith("TAG_") else "TAG_" + key
+            tag = getattr(SDB_TAGS, name, None)
+            if not isinstance(tag, numbers.Integral):
+                raise ValueError("unknown tag: %s" % name)
+            key = tag
+        normalized[key] = value
+    return normalized
+
+
+def normalize_path(path):
+    return path.replace("/", "\\").lower()
+
+
+def get_file_name(path):
+    return normalize_path(path).rpartition("\\")[2]
+
+
+def has_wildcards(pattern):
+    return "*" in pattern or "?" in pattern
+
+
+def compile_pattern(pattern):
+    """
+    compile a name pattern with `*` and `?` wildcards into a case-insensitive regex.
+    """
+    parts = []
+    for c in pattern:
+        if c == "*":
+            parts.append(".*")
+        elif c == "?":
+            parts.append(".")
+        else:
+            parts.append(re.escape(c))
+    return re.compile("".join(parts) + r"\Z", re.IGNORECASE | re.DOTALL)
+
+
+def match_version(criterion, version):
+    for shift in (0, 16, 32, 48):
+        word = (criterion >> shift) & 0xFFFF
+        if word != VERSION_WILDCARD and word != (version >> shift) & 0xFFFF:
+            return False
+    return True
+
+
+def _normalize_files(files):
+    if not files:
+        return {}
+    return dict((normalize_path(path), normalize_attributes(attributes))
+                for path, attributes in files.items())
+
+
+class SDBMatcher(object):
+    """
+    find the EXE entries of a database, parsed by the fast, lazy, or columnar
+     engines, that apply to a file.
+    """
+    def __init__(self, db, strings=None):
+        self._db = db
+        if strings is None:
+            strings = SDBStringTable.from_buffer(db.buffer, db.strtab_root.offset)
+        self._strings = strings
+        # map from pattern to compiled regex
+        self._patterns = {}
+        # map from lowercase NAME to the EXEs with that name
+        self._names = {}
+        # the EXEs with wildcards in their names, as (regex, EXE) pairs
+        self._wildcards = []
+
+        for exe in db.database_root.get_children(SDB_TAGS.TAG_EXE):
+            try:
+                name = self.get_value(exe.get_child(SDB_TAGS.TAG_NAME))
+            except KeyError:
+                continue
+            if name is None:
+                continue
+            if has_wildcards(name):
+                self._wildcards.append((self._get_pattern(name), exe))
+            else:
+                self._names.setdefault(name.lower(), []).append(exe)
+
+    def get_value(self, node):
+        """
+        fetch the value of the given item, with string references resolved.
+        unresolvable references are returned as None.
+        """
+        if node.tag & TAG_TYPE_MASK == TAG_TYPE_STRINGREF:
+            try:
+                return self._strings.get(node.value)
+            except KeyError:
+                g_logger.debug("unresolved string reference: %s", hex(node.value))
+                return None
+        return node.value
+
+    def _get_pattern(self, pattern):
+        try:
+            return self._patterns[pattern]
+        except KeyError:
+            regex = compile_pattern(pattern)
+            self._patterns[pattern] = regex
+            return regex
+
+    def candidates(self, path):
+        """
+        find the EXEs whose NAME matches the file name of the given path.
+
+        Returns:
+          List[node]: the EXEs, in the order of the database.
+        """
+        name = get_file_name(path)
+        found = list(self._names.get(name, ()))
+        found.extend(exe for regex, exe in self._wildcards if regex.match(name))
+        found.sort(key=lambda exe: exe.offset)
+        return found
+
+    def match_criterion(self, tag, criterion, attributes):
+        """
+        Args:
+          tag (int): the tag of the criterion.
+          criterion (Any): the resolved value of the criterion.
+          attributes (Dict[int, Any]): the attributes of the file.
+
+        Returns:
+          bool: True if the file satisfies the criterion.
+        """
+        if tag in UPPER_BOUNDS:
+            value = attributes.get(UPPER_BOUNDS[tag])
+            return value is not None and value <= criterion
+
+        value = attributes.get(tag)
+        if value is None or criterion is None:
+            return False
+
+        if tag in VERSION_TAGS:
+            return match_version(criterion, value)
+
+        t = tag & TAG_TYPE_MASK
+        if t == TAG_TYPE_STRINGREF or t == TAG_TYPE_STRING:
+            if has_wildcards(criterion):
+                return self._get_pattern(criterion).match(value) is not None
+            return criterion.lower() == value.lower()
+        elif t == TAG_TYPE_BINARY:
+            return bytes(bytearray(criterion)) == bytes(bytearray(value))
+        return criterion == value
+
+    def match_file(self, matching_file, attributes):
+        """
+        Args:
+          matching_file (node): the MATCHING_FILE item.
+          attributes (Optional[Dict[int, Any]]): the attributes of the file it names,
+            or None if there's no such file.
+
+        Returns:
+          bool: True if the file satisfies the MATCHING_FILE.
+        """
+        negated = False
+        matched = attributes is not None
+        for c in matching_file.children:
+            if c.tag == SDB_TAGS.TAG_MATCH_LOGIC_NOT:
+                negated = True
+                continue
+            if not matched or c.children is not None:
+                continue
+            if c.tag == SDB_TAGS.TAG_NAME or c.tag & TAG_TYPE_MASK == TAG_TYPE_NULL:
+                continue
+            if not self.match_criterion(c.tag, self.get_value(c), attributes):
+                matched = False
+        return matched != negated
+
+    def match_exe(self, exe, path, attributes, files=None):
+        """
+        Args:
+          exe (node): the EXE item.
+          path (str): the path of the program.
+          attributes (Dict[Union[int, str], Any]): the attributes of the program.
+          files (Dict[str, Dict[Union[int, str], Any]]): the attributes of other files,
+            by path relative to the directory of the program.
+
+        Returns:
+          bool: True if each MATCHING_FILE of the EXE matches.
+        """
+        attributes = normalize_attributes(attributes)
+        others = _normalize_files(files)
+        return self._match_exe(exe, get_file_name(path), attributes, others)
+
+    def _match_exe(self, exe, name, attributes, others):
+        for matching_file in exe.get_children(SDB_TAGS.TAG_MATCHING_FILE):
+            try:
+                file_name = self.get_value(matching_file.get_child(SDB_TAGS.TAG_NAME))
+            except KeyError:
+                file_name = MAIN_FILE_NAME
+            if file_name is None:
+                return False
+
+            file_name = normalize_path(file_name)
+            if file_name == MAIN_FILE_NAME or (file_name == name and file_name not in others):
+                file_attributes = attributes
+            else:
+                file_attributes = others.get(file_name)
+
+            if not self.match_file(matching_file, file_attributes):
+                return False
+        return True
+
+    def match(self, path, attributes, files=None):
+        """
+        find the EXEs that apply to the program at the given path.
+
+        Args:
+          path (str): the path, or file name, of the program.
+          attributes (Dict[Union[int, str], Any]): the attributes of the program.
+          files (Dict[str, Dict[Union[int, str], Any]]): the attributes of other files,
+            by path relative to the directory of the program.
+
+        Returns:
+          List[node]: the matching EXEs, in the order of the database.
+
+        Raises:
+          ValueError: if an attribute name is unknown.
+        """
+        attributes = normalize_attributes(attributes)
+        others = _normalize_files(files)
+
+        name = get_file_name(path)
+        return [exe for exe in self.candidates(name)
+                if self._match_exe(exe, name, attributes, others)]
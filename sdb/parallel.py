@@ -0,0 +1,286 @@
+"""
+parse a single large shim database using a pool of worker processes.
+
+the children of each of the three roots (the EXEs, LAYERs, SHIMs, and so on of the
+ DATABASE, and the items of the STRINGTABLE) are independently sized. so, just the
+ headers and size fields of the children are scanned first, and the children are
+ split into chunks of about the same number of bytes. each worker maps the file and
+ builds the `SDBNodeStore` columns of its chunks, which are then merged in order,
+ with their node numbers rebased, into a single store.
+
+the result has the same columns, including junk ranges, as `SDBNodeStore`.
+
+scanning the roots and merging the chunks are serial, in the parent process, so they
+ bound the speedup. the node numbers of the chunks are rebased using numpy, when the
+ `bulk` extra is installed. on a 57 MB synthetic database (200,000 EXEs) parsed on a
+ single CPU, the chunks took 11.8s to build, while the scan took 0.3s and the merge
+ 0.35s (2.3s without numpy). that's a serial share of about 5%, which caps the speedup
+ near 18x. the scaling across cores hasn't been measured.
+"""
+import array
+import bisect
+import struct
+import logging
+import multiprocessing
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .sdb import InvalidSDBFileError
+from .lazy import LazySDB
+from .columnar import COLUMNS
+from .columnar import NO_NODE
+from .columnar import SDBNodeStore
+from .fastparse import JunkRange
+from .fastparse import SDB_HEADER_SIZE
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_LIST
+from .fastparse import is_junk
+from .fastparse import read_junk
+from .fastparse import skip_item
+from .fastparse import _unpack_word
+from .fastparse import _unpack_dword
+
+g_logger = logging.getLogger("sdb.parallel")
+
+
+# chunks are at least this many bytes, so that small databases aren't split into tiny tasks
+MIN_CHUNK_SIZE = 0x10000
+
+# chunks per worker, so that workers stay busy when some chunks take longer than others
+CHUNKS_PER_WORKER = 4
+
+# a root list, and the offsets of its children
+RootLayout = namedtuple("RootLayout", ["offset", "length", "tag", "children"])
+
+# the database of a worker process, set up by `_init_worker`
+g_db = None
+
+
+def _skip_junk(buf, offset, end, junk):
+    if not is_junk(buf, offset):
+        return offset
+    run = read_junk(buf, offset, end)
+    g_logger.warning("ignoring %d bytes [offset=%s]", run.length, hex(offset))
+    junk.append(run)
+    return offset + run.length
+
+
+def scan_roots(buf):
+    """
+    read the headers of the three roots and of their children, without decoding anything else.
+
+    Returns:
+      Tuple[List[RootLayout], List[JunkRange]]: the roots, and the runs of junk bytes
+        around the roots and between their children.
+
+    Raises:
+      InvalidSDBFileError: if a root isn't a list, or the file is truncated.
+    """
+    junk = []
+    roots = []
+    offset = SDB_HEADER_SIZE
+    try:
+        for _ in range(3):
+            offset = _skip_junk(buf, offset, len(buf), junk)
+            start = offset
+            tag = _unpack_word(buf, offset)[0]
+            if tag & TAG_TYPE_MASK != TAG_TYPE_LIST:
+                raise InvalidSDBFileError("expected list at offset %s" % hex(offset))
+            end = offset + 6 + _unpack_dword(buf, offset + 2)[0]
+
+            offset += 6
+            children = array.array("I")
+            while offset < end:
+                child = _skip_junk(buf, offset, end, junk)
+                if child != offset:
+                    offset = child
+                    continue
+                children.append(offset)
+                offset = skip_item(buf, offset)
+            if offset > len(buf):
+                raise InvalidSDBFileError("truncated item near offset %s" % hex(children[-1]))
+            roots.append(RootLayout(start, offset - start, tag, children))
+    except struct.error:
+        raise InvalidSDBFileError("truncated item near offset %s" % hex(offset))
+    return roots, junk
+
+
+def split_children(roots, chunk_size):
+    """
+    Yields:
+      Tuple[int, array.array]: the index of a root, and the offsets of a run of its children
+        spanning about `chunk_size` bytes.
+    """
+    for i, root in enumerate(roots):
+        children = root.children
+        start = 0
+        while start < len(children):
+            stop = bisect.bisect_left(children, children[start] + chunk_size, start + 1)
+            yield i, children[start:stop]
+            start = stop
+
+
+def _init_worker(sdb_path):
+    global g_db
+    g_db = LazySDB.open(sdb_path)
+
+
+def _build_chunk(task):
+    """
+    build a chunk within a worker process, from the database opened by `_init_worker`.
+    """
+    return build_chunk(g_db.buffer, task)
+
+
+def build_chunk(buf, task):
+    """
+    Args:
+      buf (memoryview): the contents of the database.
+      task (Tuple[int, array.array]): the index of a root, and the offsets of a run of its children.
+
+    Returns:
+      Tuple[int, Tuple[array.array]]: the index of the root, and the columns of the chunk,
+        whose node numbers are relative to the chunk. the children of the root are already
+        linked as siblings, so that only the first of them is linked when merging.
+    """
+    i, offsets = task
+    store = SDBNodeStore.__new__(SDBNodeStore)
+    store._set_buffer(buf)
+    store._init_columns()
+    for offset in offsets:
+        store._build(offset, 1)
+    roots = store.roots
+    next_siblings = store.next_siblings
+    for j in range(1, len(roots)):
+        next_siblings[roots[j - 1]] = roots[j]
+    return i, store.columns
+
+
+def _rebase(column, base, default):
+    """
+    offset the node numbers of a chunk column by `base`, replacing NO_NODE with `default`.
+    this is the serial part of the merge, so it's done in bulk when numpy is available.
+    """
+    if np is not None and len(column):
+        nodes = np.frombuffer(column, dtype=column.typecode)
+        rebased = np.where(nodes == NO_NODE, default, nodes + base).astype(nodes.dtype)
+        return array.array(column.typecode, rebased.tobytes())
+    return array.array(column.typecode, [default if v == NO_NODE else v + base for v in column])
+
+
+def merge_chunks(buf, roots, junk, results):
+    """
+    assemble a store from the roots and the columns of their chunks.
+
+    Args:
+      buf (memoryview): the contents of the database.
+      roots (List[RootLayout]): the roots, from `scan_roots`.
+      junk (List[JunkRange]): the runs of junk bytes found by `scan_roots`.
+      results (Iterable[Tuple[int, Tuple[array.array]]]): the columns of each chunk, in file order.
+
+    Returns:
+      SDBNodeStore: the store.
+    """
+    store = SDBNodeStore.__new__(SDBNodeStore)
+    store._set_buffer(buf)
+    store._init_columns()
+    junk = list(junk)
+
+    # node number of the most recent root, and of its most recent child
+    state = {"root": NO_NODE, "child": NO_NODE}
+
+    def add_root(root):
+        index = len(store.offsets)
+        store.offsets.append(root.offset)
+        store.lengths.append(root.length)
+        store.tags.append(root.tag)
+        store.parents.append(NO_NODE)
+        store.first_children.append(NO_NODE)
+        store.next_siblings.append(NO_NODE)
+        store.values.append(0)
+        if store.roots:
+            store.next_siblings[store.roots[-1]] = index
+        store.roots.append(index)
+        state["root"] = index
+        state["child"] = NO_NODE
+
+    for i, columns in results:
+        while len(store.roots) <= i:
+            add_root(roots[len(store.roots)])
+
+        chunk = dict(zip(COLUMNS, columns))
+        base = len(store.offsets)
+        store.offsets.extend(chunk["offsets"])
+        store.lengths.extend(chunk["lengths"])
+        store.tags.extend(chunk["tags"])
+        store.values.extend(chunk["values"])
+        store.parents.extend(_rebase(chunk["parents"], base, state["root"]))
+        store.first_children.extend(_rebase(chunk["first_children"], base, NO_NODE))
+        store.next_siblings.extend(_rebase(chunk["next_siblings"], base, NO_NODE))
+
+        # link the children of the root across chunks
+        local_roots = chunk["roots"]
+        if local_roots:
+            child = base + local_roots[0]
+            if state["child"] == NO_NODE:
+                store.first_children[state["root"]] = child
+            else:
+                store.next_siblings[state["child"]] = child
+            state["child"] = base + local_roots[-1]
+
+        junk.extend(JunkRange(o, n) for o, n in zip(chunk["junk_offsets"], chunk["junk_lengths"]))
+
+    while len(store.roots) < len(roots):
+        add_root(roots[len(store.roots)])
+
+    junk.sort()
+    for run in junk:
+        store.junk_offsets.append(run.offset)
+        store.junk_lengths.append(run.length)
+    return store
+
+
+def parse_parallel(sdb_path, workers=None, chunk_size=None):
+    """
+    parse the database at the given path into a `SDBNodeStore`, using a pool of worker processes.
+
+    Args:
+      sdb_path (str): the path to the database.
+      workers (int): the number of worker processes, or None for the number of CPUs.
+        when 1, the chunks are parsed in this process.
+      chunk_size (int): the approximate number of bytes given to a worker at a time,
+        or None to split the database into a few chunks per worker.
+
+    Returns:
+      SDBNodeStore: the parsed database, with the same columns as `SDBNodeStore.open(sdb_path)`.
+        the file remains mapped while the store is referenced.
+
+    Raises:
+      InvalidSDBFileError: if the file isn't a valid database.
+    """
+    buf = LazySDB.open(sdb_path).buffer
+    roots, junk = scan_roots(buf)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if chunk_size is None:
+        total = sum(root.length for root in roots)
+        chunk_size = max(MIN_CHUNK_SIZE, total // (workers * CHUNKS_PER_WORKER))
+    tasks = list(split_children(roots, chunk_size))
+    g_logger.debug("parsing %d chunks with %d workers", len(tasks), workers)
+
+    if workers == 1:
+        return merge_chunks(buf, roots, junk, (build_chunk(buf, task) for task in tasks))
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(sdb_path, ))
+    try:
+        store = merge_chunks(buf, roots, junk, pool.imap(_build_chunk, tasks))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return store
@@ -0,0 +1,429 @@
+"""
+path queries over parsed shim databases.
+
+a query is a sequence of steps separated by `/`, each naming a tag
+ (without the `TAG_` prefix) or `*`, optionally followed by predicates:
+
+    DATABASE/EXE[NAME="calc.exe"]/SHIM_REF/NAME
+    DATABASE/EXE[APP_NAME="Setup"][MATCHING_FILE]/MATCHING_FILE[0]/SIZE
+    DATABASE//MATCHING_FILE[SIZE>=0x1000][CHECKSUM!=0]
+    DATABASE/LIBRARY/SHIM/NAME[.="CorrectFilePaths"]
+
+`//` selects descendants, rather than children. predicates are:
+
+  - `[TAG op literal]`: some child with the tag has a value that compares as given,
+  - `[. op literal]`: the value of the item itself compares as given,
+  - `[TAG]`: some child has the tag,
+  - `[n]`: the n-th (from zero) item selected by the step within its parent.
+
+operators are `=`, `!=`, `<`, `<=`, `>`, and `>=`. literals are quoted strings,
+ compared case-insensitively with string values (or as hex with binary values),
+ and decimal or `0x` hexadecimal integers.
+
+queries are compiled once with `compile_query`, and may be evaluated against
+ databases parsed by the fast, lazy, or columnar engines. results are produced lazily.
+ when evaluating against a `LazySDB`, equality predicates on indexed keys (such as
+ `DATABASE/EXE[NAME="calc.exe"]`) are answered using the INDEXES section instead of
+ scanning every EXE.
+"""
+import re
+import numbers
+import logging
+import binascii
+from collections import namedtuple
+
+from .sdb import SDB_TAGS
+from .lazy import LazySDB
+from .strtab import SDBStringTable
+from .indexes import SDBIndexes
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_BINARY
+
+g_logger = logging.getLogger("sdb.query")
+
+
+class InvalidQueryError(ValueError):
+    pass
+
+
+AXIS_CHILD = "child"
+AXIS_DESCENDANT = "descendant"
+
+PREDICATE_COMPARE = "compare"
+PREDICATE_EXISTS = "exists"
+PREDICATE_POSITION = "position"
+
+# `tag` is None for the wildcard step `*`
+QueryStep = namedtuple("QueryStep", ["axis", "tag", "predicates"])
+# `tag` is None for comparisons against the item itself (`.`)
+QueryPredicate = namedtuple("QueryPredicate", ["kind", "tag", "op", "value"])
+
+
+_OPERATORS = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+      (?P<descendant>//)
+     |(?P<slash>/)
+     |(?P<lbracket>\[)
+     |(?P<rbracket>\])
+     |(?P<op>!=|<=|>=|=|<|>)
+     |(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+     |(?P<number>0[xX][0-9a-fA-F]+|[0-9]+)
+     |(?P<name>[A-Za-z_][A-Za-z0-9_]*|\*|\.)
+    )""", re.VERBOSE)
+
+
+def _tokenize(text):
+    offset = 0
+    text = text.rstrip()
+    while offset < len(text):
+        m = _TOKEN_RE.match(text, offset)
+        if m is None:
+            raise InvalidQueryError("unexpected character at position %d: %s" % (offset, text[offset:]))
+        offset = m.end()
+        kind = m.lastgroup
+        yield kind, m.group(kind)
+
+
+def get_tag_by_name(name):
+    """
+    find the tag with the given name, with or without the `TAG_` prefix.
+
+    Raises:
+      InvalidQueryError: if there's no such tag.
+    """
+    if not name.startswith("TAG_"):
+        name = "TAG_" + name
+    tag = getattr(SDB_TAGS, name, None)
+    if not isinstance(tag, numbers.Integral):
+        raise InvalidQueryError("unknown tag: %s" % name)
+    return tag
+
+
+def _parse_literal(kind, text):
+    if kind == "string":
+        return re.sub(r"\\(.)", r"\1", text[1:-1])
+    elif kind == "number":
+        return int(text, 0x10 if text[:2] in ("0x", "0X") else 10)
+    raise InvalidQueryError("expected a literal, found: %s" % text)
+
+
+class _Parser(object):
+    def __init__(self, text):
+        self._tokens = list(_tokenize(text))
+        self._index = 0
+
+    def _peek(self):
+        if self._index < len(self._tokens):
+            return self._tokens[self._index]
+        return None, None
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise InvalidQueryError("unexpected end of query")
+        self._index += 1
+        return token
+
+    def _expect(self, kind):
+        token_kind, text = self._next()
+        if token_kind != kind:
+            raise InvalidQueryError("expected %s, found: %s" % (kind, text))
+        return text
+
+    def parse(self):
+        steps = []
+        kind, _ = self._peek()
+        if kind == "slash":
+            self._next()
+        while True:
+            axis = AXIS_CHILD
+            if self._peek()[0] == "descendant":
+                self._next()
+                axis = AXIS_DESCENDANT
+            steps.append(self._parse_step(axis))
+
+            kind, text = self._peek()
+            if kind is None:
+                return steps
+            elif kind == "slash":
+                self._next()
+            elif kind != "descendant":
+                raise InvalidQueryError("unexpected token: %s" % text)
+
+    def _parse_step(self, axis):
+        name = self._expect("name")
+        if name == ".":
+            raise InvalidQueryError("`.` may only appear within a predicate")
+        tag = None if name == "*" else get_tag_by_name(name)
+
+        predicates = []
+        while self._peek()[0] == "lbracket":
+            self._next()
+            predicates.append(self._parse_predicate())
+            self._expect("rbracket")
+        return QueryStep(axis, tag, tuple(predicates))
+
+    def _parse_predicate(self):
+        kind, text = self._next()
+        if kind == "number":
+            return QueryPredicate(PREDICATE_POSITION, None, None, _parse_literal(kind, text))
+        elif kind != "name" or text == "*":
+            raise InvalidQueryError("expected a tag name or position, found: %s" % text)
+
+        tag = None if text == "." else get_tag_by_name(text)
+        if self._peek()[0] != "op":
+            if tag is None:
+                raise InvalidQueryError("expected an operator after `.`")
+            return QueryPredicate(PREDICATE_EXISTS, tag, None, None)
+
+        op = self._next()[1]
+        kind, text = self._next()
+        return QueryPredicate(PREDICATE_COMPARE, tag, op, _parse_literal(kind, text))
+
+
+class SDBQuery(object):
+    """
+    a compiled query. use `compile_query` to construct one.
+    """
+    def __init__(self, text, steps):
+        self.text = text
+        self.steps = steps
+
+    def evaluate(self, db, strings=None):
+        """
+        find the items selected by the query.
+
+        Args:
+          db (Union[sdb.FastSDB, sdb.LazySDB, sdb.SDBNodeStore]): the database.
+          strings (sdb.SDBStringTable): the string table of the database, if already loaded.
+
+        Returns:
+          Iterator[node]: the selected items, lazily.
+        """
+        return _Evaluator(db, strings).evaluate(self.steps)
+
+    def __str__(self):
+        return "SDBQuery(%s)" % (self.text)
+
+    __repr__ = __str__
+
+
+def compile_query(text):
+    """
+    Raises:
+      InvalidQueryError: if the query is malformed.
+    """
+    return SDBQuery(text, tuple(_Parser(text).parse()))
+
+
+def query(db, text):
+    """
+    compile and evaluate the given query.
+
+    Returns:
+      Iterator[node]: the selected items, lazily.
+    """
+    return compile_query(text).evaluate(db)
+
+
+def _coerce(tag, value, literal):
+    """
+    convert a resolved item value into a form comparable with the given literal.
+
+    Returns:
+      Tuple[Any, Any]: the value and literal, or None if they aren't comparable.
+    """
+    t = tag & TAG_TYPE_MASK
+    if isinstance(literal, numbers.Integral):
+        if isinstance(value, numbers.Integral):
+            return value, literal
+        return None
+    if t == TAG_TYPE_STRINGREF or t == TAG_TYPE_STRING:
+        if value is None:
+            return None
+        return value.upper(), literal.upper()
+    elif t == TAG_TYPE_BINARY:
+        h = binascii.hexlify(bytearray(value)).decode("ascii")
+        return h, literal.replace("-", "").lower()
+    return None
+
+
+class _Evaluator(object):
+    def __init__(self, db, strings):
+        self._db = db
+        if strings is None and not isinstance(db, LazySDB):
+            strings = SDBStringTable.from_buffer(db.buffer, db.strtab_root.offset)
+        self._strings = strings
+        self._indexes = None
+
+    def _get_indexes(self):
+        if self._indexes is None:
+            self._indexes = SDBIndexes(self._db)
+        return self._indexes
+
+    def get_value(self, node):
+        if node.tag & TAG_TYPE_MASK == TAG_TYPE_STRINGREF:
+            try:
+                if self._strings is not None:
+                    return self._strings.get(node.value)
+                return self._db.get_string(node.value)
+            except KeyError:
+                return None
+        return node.value
+
+    def _compare(self, node, op, literal):
+        if node.children is not None:
+            return False
+        pair = _coerce(node.tag, self.get_value(node), literal)
+        if pair is None:
+            return False
+        return _OPERATORS[op](*pair)
+
+    def _matches(self, node, predicate):
+        if predicate.kind == PREDICATE_EXISTS:
+            if node.children is None:
+                return False
+            for _ in node.get_children(predicate.tag):
+                return True
+            return False
+
+        elif predicate.kind == PREDICATE_COMPARE:
+            if predicate.tag is None:
+                return self._compare(node, predicate.op, predicate.value)
+            if node.children is None:
+                return False
+            for c in node.get_children(predicate.tag):
+                if self._compare(c, predicate.op, predicate.value):
+                    return True
+            return False
+
+        raise RuntimeError("unexpected predicate: %s" % (predicate.kind))
+
+    def _iter_descendants(self, node):
+        stack = [iter(node.children)]
+        while stack:
+            for c in stack[-1]:
+                yield c
+                if c.children is not None:
+                    stack.append(iter(c.children))
+                break
+            else:
+                stack.pop()
+
+    def _iter_indexed(self, context, step):
+        """
+        use the on-disk indexes to find the candidates for a step like `EXE[NAME="calc.exe"]`
+         among the children of DATABASE.
+
+        Returns:
+          Optional[List[node]]: the candidates, in file order, or None if no index applies.
+        """
+        if not isinstance(self._db, LazySDB):
+            return None
+        if step.axis != AXIS_CHILD or step.tag is None:
+            return None
+        if context.offset != self._db.database_root.offset:
+            return None
+
+        indexes = self._get_indexes()
+        for predicate in step.predicates:
+            if predicate.kind == PREDICATE_POSITION:
+                # positions are relative to all the matching children, not the candidates.
+                return None
+
+        for predicate in step.predicates:
+            if predicate.kind != PREDICATE_COMPARE or predicate.op != "=" or predicate.tag is None:
+                continue
+            if (step.tag, predicate.tag) not in indexes:
+                continue
+
+            value = predicate.value
+            t = predicate.tag & TAG_TYPE_MASK
+            if t == TAG_TYPE_BINARY:
+                if isinstance(value, numbers.Integral):
+                    continue
+                try:
+                    value = binascii.unhexlify(value.replace("-", ""))
+                except (TypeError, ValueError):
+                    continue
+            elif t == TAG_TYPE_STRINGREF or t == TAG_TYPE_STRING:
+                if isinstance(value, numbers.Integral):
+                    continue
+            elif not isinstance(value, numbers.Integral):
+                continue
+
+            g_logger.debug("using index (0x%x, 0x%x)", step.tag, predicate.tag)
+            candidates = list(indexes.lookup(step.tag, predicate.tag, value))
+            candidates.sort(key=lambda c: c.offset)
+            return candidates
+        return None
+
+    def _iter_step(self, context, step):
+        candidates = None
+        if context is not None:
+            candidates = self._iter_indexed(context, step)
+
+        if candidates is None:
+            if context is None:
+                # the top level: the three roots
+                candidates = (self._db.indexes_root, self._db.database_root, self._db.strtab_root)
+                if step.axis == AXIS_DESCENDANT:
+                    candidates = self._iter_roots_and_descendants(candidates)
+            elif context.children is None:
+                return
+            elif step.axis == AXIS_DESCENDANT:
+                candidates = self._iter_descendants(context)
+            elif step.tag is not None:
+                # the columnar engine can match children by tag without creating views
+                candidates = context.get_children(step.tag)
+            else:
+                candidates = context.children
+
+            if step.tag is not None and (context is None or step.axis == AXIS_DESCENDANT):
+                candidates = (c for c in candidates if c.tag == step.tag)
+
+        for predicate in step.predicates:
+            if predicate.kind == PREDICATE_POSITION:
+                candidates = self._select_position(candidates, predicate.value)
+            else:
+                candidates = self._filter(candidates, predicate)
+
+        for c in candidates:
+            yield c
+
+    def _iter_roots_and_descendants(self, roots):
+        for root in roots:
+            yield root
+            for c in self._iter_descendants(root):
+                yield c
+
+    def _select_position(self, candidates, position):
+        for i, c in enumerate(candidates):
+            if i == position:
+                yield c
+                return
+
+    def _filter(self, candidates, predicate):
+        for c in candidates:
+            if self._matches(c, predicate):
+                yield c
+
+    def evaluate(self, steps, context=None):
+        step = steps[0]
+        for node in self._iter_step(context, step):
+            if len(steps) == 1:
+                yield node
+            else:
+                for result in self.evaluate(steps[1:], node):
+                    yield result
@@ -0,0 +1,288 @@
+"""
+resolution of the *_TAGID references between items.
+
+a TAGID is the file offset of the referenced item. rather than indexing
+ every item by offset, `SDBTagIdResolver` records only the items that
+ references can point to (SHIM, PATCH, FLAG, LAYER, MSI_TRANSFORM) in a sorted
+ offset array, and resolves references by bisection.
+"""
+import array
+import bisect
+import logging
+from collections import namedtuple
+
+from .sdb import SDB
+from .sdb import SDB_TAGS
+from .lazy import LazySDB
+from .stream import EVENT_LEAF
+from .stream import EVENT_ENTER_LIST
+from .stream import iter_item_events
+from .columnar import SDBNodeStore
+
+g_logger = logging.getLogger("sdb.refs")
+
+
+# map from reference tag to the tag of the item it refers to
+REFERENCE_TARGETS = {
+    SDB_TAGS.TAG_SHIM_TAGID: SDB_TAGS.TAG_SHIM,
+    SDB_TAGS.TAG_PATCH_TAGID: SDB_TAGS.TAG_PATCH,
+    SDB_TAGS.TAG_FLAG_TAGID: SDB_TAGS.TAG_FLAG,
+    SDB_TAGS.TAG_LAYER_TAGID: SDB_TAGS.TAG_LAYER,
+    SDB_TAGS.TAG_MSI_TRANSFORM_TAGID: SDB_TAGS.TAG_MSI_TRANSFORM,
+}
+
+REFERENCEABLE_TAGS = frozenset(REFERENCE_TARGETS.values())
+
+# map from reference list tag to the tag of its *_TAGID child.
+# LAYER_TAGID appears directly, rather than within a list.
+REFERENCE_LISTS = {
+    SDB_TAGS.TAG_SHIM_REF: SDB_TAGS.TAG_SHIM_TAGID,
+    SDB_TAGS.TAG_PATCH_REF: SDB_TAGS.TAG_PATCH_TAGID,
+    SDB_TAGS.TAG_FLAG_REF: SDB_TAGS.TAG_FLAG_TAGID,
+    SDB_TAGS.TAG_MSI_TRANSFORM_REF: SDB_TAGS.TAG_MSI_TRANSFORM_TAGID,
+}
+
+
+# a reference that doesn't resolve.
+# `offset` is the offset of the *_TAGID item, and `tagid` its value.
+DanglingReference = namedtuple("DanglingReference", ["offset", "tag", "tagid"])
+
+
+def walk_vstruct(item, offset, visit):
+    """
+    invoke `visit(offset, item)` for the given `SDBItem` and its descendants.
+    junk items are skipped.
+
+    `len(item)` accounts for padding that `vsParse` doesn't consume,
+     so we compute the offsets from the parsed sizes instead.
+
+    Returns:
+      int: the offset following the item.
+    """
+    if not item.vsHasField("header"):
+        # a run of junk bytes
+        return offset + len(item)
+
+    visit(offset, item)
+    v = item.value
+    if v.vsHasField("children"):
+        o = offset + 6
+        for _, c in v.children:
+            o = walk_vstruct(c, o, visit)
+        return o
+    elif v.vsHasField("size"):
+        return offset + 6 + v.size
+    else:
+        return offset + 2 + len(v)
+
+
+def walk_nodes(node, visit):
+    """
+    invoke `visit(node)` for the given `SDBNode` and its descendants.
+    """
+    visit(node)
+    if node.children is not None:
+        for c in node.children:
+            walk_nodes(c, visit)
+
+
+def _vstruct_database_offset(db):
+    return walk_vstruct(db.indexes_root, len(db.header), lambda offset, item: None)
+
+
+def iter_references(db):
+    """
+    yield all the *_TAGID references in the DATABASE of the given database.
+
+    Args:
+      db (Union[sdb.SDB, sdb.FastSDB, sdb.LazySDB, sdb.SDBNodeStore]): the database.
+
+    Yields:
+      Tuple[int, int, int]: the offset and tag of the *_TAGID item, and its value.
+    """
+    if isinstance(db, SDB):
+        refs = []
+
+        def visit(offset, item):
+            tag = item.header.tag
+            if tag in REFERENCE_TARGETS:
+                refs.append((offset, tag, item.value.value))
+
+        walk_vstruct(db.database_root, _vstruct_database_offset(db), visit)
+        for ref in refs:
+            yield ref
+
+    elif isinstance(db, LazySDB):
+        for kind, offset, _, tag, value in iter_item_events(db.buffer, db.database_root.offset):
+            if kind == EVENT_LEAF and tag in REFERENCE_TARGETS:
+                yield offset, tag, value
+
+    elif isinstance(db, SDBNodeStore):
+        root = db.database_root
+        start = root.index
+        end = bisect.bisect_left(db.offsets, root.offset + root.length, start)
+        tags = db.tags
+        for i in range(start, end):
+            if tags[i] in REFERENCE_TARGETS:
+                yield int(db.offsets[i]), tags[i], db.get_value(i)
+
+    else:
+        refs = []
+
+        def visit(node):
+            if node.tag in REFERENCE_TARGETS:
+                refs.append((node.offset, node.tag, node.value))
+
+        walk_nodes(db.database_root, visit)
+        for ref in refs:
+            yield ref
+
+
+def node_store_loader(store):
+    """
+    create a loader for `SDBTagIdResolver` that fetches items from the given `SDBNodeStore`.
+    node offsets are sorted and unique, so the node is found by bisection.
+    """
+    def load(offset):
+        return store.node(bisect.bisect_left(store.offsets, offset))
+    return load
+
+
+class SDBTagIdResolver(object):
+    """
+    resolve *_TAGID references to the items they refer to.
+
+    use `SDBTagIdResolver.from_db` to construct one.
+    `items` holds the referenceable items, or, if None, `loader(offset)` fetches them on demand.
+    """
+    def __init__(self, offsets, tags, items=None, loader=None):
+        self._offsets = offsets
+        self._tags = tags
+        self._items = items
+        self._loader = loader
+
+    @classmethod
+    def from_db(cls, db):
+        """
+        index the referenceable items in the DATABASE of the given database.
+
+        Args:
+          db (Union[sdb.SDB, sdb.FastSDB, sdb.LazySDB, sdb.SDBNodeStore]): the database.
+        """
+        offsets = array.array("I")
+        tags = array.array("H")
+
+        if isinstance(db, SDB):
+            items = []
+
+            def visit(offset, item):
+                if item.header.tag in REFERENCEABLE_TAGS:
+                    offsets.append(offset)
+                    tags.append(item.header.tag)
+                    items.append(item)
+
+            walk_vstruct(db.database_root, _vstruct_database_offset(db), visit)
+            return cls(offsets, tags, items=items)
+
+        elif isinstance(db, LazySDB):
+            for kind, offset, _, tag, _ in iter_item_events(db.buffer, db.database_root.offset):
+                if kind == EVENT_ENTER_LIST and tag in REFERENCEABLE_TAGS:
+                    offsets.append(offset)
+                    tags.append(tag)
+            return cls(offsets, tags, loader=db.item_at)
+
+        elif isinstance(db, SDBNodeStore):
+            root = db.database_root
+            end = bisect.bisect_left(db.offsets, root.offset + root.length, root.index)
+            for i in range(root.index, end):
+                if db.tags[i] in REFERENCEABLE_TAGS:
+                    offsets.append(db.offsets[i])
+                    tags.append(db.tags[i])
+            return cls(offsets, tags, loader=node_store_loader(db))
+
+        else:
+            items = []
+
+            def visit(node):
+                if node.tag in REFERENCEABLE_TAGS:
+                    offsets.append(node.offset)
+                    tags.append(node.tag)
+                    items.append(node)
+
+            walk_nodes(db.database_root, visit)
+            return cls(offsets, tags, items=items)
+
+    @property
+    def columns(self):
+        """
+        the arrays of referenceable item offsets and their tags.
+        """
+        return self._offsets, self._tags
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _find(self, tagid):
+        i = bisect.bisect_left(self._offsets, tagid)
+        if i == len(self._offsets) or self._offsets[i] != tagid:
+            raise KeyError("no referenceable item at %s" % hex(tagid))
+        return i
+
+    def __contains__(self, tagid):
+        try:
+            self._find(tagid)
+        except KeyError:
+            return False
+        return True
+
+    def get_tag(self, tagid):
+        """
+        fetch the tag of the referenceable item at the given offset.
+        """
+        return self._tags[self._find(tagid)]
+
+    def get_item(self, tagid):
+        """
+        fetch the referenceable item (SHIM, PATCH, FLAG, LAYER, MSI_TRANSFORM) at the given offset.
+
+        Raises:
+          KeyError: if there's no such item at the offset.
+        """
+        i = self._find(tagid)
+        if self._items is not None:
+            return self._items[i]
+        return self._loader(tagid)
+
+    def resolve(self, ref_tag, tagid):
+        """
+        resolve a reference, checking that it points to the expected kind of item.
+
+        Args:
+          ref_tag (int): the tag of the reference, such as `SDB_TAGS.TAG_SHIM_TAGID`.
+          tagid (int): the value of the reference.
+
+        Raises:
+          KeyError: if the reference is dangling.
+        """
+        expected = REFERENCE_TARGETS[ref_tag]
+        if self.get_tag(tagid) != expected:
+            raise KeyError("item at %s is not a 0x%x" % (hex(tagid), expected))
+        return self.get_item(tagid)
+
+    def is_dangling(self, ref_tag, tagid):
+        try:
+            return self.get_tag(tagid) != REFERENCE_TARGETS[ref_tag]
+        except KeyError:
+            return True
+
+    def find_dangling(self, db):
+        """
+        find the references in the given database (the one this resolver indexed)
+         that don't point to an item of the expected kind.
+
+        Returns:
+          List[DanglingReference]: the unresolved references.
+        """
+        return [DanglingReference(offset, tag, tagid)
+                for offset, tag, tagid in iter_references(db)
+                if self.is_dangling(tag, tagid)]
@@ -0,0 +1,208 @@
+"""
+shim databases kept parsed in memory by a long-running process, and reloaded when their files change.
+
+a `ResidentSDB` is a snapshot of one file: its contents are read into memory (rather than
+ mapped, so that rewriting the file can't change or truncate a snapshot that's in use),
+ fully decoded, and indexed for matching. a `SDBRegistry` holds the current snapshot of
+ each of a set of files. `SDBRegistry.reload` builds a new snapshot and then swaps it in,
+ so readers that hold the previous snapshot are never blocked or disturbed.
+
+changes are detected by the modification time and size of each file, and confirmed by
+ the SHA-256 of the contents, so merely touching a file doesn't cause a re-parse.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from collections import OrderedDict
+
+from .sdb import InvalidSDBFileError
+from .lazy import LazySDB
+from .refs import walk_nodes
+from .strtab import SDBStringTable
+from .indexes import SDBIndexes
+from .matching import SDBMatcher
+
+g_logger = logging.getLogger("sdb.resident")
+
+
+FileSignature = namedtuple("FileSignature", ["mtime", "size"])
+
+
+def get_signature(path):
+    """
+    Raises:
+      OSError: if the file cannot be accessed.
+    """
+    st = os.stat(path)
+    return FileSignature(st.st_mtime, st.st_size)
+
+
+def _ignore(node):
+    pass
+
+
+class ResidentSDB(object):
+    """
+    a fully decoded and indexed database. a snapshot isn't modified once constructed,
+     so it may be shared by any number of readers.
+    """
+    def __init__(self, path, buf, digest):
+        self.path = path
+        self.digest = digest
+        self.size = len(buf)
+        # seconds since the epoch at which the snapshot was built
+        self.loaded = time.time()
+
+        self.db = LazySDB(buf)
+        # decode everything now, so that no request pays for it later
+        for root in (self.db.indexes_root, self.db.database_root, self.db.strtab_root):
+            walk_nodes(root, _ignore)
+        self.strings = SDBStringTable.from_buffer(self.db.buffer, self.db.strtab_root.offset)
+        self.indexes = SDBIndexes(self.db)
+        self.matcher = SDBMatcher(self.db, strings=self.strings)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Raises:
+          InvalidSDBFileError: if the file cannot be parsed.
+          IOError: if the file cannot be read.
+        """
+        with open(path, "rb") as f:
+            buf = f.read()
+        return cls(path, buf, hashlib.sha256(buf).hexdigest())
+
+    def get_string(self, reference):
+        return self.strings.get(reference)
+
+
+class SDBRegistry(object):
+    """
+    the current snapshots of a set of database files, by name.
+
+    lookups are lock-free: `get` returns whichever snapshot is current,
+     and a concurrent `reload` only replaces the registry's reference to it.
+    """
+    def __init__(self):
+        # map from name to path
+        self._paths = OrderedDict()
+        # map from name to `ResidentSDB`
+        self._snapshots = {}
+        # map from name to the `FileSignature` of the file when it was last read
+        self._signatures = {}
+        # map from name to the reason the most recent reload failed
+        self.errors = {}
+        # reloads are serialized, so that a file isn't parsed twice at once
+        self._lock = threading.Lock()
+
+    def add(self, path, name=None):
+        """
+        load the database at the given path, and serve it under the given name
+         (by default, its file name).
+
+        Raises:
+          ValueError: if the name is already in use.
+          InvalidSDBFileError: if the file cannot be parsed.
+          IOError: if the file cannot be read.
+        """
+        if name is None:
+            name = os.path.basename(path)
+        if name in self._paths:
+            raise ValueError("duplicate database name: %s" % (name))
+
+        signature = get_signature(path)
+        snapshot = ResidentSDB.load(path)
+        self._paths[name] = path
+        self._snapshots[name] = snapshot
+        self._signatures[name] = signature
+        g_logger.info("loaded %s from %s (%d bytes)", name, path, snapshot.size)
+        return name
+
+    def names(self):
+        return list(self._paths.keys())
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    def __len__(self):
+        return len(self._paths)
+
+    def get(self, name):
+        """
+        Returns:
+          ResidentSDB: the current snapshot of the named database.
+
+        Raises:
+          KeyError: if there's no database with the given name.
+        """
+        return self._snapshots[name]
+
+    def is_stale(self, name):
+        """
+        has the file changed since it was last read? missing files aren't stale,
+         so that the last good snapshot is served while a file is being replaced.
+        """
+        try:
+            signature = get_signature(self._paths[name])
+        except OSError:
+            return False
+        return signature != self._signatures[name]
+
+    def stale(self):
+        """
+        Returns:
+          List[str]: the names of the databases whose files have changed.
+        """
+        return [name for name in self._paths if self.is_stale(name)]
+
+    def reload(self, name):
+        """
+        re-read the named database and, if its contents changed, swap in a new snapshot.
+        may be called from a background thread. if the file can't be parsed,
+         the previous snapshot remains current and the error is recorded in `errors`.
+
+        Returns:
+          bool: True if a new snapshot was swapped in.
+
+        Raises:
+          KeyError: if there's no database with the given name.
+        """
+        path = self._paths[name]
+        with self._lock:
+            try:
+                signature = get_signature(path)
+                with open(path, "rb") as f:
+                    buf = f.read()
+            except (IOError, OSError) as e:
+                g_logger.warning("failed to read %s: %s", path, str(e))
+                self.errors[name] = str(e)
+                return False
+
+            # if the file changes again while it's read, the signature won't match,
+            #  so it's read again on the next check.
+            self._signatures[name] = signature
+            digest = hashlib.sha256(buf).hexdigest()
+            if digest == self._snapshots[name].digest:
+                g_logger.debug("contents of %s are unchanged", path)
+                return False
+
+            try:
+                snapshot = ResidentSDB(path, buf, digest)
+            except InvalidSDBFileError as e:
+                g_logger.warning("failed to parse %s, keeping the previous version: %s", path, str(e))
+                self.errors[name] = "not an SDB file: %s" % (str(e))
+                return False
+            except Exception as e:
+                # a damaged file may fail in any number of ways,
+                #  and shouldn't take down the process serving the others.
+                g_logger.warning("failed to parse %s, keeping the previous version: %s", path, str(e))
+                self.errors[name] = "%s: %s" % (e.__class__.__name__, str(e))
+                return False
+
+            self._snapshots[name] = snapshot
+            self.errors.pop(name, None)
+            g_logger.info("reloaded %s from %s (%d bytes)", name, path, snapshot.size)
+            return True
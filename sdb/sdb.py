@@ -1,3 +1,4 @@
+import re
 import logging
 import sys
 
@@ -176,6 +177,84 @@ SDB_TAGS.TAG_INDEX_KEY = (0x803 | SDB_TAG_TYPES.TAG_TYPE_WORD)
 SDB_KNOWN_TAGS = set([c & 0xFF for c in SDB_TAGS._vs_reverseMap.keys()])
 
 
+def get_tag_name(tag):
+    """
+    format the name of a tag without its `TAG_` prefix, such as `EXE`,
+     or `UNKNOWN_0x...` for a tag that isn't known.
+    """
+    name = SDB_TAGS.vsReverseMapping(tag)
+    if name is None:
+        return "UNKNOWN_%s" % (hex(tag & 0xFFFF))
+    return str(name.partition("TAG_")[2])
+
+
+def format_guid(value):
+    """
+    format the 16 bytes of a GUID, such as an EXE_ID or DATABASE_ID, in the usual form.
+    """
+    # under python 2.x, indexing a memoryview yields a str
+    h = bytearray(value)
+    return "%02x%02x%02x%02x-%02x%02x-%02x%02x-%02x%02x-%02x%02x%02x%02x%02x%02x" % \
+        (h[3], h[2], h[1], h[0],
+        h[5], h[4],
+        h[7], h[6],
+        h[8], h[9],
+        h[10], h[11], h[12], h[13], h[14], h[15])
+
+
+def _byte_class(values):
+    return b"[" + b"".join(("\\x%02x" % v).encode("ascii") for v in sorted(values)) + b"]"
+
+
+# matches at each offset that looks like an item header: either the first byte
+#  is a known tag, or the second byte has a known type nibble.
+_ITEM_HEADER = re.compile(
+    _byte_class(SDB_KNOWN_TAGS) + b"|[\\x00-\\xff]" +
+    _byte_class(v for v in range(0x100) if (v & 0xF0) << 8 in SDB_KNOWN_TAG_TYPES))
+
+# python 2.x can't search a memoryview, so copies of windows of this size are searched instead
+RESYNC_WINDOW = 0x1000
+
+
+def _search_item_header(bytez, offset, end):
+    try:
+        m = _ITEM_HEADER.search(bytez, offset, end)
+        return None if m is None else m.start()
+    except TypeError:
+        pass
+
+    while offset < end:
+        window = bytearray(bytez[offset:min(end, offset + RESYNC_WINDOW + 1)])
+        m = _ITEM_HEADER.search(window)
+        if m is not None:
+            return offset + m.start()
+        offset += RESYNC_WINDOW
+    return None
+
+
+def find_item_header(bytez, offset, end):
+    """
+    find the next offset that looks like an item header, skipping a run of junk bytes
+     with a single search rather than checking one byte at a time.
+    uses the same heuristic as `SDBItem.vsParse`.
+
+    Args:
+      bytez (Union[bytes, bytearray, mmap, memoryview]): the contents of the database.
+      offset (int): the offset of the first junk byte.
+      end (int): the end of the enclosing list; the run doesn't extend beyond it.
+
+    Returns:
+      int: the offset of the next plausible item header, or `end` when there's none.
+        the run stops before the last byte of the buffer, which can't be classified alone,
+        so a truncated item there is still reported by the caller.
+    """
+    limit = min(end, len(bytez) - 1)
+    found = _search_item_header(bytez, offset, limit + 1)
+    if found is None or found > limit:
+        return limit
+    return found
+
+
 class SDBItemHeader(vstruct.VStruct):
     def __init__(self):
         vstruct.VStruct.__init__(self)
@@ -208,7 +287,7 @@ class SDBItemArray(vstruct.VArray):
         #   buffer
         start_offset = offset
         while offset - start_offset < self.size:
-            i = SDBItem()
+            i = SDBItem(end=start_offset + self.size)
             offset = i.vsParse(bytez, offset=offset)
             self.vsAddElement(i)
         return offset
@@ -308,8 +387,13 @@ def getItemClass(header):
 
 
 class SDBItem(vstruct.VStruct):
-    def __init__(self):
+    def __init__(self, end=None):
+        """
+        Args:
+          end (int): the end of the enclosing list, which bounds a run of junk bytes.
+        """
         vstruct.VStruct.__init__(self)
+        self._end = end
         # this is what we *should* have
         # however, empirically, it seems there are occasionally
         #   junk bytes in the file. we can only detect this by
@@ -326,9 +410,11 @@ class SDBItem(vstruct.VStruct):
         b2 = bytez[offset+1]
 
         if b1 not in SDB_KNOWN_TAGS and (b2 & 0xF0) << 8 not in SDB_KNOWN_TAG_TYPES:
-            g_logger.warning("ignoring byte [offset=%s]: 0x%02x 0x%02x",
-                    hex(offset), b1, b2)
-            self.vsAddField("unknown", v_uint8())
+            # a run of junk bytes becomes a single item
+            end = find_item_header(bytez, offset, len(bytez) if self._end is None else self._end)
+            g_logger.warning("ignoring %d bytes [offset=%s]: 0x%02x 0x%02x",
+                    end - offset, hex(offset), b1, b2)
+            self.vsAddField("unknown", v_bytes(size=end - offset))
         else:
             self.vsAddField("header", SDBItemHeader())
             self.vsAddField("value", SDBValueNull())
@@ -0,0 +1,268 @@
+"""
+substring and wildcard search over the strings of a shim database.
+
+the searchable strings are the entries of the STRINGTABLE and the values of inline
+ TAG_TYPE_STRING items. each string is broken into trigrams (three consecutive
+ characters, lowercased), and each trigram maps to the sorted ids of the strings that
+ contain it. a search intersects the postings of the trigrams of its literal parts,
+ and only the remaining candidates are decoded and compared, so few strings are touched.
+ patterns without any literal part of three or more characters fall back to a scan.
+
+each string also maps to the items that hold it: the TAG_TYPE_STRINGREF items that
+ reference a string table entry, or the inline item itself. results are reported as
+ the offsets (TAGIDs) of those items, along with their tags.
+
+all of the index is held in flat arrays (see `SDBStringIndex.columns`) that refer into
+ the buffer of the database, so it can be persisted alongside it, such as by `sdb.SDBCache`.
+"""
+import array
+import bisect
+import logging
+from collections import namedtuple
+
+from .strtab import SDBStringTable
+from .columnar import QWORD_TYPECODE
+from .matching import compile_pattern
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import normalize_tags
+from .fastparse import _unpack_dword
+from .stream import EVENT_LEAF
+from .stream import iter_item_events
+
+g_logger = logging.getLogger("sdb.search")
+
+
+# a string that matched a search.
+# `reference` is the TAG_TYPE_STRINGREF reference of a string table entry, or None for an inline string.
+# `items` and `tags` are the offsets and tags of the items that hold the string.
+StringMatch = namedtuple("StringMatch", ["text", "reference", "items", "tags"])
+
+
+def decode_string(raw):
+    return raw.decode("utf-16le").split(u"\x00")[0]
+
+
+def iter_trigrams(text):
+    """
+    Yields:
+      int: a key for each trigram of the lowercased text.
+    """
+    codes = [ord(c) for c in text.lower()]
+    for i in range(len(codes) - 2):
+        yield (codes[i] << 42) | (codes[i + 1] << 21) | codes[i + 2]
+
+
+def _split_literals(pattern):
+    """
+    the runs of characters of a wildcard pattern between `*` and `?`.
+    """
+    return pattern.replace("?", "*").split("*")
+
+
+def _intersect(a, b):
+    """
+    intersect two sorted sequences of ids.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    out = []
+    lo = 0
+    for v in a:
+        lo = bisect.bisect_left(b, v, lo)
+        if lo == len(b):
+            break
+        if b[lo] == v:
+            out.append(v)
+    return out
+
+
+class SDBStringIndex(object):
+    """
+    a trigram index over the strings of a database.
+
+    use `SDBStringIndex.from_db` to construct one.
+    """
+    def __init__(self, buf, refs, starts, sizes, item_starts, items, item_tags, grams, gram_starts, postings):
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        self._buf = buf
+        # the references of the string table entries, which are the first strings, by id
+        self._refs = refs
+        # the offsets and sizes of the UTF-16LE data of each string, by id
+        self._starts = starts
+        self._sizes = sizes
+        # the items that hold string `i` are `items[item_starts[i]:item_starts[i + 1]]`
+        self._item_starts = item_starts
+        self._items = items
+        self._item_tags = item_tags
+        # the strings with trigram `grams[j]` are `postings[gram_starts[j]:gram_starts[j + 1]]`
+        self._grams = grams
+        self._gram_starts = gram_starts
+        self._postings = postings
+
+    @classmethod
+    def from_db(cls, db, strings=None):
+        """
+        index the strings of the DATABASE of the given database.
+
+        Args:
+          db (Union[sdb.FastSDB, sdb.LazySDB, sdb.SDBNodeStore]): the database.
+          strings (sdb.SDBStringTable): the string table of the database, if already loaded.
+        """
+        buf = db.buffer
+        if strings is None:
+            strings = SDBStringTable.from_buffer(buf, db.strtab_root.offset)
+        refs, table_starts, table_sizes = strings.columns
+
+        starts = array.array("I", table_starts)
+        sizes = array.array("I", table_sizes)
+        # map from string id to the offsets and tags of the items that hold it
+        holders = [[] for _ in range(len(refs))]
+        for kind, offset, _, tag, value in iter_item_events(buf, db.database_root.offset):
+            if kind != EVENT_LEAF:
+                continue
+            t = tag & TAG_TYPE_MASK
+            if t == TAG_TYPE_STRINGREF:
+                i = bisect.bisect_left(refs, value)
+                if i == len(refs) or refs[i] != value:
+                    g_logger.debug("unresolved string reference %s [offset=%s]", hex(value), hex(offset))
+                    continue
+                holders[i].append((offset, tag))
+            elif t == TAG_TYPE_STRING:
+                starts.append(offset + 6)
+                sizes.append(_unpack_dword(buf, offset + 2)[0])
+                holders.append([(offset, tag)])
+
+        item_starts = array.array("I", [0])
+        items = array.array("I")
+        item_tags = array.array("H")
+        for h in holders:
+            for offset, tag in h:
+                items.append(offset)
+                item_tags.append(tag)
+            item_starts.append(len(items))
+
+        # map from trigram to the ids of the strings that contain it, in order
+        index = {}
+        for i in range(len(starts)):
+            text = decode_string(buf[starts[i]:starts[i] + sizes[i]].tobytes())
+            for gram in set(iter_trigrams(text)):
+                index.setdefault(gram, []).append(i)
+
+        grams = array.array(QWORD_TYPECODE, sorted(index.keys()))
+        gram_starts = array.array("I", [0])
+        postings = array.array("I")
+        for gram in grams:
+            postings.extend(index[gram])
+            gram_starts.append(len(postings))
+
+        return cls(buf, array.array("I", refs), starts, sizes, item_starts, items, item_tags,
+                   grams, gram_starts, postings)
+
+    @property
+    def columns(self):
+        """
+        the arrays of the index, in the order taken by the constructor (after the buffer).
+        """
+        return (self._refs, self._starts, self._sizes, self._item_starts, self._items, self._item_tags,
+                self._grams, self._gram_starts, self._postings)
+
+    def __len__(self):
+        """
+        the number of indexed strings.
+        """
+        return len(self._starts)
+
+    def get_text(self, i):
+        start = self._starts[i]
+        return decode_string(self._buf[start:start + self._sizes[i]].tobytes())
+
+    def get_match(self, i):
+        start, end = self._item_starts[i], self._item_starts[i + 1]
+        reference = int(self._refs[i]) if i < len(self._refs) else None
+        return StringMatch(self.get_text(i), reference,
+                           [int(v) for v in self._items[start:end]],
+                           [int(v) for v in self._item_tags[start:end]])
+
+    def _get_postings(self, gram):
+        j = bisect.bisect_left(self._grams, gram)
+        if j == len(self._grams) or self._grams[j] != gram:
+            return []
+        return self._postings[self._gram_starts[j]:self._gram_starts[j + 1]]
+
+    def candidates(self, literals):
+        """
+        find the ids of the strings that contain each of the given literals, and possibly others.
+
+        Returns:
+          Sequence[int]: the ids, in order.
+        """
+        grams = set()
+        for literal in literals:
+            grams.update(iter_trigrams(literal))
+        if not grams:
+            return range(len(self))
+
+        # intersect the shortest postings first, so the candidates shrink quickly
+        postings = sorted((self._get_postings(gram) for gram in grams), key=len)
+        found = postings[0]
+        for p in postings[1:]:
+            if not found:
+                break
+            found = _intersect(found, p)
+        return found
+
+    def _search(self, literals, match, tags):
+        tags = normalize_tags(tags)
+        matches = []
+        for i in self.candidates(literals):
+            if not match(self.get_text(i)):
+                continue
+            m = self.get_match(i)
+            if tags is not None:
+                pairs = [(o, t) for o, t in zip(m.items, m.tags) if t in tags]
+                if not pairs:
+                    continue
+                m = m._replace(items=[o for o, _ in pairs], tags=[t for _, t in pairs])
+            matches.append(m)
+        return matches
+
+    def find(self, substring, tags=None):
+        """
+        find the strings that contain the given substring, case-insensitively.
+
+        Args:
+          substring (str): the text to find.
+          tags (Iterable[Union[int, str]]): if given, only report items with these tags
+            (or tag names), such as `["NAME", "COMMAND_LINE"]`.
+
+        Returns:
+          List[StringMatch]: the matching strings, with the items that hold them.
+        """
+        needle = substring.lower()
+        return self._search([substring], lambda text: needle in text.lower(), tags)
+
+    def search(self, pattern, tags=None):
+        """
+        find the strings that match the given pattern, in which `*` matches any run of
+         characters and `?` matches any one character. the whole string must match,
+         case-insensitively, so use `*\\temp\\*` to find `\\temp\\` anywhere.
+
+        Args:
+          pattern (str): the wildcard pattern.
+          tags (Iterable[Union[int, str]]): if given, only report items with these tags.
+
+        Returns:
+          List[StringMatch]: the matching strings, with the items that hold them.
+        """
+        regex = compile_pattern(pattern)
+        return self._search(_split_literals(pattern), regex.match, tags)
+
+    def search_items(self, pattern, tags=None):
+        """
+        Returns:
+          List[int]: the offsets of the items that hold strings matching the given pattern, in order.
+        """
+        return sorted(o for m in self.search(pattern, tags=tags) for o in m.items)
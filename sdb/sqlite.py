@@ -0,0 +1,336 @@
+"""
+export the entities of shim databases into normalized SQLite tables, for joining with other data.
+
+each table has a `db` column, the row id of the source database in the `databases` table,
+ and an `offset` column, the file offset (TAGID) of the item. references between entities
+ use those offsets: `shim_refs.exe` is the `offset` of the EXE that contains the reference,
+ and `shim_refs.tagid` is the `offset` of the SHIM it names, if the reference has one.
+
+    databases                (id, database_id, name, time, compiler_version, os_platform, path, size, sha256)
+    exes                     (db, offset, name, app_name, vendor, exe_id)
+    matching_files           (db, offset, exe, name)
+    matching_file_attributes (db, matching_file, tag, value)
+    shims                    (db, offset, name, dll_file)
+    patches                  (db, offset, name)
+    flags                    (db, offset, name, mask_kernel, mask_user, mask_shell, mask_fusion)
+    layers                   (db, offset, name)
+    shim_refs                (db, offset, exe, layer, name, tagid, command_line)
+    patch_refs               (db, offset, exe, name, tagid)
+    flag_refs                (db, offset, exe, layer, name, tagid, command_line)
+    layer_refs               (db, offset, exe, name, tagid)
+    strings                  (db, reference, value)
+
+the criteria of a MATCHING_FILE (SIZE, CHECKSUM, BIN_FILE_VERSION, and so on) are rows of
+ `matching_file_attributes`, keyed by tag name without the `TAG_` prefix, as in `sdb.SDBMatcher`.
+string references are resolved, and binary values whose tag name ends with `_ID` are formatted
+ as GUIDs. SQLite integers are signed, so QWORD values of 2**63 or more are stored as their
+ two's complement.
+
+databases are keyed by their DATABASE_ID. exporting a database that's already present, with
+ the same contents, does nothing; with different contents, its rows are replaced.
+"""
+import sqlite3
+import hashlib
+import logging
+
+from .sdb import SDB_TAGS
+from .sdb import get_tag_name
+from .sdb import format_guid
+from .strtab import SDBStringTable
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_LIST
+from .fastparse import TAG_TYPE_NULL
+from .fastparse import TAG_TYPE_QWORD
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_BINARY
+
+g_logger = logging.getLogger("sdb.sqlite")
+
+
+DEFAULT_BATCH_SIZE = 0x1000
+
+# table name, and column definitions, of the tables with rows per database
+TABLES = (
+    ("exes", ("db INTEGER", "offset INTEGER", "name TEXT", "app_name TEXT", "vendor TEXT", "exe_id TEXT")),
+    ("matching_files", ("db INTEGER", "offset INTEGER", "exe INTEGER", "name TEXT")),
+    ("matching_file_attributes", ("db INTEGER", "matching_file INTEGER", "tag TEXT", "value")),
+    ("shims", ("db INTEGER", "offset INTEGER", "name TEXT", "dll_file TEXT")),
+    ("patches", ("db INTEGER", "offset INTEGER", "name TEXT")),
+    ("flags", ("db INTEGER", "offset INTEGER", "name TEXT", "mask_kernel INTEGER", "mask_user INTEGER",
+               "mask_shell INTEGER", "mask_fusion INTEGER")),
+    ("layers", ("db INTEGER", "offset INTEGER", "name TEXT")),
+    ("shim_refs", ("db INTEGER", "offset INTEGER", "exe INTEGER", "layer INTEGER", "name TEXT",
+                   "tagid INTEGER", "command_line TEXT")),
+    ("patch_refs", ("db INTEGER", "offset INTEGER", "exe INTEGER", "name TEXT", "tagid INTEGER")),
+    ("flag_refs", ("db INTEGER", "offset INTEGER", "exe INTEGER", "layer INTEGER", "name TEXT",
+                   "tagid INTEGER", "command_line TEXT")),
+    ("layer_refs", ("db INTEGER", "offset INTEGER", "exe INTEGER", "name TEXT", "tagid INTEGER")),
+    ("strings", ("db INTEGER", "reference INTEGER", "value TEXT")),
+)
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS databases (id INTEGER PRIMARY KEY, database_id TEXT, name TEXT, "
+    "time INTEGER, compiler_version TEXT, os_platform INTEGER, path TEXT, size INTEGER, sha256 TEXT)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS databases_database_id ON databases (database_id)",
+    "CREATE INDEX IF NOT EXISTS databases_sha256 ON databases (sha256)",
+]
+for _table, _columns in TABLES:
+    SCHEMA.append("CREATE TABLE IF NOT EXISTS %s (%s)" % (_table, ", ".join(_columns)))
+    # every table is looked up by database when rows are replaced
+    SCHEMA.append("CREATE INDEX IF NOT EXISTS %s_db ON %s (db)" % (_table, _table))
+
+# table and column of the other indexes
+INDEXES = (
+    ("exes", "name"),
+    ("exes", "exe_id"),
+    ("matching_files", "exe"),
+    ("matching_files", "name"),
+    ("matching_file_attributes", "matching_file"),
+    ("shims", "name"),
+    ("patches", "name"),
+    ("flags", "name"),
+    ("layers", "name"),
+    ("shim_refs", "exe"),
+    ("shim_refs", "name"),
+    ("shim_refs", "tagid"),
+    ("patch_refs", "exe"),
+    ("patch_refs", "tagid"),
+    ("flag_refs", "exe"),
+    ("flag_refs", "tagid"),
+    ("layer_refs", "exe"),
+    ("layer_refs", "name"),
+    ("strings", "value"),
+)
+for _table, _column in INDEXES:
+    SCHEMA.append("CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)" % (_table, _column, _table, _column))
+
+# map from reference tag to (table, tag of the tagid child)
+REFERENCES = {
+    SDB_TAGS.TAG_SHIM_REF: ("shim_refs", SDB_TAGS.TAG_SHIM_TAGID),
+    SDB_TAGS.TAG_PATCH_REF: ("patch_refs", SDB_TAGS.TAG_PATCH_TAGID),
+    SDB_TAGS.TAG_FLAG_REF: ("flag_refs", SDB_TAGS.TAG_FLAG_TAGID),
+    SDB_TAGS.TAG_LAYER: ("layer_refs", SDB_TAGS.TAG_LAYER_TAGID),
+}
+
+
+class SQLiteExporter(object):
+    """
+    write parsed databases into the tables of a SQLite database.
+    """
+    def __init__(self, conn, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Args:
+          conn (sqlite3.Connection): the destination. the schema is created if needed.
+          batch_size (int): the number of rows inserted into a table at a time.
+        """
+        self.conn = conn
+        self.batch_size = batch_size
+        # map from table to rows not yet inserted
+        self._pending = {}
+        # map from table to the number of rows inserted by the current export
+        self.counts = {}
+        self._strings = None
+        self._db_key = None
+
+        # transactions are explicit, so that each export is one
+        self.conn.isolation_level = None
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+
+    def _add(self, table, row):
+        rows = self._pending.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self._flush(table)
+
+    def _flush(self, table):
+        rows = self._pending.pop(table, None)
+        if not rows:
+            return
+        self.conn.executemany("INSERT INTO %s VALUES (%s)" % (table, ", ".join("?" * len(rows[0]))), rows)
+        self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+    def _flush_all(self):
+        for table in list(self._pending.keys()):
+            self._flush(table)
+
+    def get_value(self, node):
+        """
+        convert the value of a leaf item into a value that SQLite can store.
+        """
+        t = node.tag & TAG_TYPE_MASK
+        v = node.value
+        if t == TAG_TYPE_NULL:
+            return 1
+        elif t == TAG_TYPE_STRINGREF:
+            try:
+                return self._strings.get(v)
+            except KeyError:
+                g_logger.warning("unresolved string reference %s [offset=%s]", hex(v), hex(node.offset))
+                return None
+        elif t == TAG_TYPE_QWORD:
+            if v >= 1 << 63:
+                return v - (1 << 64)
+            return v
+        elif t == TAG_TYPE_BINARY:
+            if len(v) == 0x10 and get_tag_name(node.tag).endswith("_ID"):
+                return format_guid(v)
+            return sqlite3.Binary(bytes(bytearray(v)))
+        return v
+
+    def _get_child_value(self, node, tag):
+        try:
+            return self.get_value(node.get_child(tag))
+        except KeyError:
+            return None
+
+    def _find_database(self, database_id, digest):
+        """
+        Returns:
+          Tuple[int, str]: the row id and SHA-256 of the existing copy of a database, or None.
+        """
+        if database_id is not None:
+            cursor = self.conn.execute("SELECT id, sha256 FROM databases WHERE database_id = ?", (database_id, ))
+        else:
+            cursor = self.conn.execute("SELECT id, sha256 FROM databases WHERE database_id IS NULL AND sha256 = ?",
+                                       (digest, ))
+        return cursor.fetchone()
+
+    def _delete_database(self, db_key):
+        for table, _ in TABLES:
+            self.conn.execute("DELETE FROM %s WHERE db = ?" % (table), (db_key, ))
+        self.conn.execute("DELETE FROM databases WHERE id = ?", (db_key, ))
+
+    def export(self, db, path=None):
+        """
+        write the rows of the given database in a single transaction.
+
+        Args:
+          db (Union[sdb.FastSDB, sdb.LazySDB, sdb.SDBNodeStore]): the database.
+          path (str): the path of the file, recorded in the `databases` table.
+
+        Returns:
+          bool: True if the rows were written, or False if the same contents were already present.
+        """
+        root = db.database_root
+        self._strings = SDBStringTable.from_buffer(db.buffer, db.strtab_root.offset)
+        digest = hashlib.sha256(db.buffer).hexdigest()
+        database_id = self._get_child_value(root, SDB_TAGS.TAG_DATABASE_ID)
+        self.counts = {}
+
+        self.conn.execute("BEGIN")
+        try:
+            existing = self._find_database(database_id, digest)
+            if existing is not None and existing[1] == digest:
+                self.conn.execute("ROLLBACK")
+                g_logger.debug("database %s is up to date", database_id)
+                return False
+
+            db_key = None
+            if existing is not None:
+                db_key = existing[0]
+                self._delete_database(db_key)
+
+            cursor = self.conn.execute("INSERT INTO databases VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                db_key,
+                database_id,
+                self._get_child_value(root, SDB_TAGS.TAG_NAME),
+                self._get_child_value(root, SDB_TAGS.TAG_TIME),
+                self._get_child_value(root, SDB_TAGS.TAG_COMPILER_VERSION),
+                self._get_child_value(root, SDB_TAGS.TAG_OS_PLATFORM),
+                path,
+                len(db.buffer),
+                digest,
+            ))
+            self._db_key = cursor.lastrowid
+
+            self._export_database(root)
+            self._export_strings()
+            self._flush_all()
+            self.conn.execute("COMMIT")
+        except Exception:
+            self._pending = {}
+            self.conn.execute("ROLLBACK")
+            raise
+        finally:
+            self._strings = None
+        return True
+
+    def _export_database(self, root):
+        for item in root.children:
+            if item.tag == SDB_TAGS.TAG_LIBRARY:
+                self._export_library(item)
+            elif item.tag == SDB_TAGS.TAG_LAYER:
+                self._export_layer(item)
+            elif item.tag == SDB_TAGS.TAG_EXE:
+                self._export_exe(item)
+
+    def _export_library(self, library):
+        k = self._db_key
+        for item in library.children:
+            if item.tag == SDB_TAGS.TAG_SHIM:
+                self._add("shims", (k, item.offset,
+                                    self._get_child_value(item, SDB_TAGS.TAG_NAME),
+                                    self._get_child_value(item, SDB_TAGS.TAG_DLLFILE)))
+            elif item.tag == SDB_TAGS.TAG_PATCH:
+                self._add("patches", (k, item.offset,
+                                      self._get_child_value(item, SDB_TAGS.TAG_NAME)))
+            elif item.tag == SDB_TAGS.TAG_FLAG:
+                self._add("flags", (k, item.offset,
+                                    self._get_child_value(item, SDB_TAGS.TAG_NAME),
+                                    self._get_child_value(item, SDB_TAGS.TAG_FLAG_MASK_KERNEL),
+                                    self._get_child_value(item, SDB_TAGS.TAG_FLAG_MASK_USER),
+                                    self._get_child_value(item, SDB_TAGS.TAG_FLAG_MASK_SHELL),
+                                    self._get_child_value(item, SDB_TAGS.TAG_FLAG_MASK_FUSION)))
+
+    def _export_reference(self, item, exe=None, layer=None):
+        table, tagid_tag = REFERENCES[item.tag]
+        row = [self._db_key, item.offset, exe]
+        if table in ("shim_refs", "flag_refs"):
+            row.append(layer)
+        row.append(self._get_child_value(item, SDB_TAGS.TAG_NAME))
+        row.append(self._get_child_value(item, tagid_tag))
+        if table in ("shim_refs", "flag_refs"):
+            row.append(self._get_child_value(item, SDB_TAGS.TAG_COMMAND_LINE))
+        self._add(table, tuple(row))
+
+    def _export_layer(self, layer):
+        self._add("layers", (self._db_key, layer.offset, self._get_child_value(layer, SDB_TAGS.TAG_NAME)))
+        for item in layer.children:
+            if item.tag == SDB_TAGS.TAG_SHIM_REF or item.tag == SDB_TAGS.TAG_FLAG_REF:
+                self._export_reference(item, layer=layer.offset)
+
+    def _export_matching_file(self, exe, matching_file):
+        k = self._db_key
+        self._add("matching_files", (k, matching_file.offset, exe.offset,
+                                     self._get_child_value(matching_file, SDB_TAGS.TAG_NAME)))
+        for item in matching_file.children:
+            if item.tag == SDB_TAGS.TAG_NAME or item.tag & TAG_TYPE_MASK == TAG_TYPE_LIST:
+                continue
+            self._add("matching_file_attributes", (k, matching_file.offset, get_tag_name(item.tag),
+                                                   self.get_value(item)))
+
+    def _export_exe(self, exe):
+        self._add("exes", (self._db_key, exe.offset,
+                           self._get_child_value(exe, SDB_TAGS.TAG_NAME),
+                           self._get_child_value(exe, SDB_TAGS.TAG_APP_NAME),
+                           self._get_child_value(exe, SDB_TAGS.TAG_VENDOR),
+                           self._get_child_value(exe, SDB_TAGS.TAG_EXE_ID)))
+        for item in exe.children:
+            if item.tag == SDB_TAGS.TAG_MATCHING_FILE:
+                self._export_matching_file(exe, item)
+            elif item.tag in REFERENCES:
+                self._export_reference(item, exe=exe.offset)
+
+    def _export_strings(self):
+        k = self._db_key
+        for ref in self._strings:
+            self._add("strings", (k, ref, self._strings.get(ref)))
+
+
+def export_sqlite(db, conn, path=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    write the entities of the given database into the given SQLite connection.
+    see `SQLiteExporter.export`.
+    """
+    return SQLiteExporter(conn, batch_size=batch_size).export(db, path=path)
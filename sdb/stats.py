@@ -0,0 +1,206 @@
+"""
+counters and timers that describe the parse of a shim database.
+
+instrumentation is opt-in. pass a `ParseStats` to `parse_sdb`, wrap a stream
+ of events with `ParseStats.observe_events`, or count an already parsed tree
+ with `ParseStats.count_tree`. without one, the parsers run their usual loops,
+ so there's no cost when instrumentation is off.
+
+the counters are:
+  - items: the number of items of each tag,
+  - sections: the number of bytes of the header and of each of the three roots,
+  - junk: the number of unknown bytes that were skipped, in any number of runs,
+  - max_depth: the deepest nesting of an item, where the roots are at depth 0,
+  - timings: the seconds spent in each named phase, such as parse, index, and render.
+
+hooks are callables invoked as `hook(offset, depth, tag, value)` for each item
+ that's counted. the value of a list item is None.
+"""
+import timeit
+import logging
+import contextlib
+from collections import OrderedDict
+
+from .sdb import SDB
+from .sdb import get_tag_name
+from .fastparse import SDB_HEADER_SIZE
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_LIST
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_NULL
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_BINARY
+from .stream import EVENT_JUNK
+from .stream import EVENT_EXIT_LIST
+
+g_logger = logging.getLogger("sdb.stats")
+
+
+SECTION_HEADER = "header"
+
+# the names of the roots, in file order
+SECTIONS = ("INDEXES", "DATABASE", "STRINGTABLE")
+
+
+def _get_vstruct_value(item):
+    t = item.header.tag & TAG_TYPE_MASK
+    if t == TAG_TYPE_LIST or t == TAG_TYPE_NULL:
+        return None
+    elif t == TAG_TYPE_STRINGREF:
+        return item.value.reference
+    return item.value.value
+
+
+def _get_vstruct_size(item):
+    """
+    compute the size of a non-list item from its header and size field, like `skip_item`.
+    `len(item)` includes the padding of odd-sized values, which `SDBItem.vsParse` doesn't consume.
+    """
+    t = item.header.tag & TAG_TYPE_MASK
+    if t == TAG_TYPE_STRING or t == TAG_TYPE_BINARY:
+        return 6 + item.value.size
+    return 2 + len(item.value)
+
+
+class ParseStats(object):
+    """
+    counters and timers collected while parsing, indexing, and rendering a database.
+    """
+    def __init__(self):
+        # map from tag to number of items
+        self.items = {}
+        # map from section name to number of bytes
+        self.sections = OrderedDict()
+        self.junk = 0
+        self.max_depth = 0
+        # map from phase name to seconds
+        self.timings = OrderedDict()
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """
+        register a callable invoked as `hook(offset, depth, tag, value)` for each item.
+        """
+        self.hooks.append(hook)
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        """
+        add the time spent within the block to the given phase.
+        """
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0.0) + timeit.default_timer() - start
+
+    @property
+    def total_items(self):
+        return sum(self.items.values())
+
+    def count_item(self, offset, depth, tag, value):
+        self.items[tag] = self.items.get(tag, 0) + 1
+        if depth > self.max_depth:
+            self.max_depth = depth
+        for hook in self.hooks:
+            hook(offset, depth, tag, value)
+
+    def count_sections(self, db):
+        """
+        record the sizes of the header and roots of a database parsed by
+         the fast, lazy, or columnar engines.
+        """
+        self.sections[SECTION_HEADER] = SDB_HEADER_SIZE
+        for name, root in zip(SECTIONS, (db.indexes_root, db.database_root, db.strtab_root)):
+            self.sections[name] = root.length
+
+    def observe_events(self, events):
+        """
+        count the items of a stream of `sdb.SDBEvent`s as they pass through.
+        sections aren't known from events alone; see `count_sections`.
+
+        Yields:
+          SDBEvent: the given events, unchanged.
+        """
+        for event in events:
+            kind = event.kind
+            if kind == EVENT_JUNK:
+                self.junk += event.value
+            elif kind != EVENT_EXIT_LIST:
+                self.count_item(event.offset, event.depth, event.tag, event.value)
+            yield event
+
+    def _count_nodes(self, node, depth):
+        self.count_item(node.offset, depth, node.tag, node.value)
+        if node.children is not None:
+            for c in node.children:
+                self._count_nodes(c, depth + 1)
+
+    def _count_vstruct(self, item, offset, depth):
+        """
+        Returns:
+          int: the offset following the item, as computed by `SDBItem.vsParse`.
+        """
+        if item.vsHasField("unknown"):
+            self.junk += len(item)
+            return offset + len(item)
+
+        self.count_item(offset, depth, item.header.tag, _get_vstruct_value(item))
+        v = item.value
+        if not v.vsHasField("children"):
+            return offset + _get_vstruct_size(item)
+
+        end = offset + 6
+        for _, c in v.children:
+            end = self._count_vstruct(c, end, depth + 1)
+        return end
+
+    def count_tree(self, db):
+        """
+        count the items and sections of a parsed database, from `SDB.vsParse`
+         or the fast, lazy, or columnar engines. lazy databases are fully decoded.
+        """
+        roots = (db.indexes_root, db.database_root, db.strtab_root)
+        if not isinstance(db, SDB):
+            self.junk += sum(run.length for run in getattr(db, "junk", ()))
+            for root in roots:
+                self._count_nodes(root, 0)
+            self.count_sections(db)
+            return
+
+        self.sections[SECTION_HEADER] = SDB_HEADER_SIZE
+        offset = SDB_HEADER_SIZE
+        for name, root in zip(SECTIONS, roots):
+            start = offset
+            offset = self._count_vstruct(root, offset, 0)
+            self.sections[name] = offset - start
+
+    def as_dict(self):
+        return OrderedDict([
+            ("items", OrderedDict((get_tag_name(tag), count) for tag, count in
+                                  sorted(self.items.items(), key=lambda p: (-p[1], p[0])))),
+            ("total_items", self.total_items),
+            ("sections", self.sections),
+            ("junk", self.junk),
+            ("max_depth", self.max_depth),
+            ("timings", self.timings),
+        ])
+
+    def format(self):
+        """
+        Yields:
+          str: lines of a human readable report.
+        """
+        for phase, seconds in self.timings.items():
+            yield "%s: %.3fs" % (phase, seconds)
+        if self.sections:
+            yield "sections:"
+            for name, size in self.sections.items():
+                yield "  %s: %d bytes" % (name, size)
+        yield "junk bytes: %d" % self.junk
+        if not self.items:
+            return
+        yield "max depth: %d" % self.max_depth
+        yield "items: %d" % self.total_items
+        for name, count in self.as_dict()["items"].items():
+            yield "  %s: %d" % (name, count)
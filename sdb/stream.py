@@ -0,0 +1,125 @@
+"""
+streaming traversal of shim database items.
+
+rather than building a tree, `iter_events` yields a flat sequence of events
+ as it walks the buffer. memory use depends only upon the nesting depth of
+ the database, not its size.
+"""
+import struct
+import logging
+from collections import namedtuple
+
+from .sdb import InvalidSDBFileError
+from .fastparse import SDB_HEADER_SIZE
+from .fastparse import TAG_TYPE_LIST
+from .fastparse import read_value
+from .fastparse import read_junk
+from .fastparse import _KNOWN_TAGS
+from .fastparse import _KNOWN_TAG_TYPES
+from .fastparse import _unpack_header
+from .fastparse import _unpack_tag
+from .fastparse import _unpack_dword
+
+g_logger = logging.getLogger("sdb.stream")
+
+
+# the start of a TAG_TYPE_LIST item. its children follow, at `depth + 1`.
+EVENT_ENTER_LIST = "enter"
+# the end of a TAG_TYPE_LIST item. `offset` is the offset of the list item.
+EVENT_EXIT_LIST = "exit"
+# a non-list item, with its decoded value.
+EVENT_LEAF = "leaf"
+# a run of unknown bytes that was skipped. `tag` is None, and `value` is the number of bytes.
+EVENT_JUNK = "junk"
+
+
+SDBEvent = namedtuple("SDBEvent", ["kind", "offset", "depth", "tag", "value"])
+
+
+def _walk(buf, offset, count):
+    """
+    yield the events for `count` consecutive items beginning at the given offset.
+    runs of junk bytes between the items are reported, but don't count towards `count`.
+    """
+    known_tags = _KNOWN_TAGS
+    known_types = _KNOWN_TAG_TYPES
+    # tuples of (list offset, list tag, end offset) for the currently open lists
+    stack = []
+    try:
+        while True:
+            while stack and offset >= stack[-1][2]:
+                list_offset, list_tag, _ = stack.pop()
+                yield SDBEvent(EVENT_EXIT_LIST, list_offset, len(stack), list_tag, None)
+
+            if not stack:
+                if count == 0:
+                    break
+                if offset >= len(buf):
+                    raise InvalidSDBFileError("truncated file near offset %s" % hex(offset))
+
+            depth = len(stack)
+            b1, b2 = _unpack_tag(buf, offset)
+            t = (b2 & 0xF0) << 8
+            if b1 not in known_tags and t not in known_types:
+                run = read_junk(buf, offset, stack[-1][2] if stack else len(buf))
+                g_logger.warning("ignoring %d bytes [offset=%s]: 0x%02x 0x%02x",
+                                 run.length, hex(offset), b1, b2)
+                yield SDBEvent(EVENT_JUNK, offset, depth, None, run.length)
+                offset += run.length
+                continue
+
+            if not stack:
+                count -= 1
+
+            tag = (b2 << 8) | b1
+            if t == TAG_TYPE_LIST:
+                size = _unpack_dword(buf, offset + 2)[0]
+                yield SDBEvent(EVENT_ENTER_LIST, offset, depth, tag, None)
+                stack.append((offset, tag, offset + 6 + size))
+                offset += 6
+            else:
+                value, end = read_value(buf, offset + 2, tag)
+                yield SDBEvent(EVENT_LEAF, offset, depth, tag, value)
+                offset = end
+    except struct.error:
+        raise InvalidSDBFileError("truncated item near offset %s" % hex(offset))
+
+
+def iter_events(buf):
+    """
+    walk all the items in the given shim database.
+
+    Args:
+      buf (Union[bytes, bytearray, memoryview]): the contents of the database.
+
+    Yields:
+      SDBEvent: the events, in file order.
+    """
+    if not isinstance(buf, memoryview):
+        buf = memoryview(buf)
+    if len(buf) < SDB_HEADER_SIZE or _unpack_header(buf, 0)[2] != b"sdbf":
+        raise InvalidSDBFileError("invalid magic")
+
+    # the three roots: indexes, database, string table
+    for event in _walk(buf, SDB_HEADER_SIZE, 3):
+        yield event
+
+
+def iter_item_events(buf, offset, depth=0):
+    """
+    walk the item (and its children) at the given offset.
+
+    Args:
+      buf (Union[bytes, bytearray, memoryview]): the contents of the database.
+      offset (int): the offset of the item, such as `LazySDB.database_root.offset`.
+      depth (int): the depth to report for the item.
+
+    Yields:
+      SDBEvent: the events, in file order.
+    """
+    if not isinstance(buf, memoryview):
+        buf = memoryview(buf)
+    for event in _walk(buf, offset, 1):
+        if depth:
+            event = event._replace(depth=event.depth + depth)
+        yield event
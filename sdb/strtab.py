@@ -0,0 +1,207 @@
+"""
+compact, lazily decoded string table.
+
+the raw UTF-16 data stays in a single buffer, alongside arrays of the string
+ references (offsets relative to the STRINGTABLE item), data offsets, and sizes.
+strings are decoded on first access, and both the decoded and the XML-escaped
+ forms are kept in bounded caches.
+"""
+import array
+import bisect
+import struct
+import logging
+import xml.sax.saxutils
+from collections import OrderedDict
+
+from .sdb import SDB_TAGS
+from .sdb import InvalidSDBFileError
+from .fastparse import is_junk
+from .fastparse import read_junk
+from .fastparse import skip_item
+from .fastparse import _unpack_word
+from .fastparse import _unpack_dword
+
+g_logger = logging.getLogger("sdb.strtab")
+
+
+DEFAULT_CACHE_SIZE = 0x1000
+
+
+class _LRUCache(object):
+    """
+    a mapping that holds at most `maxsize` entries, evicting the least recently used.
+    """
+    def __init__(self, maxsize):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Raises:
+          KeyError: if the key is not cached.
+        """
+        value = self._entries.pop(key)
+        # move to the most recently used position
+        self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        if self._maxsize <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SDBStringTable(object):
+    """
+    the strings of a shim database, addressed by their TAG_TYPE_STRINGREF reference.
+
+    use `SDBStringTable.from_buffer` or `SDBStringTable.from_vstruct` to construct one.
+    """
+    def __init__(self, buf, refs, starts, sizes, cache_size=DEFAULT_CACHE_SIZE):
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        self._buf = buf
+        self._refs = refs
+        self._starts = starts
+        self._sizes = sizes
+        self._decoded = _LRUCache(cache_size)
+        self._escaped = _LRUCache(cache_size)
+
+    @classmethod
+    def from_buffer(cls, buf, offset, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        index the STRINGTABLE item at the given offset without decoding any strings.
+        the buffer is retained, not copied.
+
+        Args:
+          buf (Union[bytes, bytearray, memoryview]): the contents of the database,
+            such as `LazySDB.buffer`.
+          offset (int): the offset of the STRINGTABLE item, such as `LazySDB.strtab_root.offset`.
+        """
+        if not isinstance(buf, memoryview):
+            buf = memoryview(buf)
+        refs = array.array("I")
+        starts = array.array("I")
+        sizes = array.array("I")
+
+        try:
+            end = offset + 6 + _unpack_dword(buf, offset + 2)[0]
+            o = offset + 6
+            while o < end:
+                if is_junk(buf, o):
+                    o += read_junk(buf, o, end).length
+                    continue
+                if _unpack_word(buf, o)[0] == SDB_TAGS.TAG_STRINGTABLE_ITEM:
+                    refs.append(o - offset)
+                    starts.append(o + 6)
+                    sizes.append(_unpack_dword(buf, o + 2)[0])
+                o = skip_item(buf, o)
+        except struct.error:
+            raise InvalidSDBFileError("truncated string table near offset %s" % hex(o))
+        return cls(buf, refs, starts, sizes, cache_size=cache_size)
+
+    @classmethod
+    def from_vstruct(cls, strtab_root, cache_size=DEFAULT_CACHE_SIZE):
+        """
+        collect the raw string data from the STRINGTABLE `SDBItem` parsed by `SDB.vsParse`.
+        """
+        data = bytearray()
+        refs = array.array("I")
+        starts = array.array("I")
+        sizes = array.array("I")
+
+        # len(strtab) - len(strtab value) == 6
+        # 01 78 ?? ?? ?? ?? (children_size:uint32)
+        offset = 0x6
+        for _, field in strtab_root.value.children:
+            if field.vsHasField("header") and field.header.tag == SDB_TAGS.TAG_STRINGTABLE_ITEM:
+                raw = field.value.vsGetField("value").vsEmit()
+                refs.append(offset)
+                starts.append(len(data))
+                sizes.append(len(raw))
+                data.extend(raw)
+            offset += len(field)
+        return cls(data, refs, starts, sizes, cache_size=cache_size)
+
+    @property
+    def columns(self):
+        """
+        the arrays of string references, data offsets into the buffer, and data sizes.
+        """
+        return self._refs, self._starts, self._sizes
+
+    def __len__(self):
+        return len(self._refs)
+
+    def __iter__(self):
+        """
+        yield the references of all the strings, in order.
+        """
+        for ref in self._refs:
+            yield int(ref)
+
+    def _find(self, ref):
+        i = bisect.bisect_left(self._refs, ref)
+        if i == len(self._refs) or self._refs[i] != ref:
+            raise KeyError(ref)
+        return i
+
+    def __contains__(self, ref):
+        try:
+            self._find(ref)
+        except KeyError:
+            return False
+        return True
+
+    def get_raw(self, ref):
+        """
+        fetch the raw UTF-16LE data of the string with the given reference, without decoding it.
+        """
+        i = self._find(ref)
+        start = self._starts[i]
+        return self._buf[start:start + self._sizes[i]]
+
+    def get(self, ref):
+        """
+        fetch the decoded (unescaped) string with the given reference.
+
+        Raises:
+          KeyError: if there's no string at the given reference.
+        """
+        try:
+            return self._decoded.get(ref)
+        except KeyError:
+            pass
+
+        s = self.get_raw(ref).tobytes().decode("utf-16le").split(u"\x00")[0]
+        self._decoded.put(ref, s)
+        return s
+
+    def get_escaped(self, ref):
+        """
+        fetch the XML-escaped string with the given reference.
+
+        Raises:
+          KeyError: if there's no string at the given reference.
+        """
+        try:
+            return self._escaped.get(ref)
+        except KeyError:
+            pass
+
+        s = xml.sax.saxutils.escape(self.get(ref))
+        self._escaped.put(ref, s)
+        return s
+
+    def clear_cache(self):
+        self._decoded.clear()
+        self._escaped.clear()
@@ -0,0 +1,283 @@
+"""
+deterministic synthetic shim databases, for benchmarks.
+
+real system databases can't be shipped with the project, so `generate_sdb` builds
+ databases of a configurable shape: the number of EXEs, the number of MATCHING_FILEs
+ per EXE, the number of extra strings in the string table, the size of the PATCH_BITS
+ payloads, and the number of junk bytes to inject.
+the same shape and seed always produce the same bytes, with a given version of Python.
+
+EXEs are generated on demand, each time the writer walks the tree, so large
+ databases are never held in memory.
+"""
+import random
+import struct
+import hashlib
+import logging
+
+from .sdb import SDB_TAGS
+from .writer import SDBWriter
+from .writer import make_item
+from .writer import make_list
+from .indexes import INDEX_RECORD
+from .indexes import SHIMDB_INDEX_UNIQUE_KEY
+from .indexes import make_string_key
+from .indexes import make_binary_key
+from .patchbits import PATCH_ACTIONS
+from .patchbits import MAX_MODULE
+from .fastparse import SDBNode
+
+g_logger = logging.getLogger("sdb.synthetic")
+
+
+SHIM_COUNT = 0x40
+PATCH_COUNT = 0x8
+FLAG_COUNT = 0x10
+LAYER_COUNT = 0x10
+VENDOR_COUNT = 0x40
+
+# unknown to the parsers, and doesn't look like the type byte of a tag either.
+# junk is injected before NAME items, whose tag (0x6001) begins with 0x01,
+#  so the parsers skip exactly the injected bytes.
+JUNK_BYTE = b"\x00"
+
+# the items of a synthetic database are given placeholder "source offsets",
+#  which the writer fixes up like those of a parsed database.
+# the lists of EXE `i` are numbered from `EXE_ORDINAL_BASE + i * stride`.
+EXE_ORDINAL_BASE = 0x10000
+
+_PATCHBITS_HEADER = struct.Struct("<IIIII")
+
+
+def make_patch_bits(rng, size):
+    """
+    build a PATCH_BITS payload of about the given size, made of PATCHBITS records
+     that alternately match and replace random patterns.
+    """
+    data = bytearray()
+    module_name = u"module.dll".ljust(MAX_MODULE, u"\x00").encode("utf-16le")
+    header_size = _PATCHBITS_HEADER.size + len(module_name)
+    i = 0
+    while len(data) + header_size < size:
+        pattern_size = min(rng.randint(1, 0x40), size - len(data) - header_size)
+        opcode = PATCH_ACTIONS.PATCH_MATCH if i % 2 == 0 else PATCH_ACTIONS.PATCH_REPLACE
+        data.extend(_PATCHBITS_HEADER.pack(opcode, header_size + pattern_size, pattern_size,
+                                           rng.randrange(0x1000, 0x100000), 0))
+        data.extend(module_name)
+        data.extend(bytearray(rng.randrange(0x100) for _ in range(pattern_size)))
+        i += 1
+    return bytes(data)
+
+
+def get_exe_name(i):
+    # EXEs come in pairs with the same name, as in real databases
+    return u"app%06d.exe" % (i // 2)
+
+
+def get_exe_id(seed, i):
+    return hashlib.md5(("%d:%d" % (seed, i)).encode("ascii")).digest()
+
+
+class _SyntheticWriter(SDBWriter):
+    """
+    a writer that also emits junk: items with no tag, whose value is written verbatim.
+    """
+    def _layout(self, node, offset):
+        if node.tag is None:
+            return len(node.value)
+        return SDBWriter._layout(self, node, offset)
+
+    def _emit(self, out, node):
+        if node.tag is None:
+            out.write(node.value)
+            return
+        SDBWriter._emit(self, out, node)
+
+
+class _ExeList(object):
+    """
+    the children of DATABASE: its properties, the LIBRARY, the LAYERs, and then
+     the EXEs, generated afresh on each iteration.
+    """
+    def __init__(self, generator, head):
+        self._generator = generator
+        self._head = head
+
+    def __iter__(self):
+        for c in self._head:
+            yield c
+        for i in range(self._generator.exes):
+            yield self._generator.make_exe(i)
+
+
+class SyntheticSDBGenerator(object):
+    def __init__(self, exes=1000, matching_files=2, strings=0, patch_size=0x100, junk=0, seed=0):
+        """
+        Args:
+          exes (int): the number of EXEs.
+          matching_files (int): the number of MATCHING_FILEs of each EXE.
+          strings (int): the number of extra, unreferenced, strings in the string table.
+          patch_size (int): the approximate size of each PATCH_BITS payload.
+          junk (int): the number of junk bytes to inject, spread across the EXEs.
+          seed (int): the seed of the generator.
+        """
+        self.exes = exes
+        self.matching_files = matching_files
+        self.strings = strings
+        self.patch_size = patch_size
+        self.junk = junk
+        self.seed = seed
+
+        # the lists of each EXE: the EXE, its MATCHING_FILEs, and up to five reference lists
+        self._stride = matching_files + 6
+        self._next_ordinal = 1
+
+        rng = random.Random(seed)
+        self.shims = [self._make_list(SDB_TAGS.TAG_SHIM, [
+            make_item(SDB_TAGS.TAG_NAME, u"Shim%03d" % i),
+            make_item(SDB_TAGS.TAG_DLLFILE, u"AcShim%d.dll" % (i % 4))]) for i in range(SHIM_COUNT)]
+        self.patches = [self._make_list(SDB_TAGS.TAG_PATCH, [
+            make_item(SDB_TAGS.TAG_NAME, u"Patch%03d" % i),
+            make_item(SDB_TAGS.TAG_PATCH_BITS, make_patch_bits(rng, patch_size))]) for i in range(PATCH_COUNT)]
+        self.flags = [self._make_list(SDB_TAGS.TAG_FLAG, [
+            make_item(SDB_TAGS.TAG_NAME, u"Flag%03d" % i),
+            make_item(SDB_TAGS.TAG_FLAG_MASK_KERNEL, 1 << i)]) for i in range(FLAG_COUNT)]
+        self.layers = []
+        for i in range(LAYER_COUNT):
+            shim = self.shims[rng.randrange(SHIM_COUNT)]
+            self.layers.append(self._make_list(SDB_TAGS.TAG_LAYER, [
+                make_item(SDB_TAGS.TAG_NAME, u"Layer%03d" % i),
+                self._make_list(SDB_TAGS.TAG_SHIM_REF, [
+                    make_item(SDB_TAGS.TAG_NAME, shim.children[0].value),
+                    make_item(SDB_TAGS.TAG_SHIM_TAGID, shim.offset)])]))
+
+    def _make_list(self, tag, children, ordinal=None):
+        node = make_list(tag, children)
+        if ordinal is None:
+            ordinal = self._next_ordinal
+            self._next_ordinal += 1
+        node.offset = ordinal
+        return node
+
+    def _get_junk(self, i):
+        if self.exes == 0:
+            return 0
+        return ((i + 1) * self.junk) // self.exes - (i * self.junk) // self.exes
+
+    def _make_reference(self, list_tag, tagid_tag, target, ordinal):
+        return self._make_list(list_tag, [
+            make_item(SDB_TAGS.TAG_NAME, target.children[0].value),
+            make_item(tagid_tag, target.offset)], ordinal=ordinal)
+
+    def make_exe(self, i):
+        """
+        generate the EXE with the given index. the same EXE is generated each time.
+        """
+        rng = random.Random((self.seed << 32) | i)
+        ordinal = EXE_ORDINAL_BASE + i * self._stride
+        vendor = u"Vendor %d" % rng.randrange(VENDOR_COUNT)
+
+        children = []
+        junk = self._get_junk(i)
+        if junk:
+            children.append(make_item(None, JUNK_BYTE * junk))
+        children.extend([
+            make_item(SDB_TAGS.TAG_NAME, get_exe_name(i)),
+            make_item(SDB_TAGS.TAG_APP_NAME, u"Application %d" % (i // 4)),
+            make_item(SDB_TAGS.TAG_VENDOR, vendor),
+            make_item(SDB_TAGS.TAG_EXE_ID, get_exe_id(self.seed, i)),
+        ])
+
+        for j in range(self.matching_files):
+            name = u"*" if j == 0 else u"module%d.dll" % rng.randrange(0x100)
+            version = ((rng.randrange(1, 20) << 48) | (rng.randrange(10) << 32) |
+                       (rng.randrange(0x10000) << 16) | rng.randrange(0x10000))
+            criteria = [
+                make_item(SDB_TAGS.TAG_NAME, name),
+                make_item(SDB_TAGS.TAG_SIZE, rng.randrange(0x1000, 0x1000000)),
+                make_item(SDB_TAGS.TAG_CHECKSUM, rng.randrange(0x100000000)),
+                make_item(SDB_TAGS.TAG_BIN_FILE_VERSION, version),
+                make_item(SDB_TAGS.TAG_LINK_DATE, rng.randrange(0x30000000, 0x60000000)),
+                make_item(SDB_TAGS.TAG_COMPANY_NAME, vendor),
+            ]
+            if rng.random() < 0.25:
+                criteria.append(make_item(SDB_TAGS.TAG_UPTO_BIN_FILE_VERSION, version | 0xFFFF))
+            children.append(self._make_list(SDB_TAGS.TAG_MATCHING_FILE, criteria, ordinal=ordinal + 1 + j))
+
+        ordinal += 1 + self.matching_files
+        for shim in rng.sample(self.shims, rng.randint(1, 3)):
+            children.append(self._make_reference(SDB_TAGS.TAG_SHIM_REF, SDB_TAGS.TAG_SHIM_TAGID, shim, ordinal))
+            ordinal += 1
+        if rng.random() < 0.05:
+            patch = rng.choice(self.patches)
+            children.append(self._make_reference(SDB_TAGS.TAG_PATCH_REF, SDB_TAGS.TAG_PATCH_TAGID, patch, ordinal))
+        ordinal += 1
+        if rng.random() < 0.1:
+            flag = rng.choice(self.flags)
+            children.append(self._make_reference(SDB_TAGS.TAG_FLAG_REF, SDB_TAGS.TAG_FLAG_TAGID, flag, ordinal))
+        if rng.random() < 0.1:
+            children.append(make_item(SDB_TAGS.TAG_LAYER_TAGID, rng.choice(self.layers).offset))
+        children.append(make_item(SDB_TAGS.TAG_MATCH_MODE, 2))
+
+        return self._make_list(SDB_TAGS.TAG_EXE, children, ordinal=EXE_ORDINAL_BASE + i * self._stride)
+
+    def _make_index(self, key_tag, keys, flags=0):
+        records = sorted((key, EXE_ORDINAL_BASE + i * self._stride) for i, key in enumerate(keys))
+        bits = b"".join(INDEX_RECORD.pack(key, ordinal) for key, ordinal in records)
+        children = [
+            make_item(SDB_TAGS.TAG_INDEX_TAG, SDB_TAGS.TAG_EXE),
+            make_item(SDB_TAGS.TAG_INDEX_KEY, key_tag),
+        ]
+        if flags:
+            children.append(make_item(SDB_TAGS.TAG_INDEX_FLAGS, flags))
+        children.append(make_item(SDB_TAGS.TAG_INDEX_BITS, bits))
+        return make_list(SDB_TAGS.TAG_INDEX, children)
+
+    def make_indexes(self):
+        """
+        build the INDEXES of the EXEs, by NAME and by EXE_ID.
+        """
+        return make_list(SDB_TAGS.TAG_INDEXES, [
+            self._make_index(SDB_TAGS.TAG_NAME,
+                             (make_string_key(get_exe_name(i)) for i in range(self.exes))),
+            self._make_index(SDB_TAGS.TAG_EXE_ID,
+                             (make_binary_key(get_exe_id(self.seed, i)) for i in range(self.exes)),
+                             flags=SHIMDB_INDEX_UNIQUE_KEY),
+        ])
+
+    def make_database(self):
+        """
+        build the DATABASE, whose EXEs are generated as it's walked.
+        """
+        rng = random.Random(self.seed)
+        head = [
+            make_item(SDB_TAGS.TAG_OS_PLATFORM, 1),
+            make_item(SDB_TAGS.TAG_NAME, u"Synthetic Database"),
+            make_item(SDB_TAGS.TAG_DATABASE_ID, bytes(bytearray(rng.randrange(0x100) for _ in range(0x10)))),
+            make_item(SDB_TAGS.TAG_TIME, 0x1d0000000000000 + self.seed),
+            make_item(SDB_TAGS.TAG_COMPILER_VERSION, u"3.0.0.9"),
+            make_list(SDB_TAGS.TAG_LIBRARY, self.shims + self.patches + self.flags),
+        ]
+        head.extend(self.layers)
+        # not `make_list`, which would collect the EXEs into a list
+        return SDBNode(None, None, SDB_TAGS.TAG_DATABASE, None, _ExeList(self, head))
+
+    def write(self, f):
+        """
+        Returns:
+          int: the number of bytes written.
+        """
+        writer = _SyntheticWriter()
+        for i in range(self.strings):
+            writer.intern(u"Synthetic string %d" % i)
+        return writer.write(f, self.make_database(), indexes_root=self.make_indexes())
+
+
+def generate_sdb(f, **shape):
+    """
+    write a synthetic database of the given shape (see `SyntheticSDBGenerator`) to a file.
+
+    Returns:
+      int: the number of bytes written.
+    """
+    return SyntheticSDBGenerator(**shape).write(f)
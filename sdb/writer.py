@@ -0,0 +1,352 @@
+"""
+serialize a tree of items into a shim database.
+
+the tree may come from the fast, lazy, or columnar engines, or be built with
+ `make_list` and `make_item`, or a mix of the two. the file is written in two passes:
+
+  1. layout: compute the size and new offset of each list, and intern the strings
+      referenced by TAG_TYPE_STRINGREF items into a deduplicated STRINGTABLE,
+  2. emit: write the header, INDEXES, DATABASE, and STRINGTABLE items to the file
+      through a small buffer, so no second copy of the database is held in memory.
+
+values of TAG_TYPE_STRINGREF items may be strings, or references into the string
+ table of the source database. values of *_TAGID items may be items of the tree,
+ or offsets of items in the source database. either way, they are fixed up to refer
+ to the new location of the item, as are the records of INDEX_BITS items.
+ (records of items that aren't written are dropped, and new items aren't indexed.)
+
+when writing a parsed database, the strings of the source string table are kept in
+ their original order, so an unmodified database without junk bytes is written
+ byte-for-byte as it was read, and parse -> write -> parse is stable.
+"""
+import struct
+import numbers
+import logging
+
+from .sdb import SDB_TAGS
+from .strtab import SDBStringTable
+from .refs import REFERENCE_TARGETS
+from .indexes import INDEX_RECORD
+from .fastparse import SDBNode
+from .fastparse import SDBFileHeader
+from .fastparse import SDB_HEADER_SIZE
+from .fastparse import TAG_TYPE_MASK
+from .fastparse import TAG_TYPE_NULL
+from .fastparse import TAG_TYPE_WORD
+from .fastparse import TAG_TYPE_DWORD
+from .fastparse import TAG_TYPE_QWORD
+from .fastparse import TAG_TYPE_STRINGREF
+from .fastparse import TAG_TYPE_LIST
+from .fastparse import TAG_TYPE_STRING
+from .fastparse import TAG_TYPE_BINARY
+
+g_logger = logging.getLogger("sdb.writer")
+
+
+DEFAULT_HEADER = SDBFileHeader(2, 1, b"sdbf")
+
+DEFAULT_BUFFER_SIZE = 0x100000
+
+# DWORD items whose value is the offset of another item
+TAGID_TAGS = frozenset(list(REFERENCE_TARGETS.keys()) + [SDB_TAGS.TAG_TAGID])
+
+_pack_header = struct.Struct("<II4s").pack
+_pack_tag = struct.Struct("<H").pack
+_pack_word = struct.Struct("<HH").pack
+_pack_dword = struct.Struct("<HI").pack
+_pack_qword = struct.Struct("<HQ").pack
+
+
+def make_item(tag, value=None):
+    """
+    create a new item, for building a tree to write.
+    the value of a TAG_TYPE_STRINGREF item is its string, and the value of
+     a *_TAGID item may be the item it refers to.
+    """
+    return SDBNode(None, None, tag, value)
+
+
+def make_list(tag, children=None):
+    """
+    create a new list item, for building a tree to write.
+    """
+    return SDBNode(None, None, tag, None, list(children or []))
+
+
+def _encode_string(s):
+    return (s + u"\x00").encode("utf-16le")
+
+
+class _BufferedOutput(object):
+    def __init__(self, f, buffer_size=DEFAULT_BUFFER_SIZE):
+        self._f = f
+        self._buffer_size = buffer_size
+        self._buf = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self._buf.extend(data)
+        self.offset += len(data)
+        if len(self._buf) >= self._buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buf:
+            self._f.write(bytes(self._buf))
+            del self._buf[:]
+
+
+class SDBWriter(object):
+    """
+    serialize trees of items into shim databases.
+    a writer must only be used to write one database.
+    """
+    def __init__(self, strings=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        Args:
+          strings (sdb.SDBStringTable): the string table of the source database,
+            used to resolve references in TAG_TYPE_STRINGREF items.
+        """
+        self._source_strings = strings
+        self._buffer_size = buffer_size
+        # map from string to reference
+        self._strings = {}
+        # the raw data of the STRINGTABLE_ITEMs, in order
+        self._string_data = []
+        self._strtab_size = 0
+        # map from source string reference to new reference
+        self._source_refs = {}
+        # map from source offset, or id of a new item, to the (offset, size) of the written list
+        self._by_offset = {}
+        self._by_id = {}
+
+    def intern(self, s, raw=None):
+        """
+        add a string to the string table, unless it's already present.
+
+        Args:
+          s (str): the string.
+          raw (Union[bytes, memoryview]): the exact STRINGTABLE_ITEM data for the string,
+            if not its UTF-16LE encoding with a terminator.
+
+        Returns:
+          int: the reference to the string.
+        """
+        try:
+            return self._strings[s]
+        except KeyError:
+            pass
+
+        if raw is None:
+            raw = _encode_string(s)
+        # references are relative to the STRINGTABLE item, after its header
+        ref = 6 + self._strtab_size
+        self._strings[s] = ref
+        self._string_data.append(raw)
+        self._strtab_size += 6 + len(raw)
+        return ref
+
+    def intern_source_strings(self):
+        """
+        add all the strings of the source string table, in order,
+         so that the references of an unmodified database don't change.
+        """
+        for ref in self._source_strings:
+            s = self._source_strings.get(ref)
+            self._source_refs[ref] = self.intern(s, raw=self._source_strings.get_raw(ref))
+
+    def _get_string_ref(self, value):
+        if not isinstance(value, numbers.Integral):
+            return self.intern(value)
+
+        try:
+            return self._source_refs[value]
+        except KeyError:
+            pass
+
+        if self._source_strings is None:
+            raise ValueError("cannot resolve string reference without a string table: %s" % hex(value))
+        try:
+            s = self._source_strings.get(value)
+        except KeyError:
+            raise ValueError("unresolved string reference: %s" % hex(value))
+        ref = self.intern(s)
+        self._source_refs[value] = ref
+        return ref
+
+    def _record(self, node, offset, size):
+        if node.offset is None:
+            self._by_id[id(node)] = (offset, size)
+        else:
+            self._by_offset[node.offset] = (offset, size)
+
+    def _get_layout(self, node):
+        if node.offset is None:
+            return self._by_id[id(node)]
+        return self._by_offset[node.offset]
+
+    def _get_value_size(self, node):
+        """
+        compute the size of a non-list item, including its tag.
+        """
+        t = node.tag & TAG_TYPE_MASK
+        if t == TAG_TYPE_STRINGREF:
+            self._get_string_ref(node.value)
+            return 6
+        elif t == TAG_TYPE_DWORD:
+            return 6
+        elif t == TAG_TYPE_STRING:
+            return 6 + len(_encode_string(node.value))
+        elif t == TAG_TYPE_NULL:
+            return 2
+        elif t == TAG_TYPE_QWORD:
+            return 10
+        elif t == TAG_TYPE_BINARY:
+            return 6 + len(node.value)
+        elif t == TAG_TYPE_WORD:
+            return 4
+        else:
+            raise ValueError("unexpected item type: 0x%x" % node.tag)
+
+    def _layout(self, node, offset):
+        """
+        compute the size of the given item, and the offsets of its descendants.
+
+        Returns:
+          int: the size of the item, including its tag.
+        """
+        if node.tag & TAG_TYPE_MASK != TAG_TYPE_LIST:
+            return self._get_value_size(node)
+
+        size = 6
+        for c in node.children:
+            size += self._layout(c, offset + size)
+        self._record(node, offset, size)
+        return size
+
+    def _get_tagid(self, value):
+        if isinstance(value, numbers.Integral):
+            try:
+                return self._by_offset[value][0]
+            except KeyError:
+                g_logger.debug("dangling tag id: %s", hex(value))
+                return value
+        return self._get_layout(value)[0]
+
+    def _encode_index_bits(self, bits):
+        """
+        fix up the tag ids of the records of an INDEX_BITS payload,
+         keeping its size, with unused records first.
+        """
+        count = len(bits) // INDEX_RECORD.size
+        records = []
+        for i in range(count):
+            key, tagid = INDEX_RECORD.unpack_from(bits, i * INDEX_RECORD.size)
+            if tagid == 0:
+                continue
+            try:
+                records.append((key, self._by_offset[tagid][0]))
+            except KeyError:
+                g_logger.debug("dropping index record for missing item: %s", hex(tagid))
+        records.sort()
+
+        data = bytearray(INDEX_RECORD.size * (count - len(records)))
+        for key, tagid in records:
+            data.extend(INDEX_RECORD.pack(key, tagid))
+        # trailing bytes that don't form a record
+        data.extend(bytearray(bits[count * INDEX_RECORD.size:]))
+        return bytes(data)
+
+    def _emit(self, out, node):
+        tag = node.tag
+        t = tag & TAG_TYPE_MASK
+        if t == TAG_TYPE_LIST:
+            _, size = self._get_layout(node)
+            out.write(_pack_dword(tag, size - 6))
+            for c in node.children:
+                self._emit(out, c)
+        elif t == TAG_TYPE_STRINGREF:
+            out.write(_pack_dword(tag, self._get_string_ref(node.value)))
+        elif t == TAG_TYPE_DWORD:
+            if tag in TAGID_TAGS:
+                out.write(_pack_dword(tag, self._get_tagid(node.value)))
+            else:
+                out.write(_pack_dword(tag, node.value))
+        elif t == TAG_TYPE_STRING:
+            data = _encode_string(node.value)
+            out.write(_pack_dword(tag, len(data)))
+            out.write(data)
+        elif t == TAG_TYPE_NULL:
+            out.write(_pack_tag(tag))
+        elif t == TAG_TYPE_QWORD:
+            out.write(_pack_qword(tag, node.value))
+        elif t == TAG_TYPE_BINARY:
+            if tag == SDB_TAGS.TAG_INDEX_BITS:
+                data = self._encode_index_bits(node.value)
+            else:
+                data = bytes(bytearray(node.value))
+            out.write(_pack_dword(tag, len(data)))
+            out.write(data)
+        elif t == TAG_TYPE_WORD:
+            out.write(_pack_word(tag, node.value))
+        else:
+            raise ValueError("unexpected item type: 0x%x" % tag)
+
+    def write(self, f, database_root, indexes_root=None, header=None):
+        """
+        serialize the given items as a complete database.
+
+        Args:
+          f (file): the writable binary file.
+          database_root (node): the DATABASE item.
+          indexes_root (node): the INDEXES item, or None for an empty one.
+          header (sdb.SDBFileHeader): the file header, or None for the default.
+
+        Returns:
+          int: the number of bytes written.
+
+        Raises:
+          ValueError: if a string reference can't be resolved, or an item has an unknown type.
+        """
+        if indexes_root is None:
+            indexes_root = make_list(SDB_TAGS.TAG_INDEXES)
+        if header is None:
+            header = DEFAULT_HEADER
+
+        offset = SDB_HEADER_SIZE
+        offset += self._layout(indexes_root, offset)
+        offset += self._layout(database_root, offset)
+
+        out = _BufferedOutput(f, buffer_size=self._buffer_size)
+        out.write(_pack_header(header.unknown0, header.unknown1, header.magic))
+        self._emit(out, indexes_root)
+        self._emit(out, database_root)
+
+        out.write(_pack_dword(SDB_TAGS.TAG_STRINGTABLE, self._strtab_size))
+        for data in self._string_data:
+            out.write(_pack_dword(SDB_TAGS.TAG_STRINGTABLE_ITEM, len(data)))
+            out.write(data)
+        out.flush()
+        return out.offset
+
+
+def write_sdb(db, f, strings=None, compact_strings=False):
+    """
+    serialize a database parsed by the fast, lazy, or columnar engines.
+
+    Args:
+      db (Union[sdb.FastSDB, sdb.LazySDB, sdb.SDBNodeStore]): the database.
+      f (file): the writable binary file.
+      strings (sdb.SDBStringTable): the string table of the database, if already loaded.
+      compact_strings (bool): when True, drop unreferenced strings and order the string
+        table by first use, rather than keeping the order of the source string table.
+
+    Returns:
+      int: the number of bytes written.
+    """
+    if strings is None:
+        strings = SDBStringTable.from_buffer(db.buffer, db.strtab_root.offset)
+    writer = SDBWriter(strings=strings)
+    if not compact_strings:
+        writer.intern_source_strings()
+    return writer.write(f, db.database_root, indexes_root=db.indexes_root, header=db.header)
@@ -23,8 +23,14 @@ setup(
     license='Apache License 2.0',
     install_requires=[
         "hexdump",
-        "vivisect-vstruct-wb>=1.0.3"
+        "vivisect-vstruct-wb>=1.0.3",
+        # the backport of `concurrent.futures`, used by `sdb_batch_scan.py`
+        'futures; python_version < "3"',
     ],
+    extras_require={
+        # needed by `sdb.BulkMatcher`
+        "bulk": ["numpy"],
+    },
     packages=find_packages(exclude=['*.tests','*.tests.*']),
     entry_points={
         "console_scripts": [
@@ -32,6 +38,14 @@ setup(
             "sdb_dump_raw=scripts.sdb_dump_raw:main",
             "sdb_dump_shims=scripts.sdb_dump_shims:main",
             "sdb_dump_info=scripts.sdb_dump_info:main",
+            "sdb_batch_scan=scripts.sdb_batch_scan:main",
+            "sdb_diff=scripts.sdb_diff:main",
+            "sdb_query=scripts.sdb_query:main",
+            "sdb_benchmark=scripts.sdb_benchmark:main",
+            "sdb_daemon=scripts.sdb_daemon:main",
+            "sdb_export_sqlite=scripts.sdb_export_sqlite:main",
+            "sdb_search_strings=scripts.sdb_search_strings:main",
+            "sdb_ref_graph=scripts.sdb_ref_graph:main",
         ]
       },
 
@@ -0,0 +1,135 @@
+"""
+check that `sdb.BulkMatcher` finds the same EXEs as `sdb.SDBMatcher`.
+"""
+import io
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import sdb
+from sdb import SDB_TAGS
+from sdb.writer import make_item
+from sdb.writer import make_list
+
+
+def _file(name, *criteria):
+    return make_list(SDB_TAGS.TAG_MATCHING_FILE, [make_item(SDB_TAGS.TAG_NAME, name)] + list(criteria))
+
+
+def _exe(name, *matching_files):
+    return make_list(SDB_TAGS.TAG_EXE, [make_item(SDB_TAGS.TAG_NAME, name)] + list(matching_files))
+
+
+def make_numeric_sdb():
+    """
+    a database of EXEs with a mix of numeric, negated, string, and other-file criteria.
+    """
+    size = lambda v: make_item(SDB_TAGS.TAG_SIZE, v)
+    checksum = lambda v: make_item(SDB_TAGS.TAG_CHECKSUM, v)
+    version = lambda v: make_item(SDB_TAGS.TAG_BIN_FILE_VERSION, v)
+    upto = lambda v: make_item(SDB_TAGS.TAG_UPTO_BIN_FILE_VERSION, v)
+    company = lambda v: make_item(SDB_TAGS.TAG_COMPANY_NAME, v)
+    negate = lambda: make_item(SDB_TAGS.TAG_MATCH_LOGIC_NOT)
+
+    exes = [
+        _exe(u"a.exe", _file(u"*", size(100), checksum(1))),
+        _exe(u"a.exe", _file(u"*", version(0x0001000200030004))),
+        _exe(u"a.exe", _file(u"*", version(0x0001FFFFFFFFFFFF), upto(0x0001000500000000))),
+        _exe(u"b.exe", _file(u"*", size(200), negate())),
+        _exe(u"b.exe", _file(u"*", size(200)), _file(u"b.exe", checksum(2))),
+        _exe(u"c.exe", _file(u"*", size(300), company(u"Vendor*"))),
+        _exe(u"c.exe", _file(u"*", size(300), company(u"Vendor 1"), negate())),
+        _exe(u"c.exe", _file(u"*", size(300)), _file(u"other.dll", size(1))),
+        _exe(u"c.exe", _file(u"*", size(300)), _file(u"other.dll", size(1), negate())),
+        _exe(u"?.exe", _file(u"*", size(100)), _file(u"d.exe", checksum(4))),
+        _exe(u"d.exe"),
+    ]
+    f = io.BytesIO()
+    sdb.SDBWriter().write(f, make_list(SDB_TAGS.TAG_DATABASE, exes))
+    return sdb.parse_sdb(f.getvalue())
+
+
+def make_inventory(rng, count):
+    return {
+        "NAME": [u"C:\\app\\" + rng.choice([u"a.exe", u"B.exe", u"c.exe", u"d.exe", u"e.exe"])
+                 for _ in range(count)],
+        "SIZE": np.ma.masked_array([rng.choice([100, 200, 300, 301]) for _ in range(count)],
+                                   mask=[rng.random() < 0.1 for _ in range(count)]),
+        "CHECKSUM": [rng.choice([1, 2, 4]) for _ in range(count)],
+        "BIN_FILE_VERSION": [rng.choice([0x0001000200030004, 0x0001000500000000, 0x0001000500000001])
+                             for _ in range(count)],
+        "COMPANY_NAME": [rng.choice([u"Vendor 1", u"vendor 2", u"Other"]) for _ in range(count)],
+    }
+
+
+def get_row(columns, row):
+    attributes = {}
+    for key, column in columns.items():
+        if np.ma.isMaskedArray(column):
+            if column.mask[row]:
+                continue
+            attributes[key] = int(column.data[row])
+        else:
+            attributes[key] = column[row]
+    return attributes
+
+
+def assert_same_matches(db, columns):
+    bulk = sdb.BulkMatcher(db)
+    matches = bulk.match_batch(columns)
+    found = sorted(zip(matches.rows.tolist(), matches.exe_indices.tolist()))
+
+    matcher = sdb.SDBMatcher(db)
+    indices = dict((exe.offset, i) for i, exe in enumerate(bulk.exes))
+    expected = []
+    for row, path in enumerate(columns["NAME"]):
+        for exe in matcher.match(path, dict((k, v) for k, v in get_row(columns, row).items() if k != "NAME")):
+            expected.append((row, indices[exe.offset]))
+    assert found == sorted(expected)
+    return bulk, found
+
+
+def test_numeric_rules():
+    db = make_numeric_sdb()
+    bulk, found = assert_same_matches(db, make_inventory(random.Random(0), 500))
+    # the EXEs with only numeric criteria on the program take the vectorized path alone
+    assert bulk._exact[:5].all() and bulk._exact[10]
+    assert not bulk._exact[5:10].any()
+    assert found
+
+
+def test_synthetic():
+    f = io.BytesIO()
+    sdb.generate_sdb(f, exes=50, matching_files=1, seed=1)
+    db = sdb.parse_sdb(f.getvalue())
+    bulk = sdb.BulkMatcher(db)
+    # each EXE gets a rule for its MATCHING_FILE on the program, used as a prefilter
+    assert len(bulk._negated) == len(bulk.exes)
+
+    matcher = sdb.SDBMatcher(db)
+    rows = []
+    for exe in bulk.exes:
+        name = matcher.get_value(exe.get_child(SDB_TAGS.TAG_NAME))
+        matching_file = next(exe.get_children(SDB_TAGS.TAG_MATCHING_FILE))
+        attributes = dict((c.tag, matcher.get_value(c)) for c in matching_file.children
+                          if c.tag != SDB_TAGS.TAG_NAME)
+        attributes.pop(SDB_TAGS.TAG_UPTO_BIN_FILE_VERSION, None)
+        rows.append((name, attributes))
+        resized = dict(attributes)
+        resized[SDB_TAGS.TAG_SIZE] += 1
+        rows.append((name, resized))
+
+    columns = {"NAME": [name for name, _ in rows]}
+    for tag in (SDB_TAGS.TAG_SIZE, SDB_TAGS.TAG_CHECKSUM, SDB_TAGS.TAG_BIN_FILE_VERSION,
+                SDB_TAGS.TAG_LINK_DATE, SDB_TAGS.TAG_COMPANY_NAME):
+        columns[tag] = [attributes[tag] for _, attributes in rows]
+
+    found = bulk.match_batch(columns)
+    expected = []
+    for row, (name, attributes) in enumerate(rows):
+        for exe in matcher.match(name, attributes):
+            expected.append((row, bulk.exes.index(exe)))
+    assert expected
+    assert sorted(zip(found.rows.tolist(), found.exe_indices.tolist())) == sorted(expected)